@@ -0,0 +1,232 @@
+# === Benchmark Macan AI Chat ===
+# Mengukur jalur-jalur yang sensitif terhadap ukuran riwayat tanpa jaringan dan tanpa layar (Qt offscreen):
+# pemuatan riwayat (indeks dingin/hangat), pembukaan percakapan, pencarian log (kata kunci dan semantik), throughput log_chat,
+# serta biaya render streaming dan time-to-first-paint memakai worker tiruan dengan laju chunk terkontrol.
+#
+#   python bench_macan_chat_ai.py --sizes 1000,10000,100000 --output bench.json
+#
+# Hasil berupa JSON (stdout atau --output) agar dua run bisa dibandingkan.
+import os
+import sys
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import time
+import json
+import random
+import argparse
+import tempfile
+import platform
+import threading
+from datetime import datetime, timedelta
+
+from PySide6.QtCore import QObject, Signal, QEventLoop, qVersion
+from PySide6.QtWidgets import QApplication
+
+import macan_chat_ai as app_module
+
+WORDS = ("kucing anjing harimau macan gajah burung ikan sungai gunung laut hutan kota desa jalan rumah sekolah "
+         "komputer jaringan data model bahasa python program fungsi kelas modul indeks pencarian kecepatan").split()
+SEARCH_QUERIES = ["kucing", "macan gajah", '"model bahasa"', "kecep*", "kata_yang_tidak_ada"]
+
+def percentiles(samples):
+    if not samples: return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+    return {"n": len(ordered), "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3), "p50_ms": round(pick(0.5) * 1000, 3),
+            "p95_ms": round(pick(0.95) * 1000, 3), "max_ms": round(ordered[-1] * 1000, 3)}
+
+def timed(fn, *args):
+    start = time.perf_counter(); result = fn(*args)
+    return time.perf_counter() - start, result
+
+# Mengalihkan semua file aplikasi (log, indeks, konfigurasi, cache) ke direktori sementara
+def use_data_dir(path):
+    for name in dir(app_module):
+        if (name.endswith("_PATH") or name.endswith("_DIR")) and name != "BASE_PATH":
+            setattr(app_module, name, os.path.join(path, os.path.basename(getattr(app_module, name))))
+
+def generate_log(path, records, per_conversation, seed=0):
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(minutes=records // per_conversation + 1) # Baru, agar tidak memicu rotasi berdasarkan umur
+    with open(path, 'w', encoding='utf-8') as f:
+        for n in range(records):
+            conv = n // per_conversation; turn = n % per_conversation
+            role = "user" if turn % 2 == 0 else "assistant"
+            text = " ".join(rng.choices(WORDS, k=rng.randint(8, 40)))
+            content = [{"type": "text", "text": text}] if role == "user" else text
+            ts = (start + timedelta(minutes=conv, seconds=turn)).strftime("%Y-%m-%d %H:%M:%S")
+            f.write(json.dumps({"role": role, "content": content, "conversation_id": f"bench{conv:08d}", "timestamp": ts}) + "\n")
+
+# Worker tiruan dengan antarmuka yang sama seperti GeminiWorker/OpenAIWorker
+class StubWorker(QObject):
+    finished = Signal(str)
+    chunk_received = Signal(str)
+    error = Signal(str)
+    cancelled = Signal(str)
+
+    def __init__(self, chunks, chunk_chars, interval_s):
+        super().__init__()
+        self.chunks = chunks; self.chunk_chars = chunk_chars; self.interval_s = interval_s
+        self.cache_status = None
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        parts = []
+        for i in range(self.chunks):
+            if self.cancel_event.is_set():
+                self.cancelled.emit("".join(parts)); return
+            if self.interval_s: time.sleep(self.interval_s)
+            chunk = (WORDS[i % len(WORDS)] + " ") * max(1, self.chunk_chars // 8)
+            parts.append(chunk); self.chunk_received.emit(chunk)
+        self.finished.emit("".join(parts))
+
+class _HistoryItem:
+    def __init__(self, conversation_id): self.conversation_id = conversation_id
+    def data(self, role): return self.conversation_id
+
+def make_window():
+    window = app_module.MacanAIChat()
+    window.check_active_api_key = lambda: True
+    window.resize(1000, 760)
+    return window
+
+def pump(qapp, until, timeout_s):
+    deadline = time.monotonic() + timeout_s
+    while not until() and time.monotonic() < deadline:
+        qapp.processEvents(QEventLoop.ProcessEventsFlag.AllEvents, 10)
+
+def bench_size(qapp, records, args):
+    result = {"records": records}
+    data_dir = tempfile.mkdtemp(prefix=f"macan_bench_{records}_")
+    use_data_dir(data_dir)
+    result["generate_s"] = round(timed(generate_log, app_module.LOG_PATH, records, args.per_conversation)[0], 3)
+    result["log_bytes"] = os.path.getsize(app_module.LOG_PATH)
+
+    # Pemuatan riwayat: indeks dibangun dari nol, lalu dibuka ulang dengan indeks yang sudah ada
+    for phase in ("history_cold", "history_warm"):
+        init_s, window = timed(make_window)
+        index_s, _ = timed(window.log_index.ensure_fresh)
+        page_s, _ = timed(window.on_history_loaded)
+        result[phase] = {"window_init_ms": round(init_s * 1000, 3), "index_ms": round(index_s * 1000, 3),
+                         "first_page_ms": round(page_s * 1000, 3), "rows": window.history_model.rowCount()}
+        if phase == "history_cold": window.close(); window.deleteLater(); qapp.processEvents()
+
+    model = window.history_model
+    page_samples = []
+    while model.canFetchMore() and len(page_samples) < args.pages:
+        page_samples.append(timed(model.fetchMore)[0])
+    result["sidebar_fetch_more"] = percentiles(page_samples)
+
+    rng = random.Random(1)
+    conversations = max(1, records // args.per_conversation)
+    load_samples = []
+    for _ in range(args.samples):
+        item = _HistoryItem(f"bench{rng.randrange(conversations):08d}")
+        load_samples.append(timed(window.load_conversation_from_history, item)[0])
+    result["load_conversation"] = percentiles(load_samples)
+
+    # Pencarian log: halaman pertama dari indeks, dan waktu sampai halaman pertama tampil di dialog (worker latar)
+    result["search"] = {}
+    for query in SEARCH_QUERIES:
+        raw_s, hits = timed(window.log_index.search, query, app_module.SEARCH_PAGE_SIZE, 0, app_module.SEARCH_SNIPPET_TOKENS)
+        start = time.perf_counter()
+        dialog = window.perform_log_search(query)
+        open_s = time.perf_counter() - start
+        pump(qapp, lambda: dialog.model.rowCount() > 0 or dialog.model.exhausted, 30)
+        first_page_s = time.perf_counter() - start
+        result["search"][query] = {"total": window.log_index.search_count(query), "first_page_hits": len(hits), "index_ms": round(raw_s * 1000, 3),
+                                   "dialog_open_ms": round(open_s * 1000, 3), "first_page_ms": round(first_page_s * 1000, 3)}
+        dialog.close(); qapp.processEvents()
+
+    if window.semantic_index is not None: # Indeks semantik: pembangunan penuh lalu query top-k
+        build_s, added = timed(window.semantic_index.sync, window.log_index)
+        query_samples = [timed(window.semantic_index.search, query, app_module.SEMANTIC_RESULT_LIMIT)[0] for query in SEARCH_QUERIES * 4]
+        result["semantic"] = {"vectors": added, "build_ms": round(build_s * 1000, 3), "query": percentiles(query_samples)}
+
+    window.start_new_chat()
+    enqueue_s, _ = timed(lambda: [window.log_chat({"role": "user", "content": f"throughput {i} kucing"}) for i in range(args.log_writes)])
+    flush_s, _ = timed(window.log_writer.flush, 60)
+    result["log_chat"] = {"writes": args.log_writes, "enqueue_ms": round(enqueue_s * 1000, 3), "flush_ms": round(flush_s * 1000, 3),
+                          "records_per_s": round(args.log_writes / max(enqueue_s + flush_s, 1e-9), 1)}
+    window.close(); window.deleteLater(); qapp.processEvents()
+    return result
+
+def bench_streaming(qapp, args):
+    use_data_dir(tempfile.mkdtemp(prefix="macan_bench_stream_"))
+    stats = {"paint_s": 0.0, "paints": 0, "first_paint": None, "sink_s": 0.0, "sinks": 0, "chunk_s": 0.0, "chunks": 0}
+    window = make_window(); window.show(); qapp.processEvents()
+
+    # Delegate pengukur dipasang sebagai delegate transkrip (bukan menambal BubbleDelegate.paint)
+    class TimingDelegate(app_module.BubbleDelegate):
+        def paint(self, painter, option, index):
+            start = time.perf_counter(); super().paint(painter, option, index)
+            stats["paint_s"] += time.perf_counter() - start; stats["paints"] += 1
+            if stats["first_paint"] is None and index.row() == window.session.bot_row and index.data(): stats["first_paint"] = time.perf_counter()
+    window.transcript_delegate = TimingDelegate(window)
+    window.transcript_view.setItemDelegate(window.transcript_delegate)
+
+    stream_buffer = window.session.stream_buffer
+    original_sink = stream_buffer.sink
+    def sink(text):
+        start = time.perf_counter(); original_sink(text)
+        stats["sink_s"] += time.perf_counter() - start; stats["sinks"] += 1
+    stream_buffer.sink = sink
+
+    # Penanganan chunk di thread GUI (ConversationSession.on_chunk -> StreamRenderBuffer.feed)
+    original_feed = stream_buffer.feed
+    def feed(chunk):
+        start = time.perf_counter(); original_feed(chunk)
+        stats["chunk_s"] += time.perf_counter() - start; stats["chunks"] += 1
+    stream_buffer.feed = feed
+    window.create_worker = lambda *_: StubWorker(args.chunks, args.chunk_chars, args.chunk_interval_ms / 1000.0)
+
+    window.inputPrompt.setText("Ceritakan tentang macan.")
+    started = time.perf_counter()
+    window.sendPrompt()
+    pump(qapp, lambda: window.session.job_id is None, args.timeout)
+    total_s = time.perf_counter() - started
+    qapp.processEvents()
+    window.log_writer.flush(10)
+    window.close(); window.deleteLater(); qapp.processEvents()
+    return {"chunks": args.chunks, "chunk_chars": args.chunk_chars, "chunk_interval_ms": args.chunk_interval_ms,
+            "completed": stats["chunks"] == args.chunks,
+            "time_to_first_paint_ms": round((stats["first_paint"] - started) * 1000, 3) if stats["first_paint"] else None,
+            "stream_total_ms": round(total_s * 1000, 3),
+            "chunk_handling_ms": round(stats["chunk_s"] * 1000, 3),
+            "render_flushes": stats["sinks"], "render_flush_ms": round(stats["sink_s"] * 1000, 3),
+            "paints": stats["paints"], "paint_ms": round(stats["paint_s"] * 1000, 3),
+            "flushes_per_s": round(stats["sinks"] / max(total_s, 1e-9), 1)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline untuk Macan AI Chat")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Jumlah catatan log sintetis, dipisah koma (mis. 1000,1000000)")
+    parser.add_argument("--per-conversation", type=int, default=10, help="Pesan per percakapan sintetis")
+    parser.add_argument("--samples", type=int, default=50, help="Jumlah percakapan acak yang dibuka")
+    parser.add_argument("--pages", type=int, default=20, help="Maksimum halaman sidebar yang diambil")
+    parser.add_argument("--log-writes", type=int, default=2000, help="Jumlah panggilan log_chat untuk uji throughput")
+    parser.add_argument("--chunks", type=int, default=400, help="Jumlah chunk dari worker tiruan")
+    parser.add_argument("--chunk-chars", type=int, default=40)
+    parser.add_argument("--chunk-interval-ms", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Batas waktu streaming (detik)")
+    parser.add_argument("--output", help="File tujuan hasil JSON (default: stdout)")
+    args = parser.parse_args(argv)
+
+    qapp = QApplication.instance() or QApplication(sys.argv[:1])
+    results = {"meta": {"timestamp": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                        "qt": qVersion(), "platform": platform.platform(), "args": vars(args)}}
+    results["streaming"] = bench_streaming(qapp, args)
+    results["sizes"] = {}
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"[bench] {size} catatan...", file=sys.stderr)
+        results["sizes"][str(size)] = bench_size(qapp, size, args)
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,260 +1,3132 @@
 # nama file: macan_chat_ai.py (Upgrade ke Google Gemini & OpenAI API)
+import time
+_MODULE_START = time.perf_counter() # Titik nol pengukuran waktu startup
 import sys
 import os
 import json
 import csv
-import requests
+import importlib
+import importlib.util
 from datetime import datetime
 import threading
+import queue
 import base64
-from PySide6.QtCore import QBuffer
+import io
+import hashlib
+import zlib
+import unicodedata
+import sqlite3
+import gzip
+import shutil
+from collections import OrderedDict, deque
+import re
+import html
+import random
+import math
+import array
+import operator
+import mmap
+import argparse
+import concurrent.futures
+import itertools
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QLineEdit, QPushButton, QScrollArea, QSizePolicy, QMessageBox,
-    QInputDialog, QListWidget, QListWidgetItem, QDialog, QTextEdit,
-    QMenu, QFileDialog, QMenuBar
+    QLabel, QLineEdit, QPushButton, QSizePolicy, QMessageBox,
+    QInputDialog, QDialog, QTextBrowser,
+    QMenu, QFileDialog, QMenuBar, QListView, QStyledItemDelegate, QAbstractItemView, QStyle
 )
-from PySide6.QtCore import Qt, QObject, QThread, Signal, QUrl, QByteArray, QTimer
-from PySide6.QtGui import QDesktopServices, QIcon, QPixmap, QPainter, QAction, QFont
+from PySide6.QtCore import (
+    Qt, QObject, Signal, QUrl, QByteArray, QTimer, QAbstractListModel, QModelIndex, QRect, QSize,
+    QRunnable, QThreadPool, QBuffer
+)
+from PySide6.QtGui import QDesktopServices, QIcon, QPixmap, QPainter, QAction, QActionGroup, QFont, QColor, QImage, QImageReader, QTextDocument
 from PySide6.QtSvg import QSvgRenderer
 
+# --- OPTIMISASI: Pengukuran waktu startup per fase (tampilkan dengan --startup-timing) ---
+class StartupTimer:
+    def __init__(self, origin):
+        self.last = origin; self.origin = origin
+        self.phases = {} # nama fase -> ms
+        self.imports = {} # modul yang diimpor secara malas -> ms
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self.last) * 1000, 2); self.last = now
+
+    def record_import(self, module_name, seconds):
+        self.imports[module_name] = round(seconds * 1000, 2)
+
+    def as_dict(self):
+        return {"phases_ms": dict(self.phases), "lazy_imports_ms": dict(self.imports),
+                "total_ms": round((self.last - self.origin) * 1000, 2)}
+
+STARTUP_TIMER = StartupTimer(_MODULE_START)
+STARTUP_TIMER.mark("import_qt")
+
+# --- OPTIMISASI: SDK provider, PIL, TTS dan speech recognition baru diimpor saat pertama kali dipakai ---
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            start = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            STARTUP_TIMER.record_import(self._name, time.perf_counter() - start)
+        return getattr(self._module, attr)
+
+def module_available(name):
+    try: return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError): return False
+
 # --- Integrasi API ---
-try:
-    import google.generativeai as genai
-    from PIL import Image
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+genai = LazyModule("google.generativeai")
+openai = LazyModule("openai")
+Image = LazyModule("PIL.Image")
+ImageOps = LazyModule("PIL.ImageOps")
+pyttsx3 = LazyModule("pyttsx3")
+sr = LazyModule("speech_recognition")
+np = LazyModule("numpy")
+
+PIL_AVAILABLE = module_available("PIL")
+GEMINI_AVAILABLE = module_available("google.generativeai") and PIL_AVAILABLE
+OPENAI_AVAILABLE = module_available("openai")
+SPEECH_RECOGNITION_AVAILABLE = module_available("speech_recognition")
+NUMPY_AVAILABLE = module_available("numpy")
 # -----------------------------
 
-import pyttsx3
+# Shortcut enum
+Expanding = QSizePolicy.Policy.Expanding
+
+# === Path Konfigurasi ===
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(BASE_PATH, "macan_ai_config.json")
+LOG_PATH = os.path.join(BASE_PATH, "macan_ai_chatlog.jsonl")
+LOG_INDEX_PATH = os.path.join(BASE_PATH, "macan_ai_chatlog.idx.sqlite")
+LOG_SEGMENT_DIR = os.path.join(BASE_PATH, "chatlog_segments")
+LOG_TOMBSTONE_PATH = os.path.join(BASE_PATH, "macan_ai_chatlog.deleted.json")
+THUMBNAIL_DIR = os.path.join(BASE_PATH, "thumbnails")
+IMAGE_CACHE_DIR = os.path.join(BASE_PATH, "image_cache")
+RESPONSE_CACHE_PATH = os.path.join(BASE_PATH, "macan_ai_response_cache.sqlite")
+METRICS_PATH = os.path.join(BASE_PATH, "macan_ai_metrics.jsonl")
+METRICS_PROM_PATH = os.path.join(BASE_PATH, "macan_ai_metrics.prom")
+SEMANTIC_INDEX_PATH = os.path.join(BASE_PATH, "macan_ai_semantic.sqlite")
+SEMANTIC_VECTORS_PATH = os.path.join(BASE_PATH, "macan_ai_semantic.f32")
+SEMANTIC_RESULT_LIMIT = 30
+SEARCH_PAGE_SIZE = 100 # Hasil pencarian log dimuat per halaman saat daftar digulir
+TRANSCRIPT_BATCH_SIZE = 50 # Baris transkrip yang diukur per langkah tata letak
+SEARCH_SNIPPET_TOKENS = 32 # Panjang potongan teks di sekitar kata yang cocok
+
+if not os.path.exists(LOG_PATH):
+    open(LOG_PATH, 'w').close()
+
+def load_config(path):
+    if not os.path.exists(path):
+        # --- OPTIMISASI: Mengganti model default OpenAI ke gpt-4o-mini ---
+        default_config = {
+            "active_api": "gemini",
+            "gemini": {
+                "api_key": "",
+                "model": "gemini-1.5-flash-latest",
+                "generation_config": {
+                    "temperature": 0.9,
+                    "top_p": 1,
+                    "top_k": 1,
+                    "max_output_tokens": 2048
+                }
+            },
+            "openai": {
+                "api_key": "",
+                "model": "gpt-4o-mini"
+                }
+            }
+        
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(default_config, f, indent=4)
+        return default_config
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_config(path, config_data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config_data, f, indent=4)
+
+# === SVG Icons (Tidak Berubah) ===
+SVG_USER_ICON = """
+<svg width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="#60d060" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
+  <path d="M20 21v-2a4 4 0 0 0-4-4H8a4 4 0 0 0-4 4v2"></path>
+  <circle cx="12" cy="7" r="4"></circle>
+</svg>
+"""
+SVG_BOT_ICON = """
+<svg width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="#60d060" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
+  <path d="M12 12V3"></path>
+  <path d="M18 10h-2"></path>
+  <path d="M8 10H6"></path>
+  <path d="M2 16c0 1.1.9 2 2 2h16a2 2 0 0 0 2-2V8a2 2 0 0 0-2-2H4a2 2 0 0 0-2 2v8z"></path>
+  <path d="M7 21h10"></path>
+</svg>
+"""
+
+# --- OPTIMISASI: Cache ikon/pixmap SVG untuk seluruh aplikasi, kunci (svg, ukuran, device pixel ratio) ---
+# Setiap ikon berbeda hanya dirasterisasi sekali; QIcon/QPixmap di-share secara implisit oleh Qt.
+_SVG_PIXMAP_CACHE = {}
+_SVG_ICON_CACHE = {}
+
+def _default_device_pixel_ratio():
+    app = QApplication.instance()
+    return app.devicePixelRatio() if app is not None else 1.0
+
+def get_svg_pixmap(svg_string, size=18, device_pixel_ratio=None):
+    dpr = device_pixel_ratio or _default_device_pixel_ratio()
+    key = (svg_string, size, dpr)
+    pixmap = _SVG_PIXMAP_CACHE.get(key)
+    if pixmap is None:
+        renderer = QSvgRenderer(QByteArray(svg_string.encode('utf-8')))
+        pixmap = QPixmap(round(size * dpr), round(size * dpr))
+        pixmap.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(pixmap)
+        renderer.render(painter)
+        painter.end()
+        pixmap.setDevicePixelRatio(dpr)
+        _SVG_PIXMAP_CACHE[key] = pixmap
+    return pixmap
+
+def get_svg_icon(svg_string, size=18):
+    key = (svg_string, size, _default_device_pixel_ratio())
+    icon = _SVG_ICON_CACHE.get(key)
+    if icon is None:
+        icon = _SVG_ICON_CACHE[key] = QIcon(get_svg_pixmap(svg_string, size, key[2]))
+    return icon
+
+def get_display_text(content):
+    if isinstance(content, list):
+        return next((p.get("text", "") for p in content if p.get("type") == "text"), "[Gambar]" if any(p.get("type") != "file_ref" for p in content) else "[File]")
+    return content or ""
+
+def get_all_text(content):
+    if isinstance(content, list):
+        return "\n".join(p.get("text", "") for p in content if p.get("type") == "text")
+    return content or ""
+
+# --- OPTIMISASI: Terjemahkan kata kunci pengguna ke sintaks FTS5 ---
+# kata -> "kata", kata* -> "kata"* (prefix), "dua kata" -> frasa, OR tetap operator; selain itu AND.
+def build_fts_query(query):
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', query):
+        if phrase.strip():
+            terms.append('"' + phrase.replace('"', '""') + '"')
+        elif word == "OR":
+            if terms and terms[-1] != "OR": terms.append("OR")
+        elif word:
+            is_prefix = word.endswith('*'); word = word.rstrip('*').replace('"', '""')
+            if word: terms.append(f'"{word}"' + ('*' if is_prefix else ''))
+    while terms and terms[-1] == "OR": terms.pop()
+    return " ".join(terms)
+
+# === Indeks Log Chat ===
+# --- OPTIMISASI: Indeks sidecar (SQLite) yang memetakan conversation_id ke offset byte di log ---
+# Indeks diperbarui per baris oleh log_chat, diperbarui dari ekor file jika log bertambah di luar aplikasi,
+# dan dibangun ulang otomatis jika log diganti/terpotong atau file indeks rusak.
+# --- OPTIMISASI: Log disimpan bersegmen. LOG_PATH adalah segmen aktif (segmen 0); segmen lama dipindah ke
+# LOG_SEGMENT_DIR sebagai macan_ai_chatlog.NNNNNN.jsonl lalu dikompres gzip, tetap terbaca lewat indeks yang sama.
+# Percakapan yang dihapus dicatat di file tombstone dan dibuang secara fisik saat kompaksi.
+DEFAULT_LOG_STORAGE_SETTINGS = {
+    "segment_max_mb": 16, # Rotasi jika segmen aktif melebihi ukuran ini
+    "segment_max_days": 30 # ...atau jika pesan pertamanya lebih tua dari ini (0 = nonaktif)
+}
+
+class ChatLogIndex:
+    SCHEMA_VERSION = "4"
+    HEAD_BYTES = 4096
+    ACTIVE_SEGMENT = 0
+    SUMMARY_CHARS = 120 # Ringkasan percakapan hanya menyimpan awal teks pertama
+
+    def __init__(self, log_path, index_path, segment_dir=None, tombstone_path=None, settings=None):
+        self.log_path = log_path
+        self.index_path = index_path
+        self.segment_dir = segment_dir or os.path.dirname(os.path.abspath(log_path))
+        self.tombstone_path = tombstone_path or log_path + ".deleted.json"
+        self.settings = dict(DEFAULT_LOG_STORAGE_SETTINGS, **(settings or {}))
+        self.segment_prefix = os.path.splitext(os.path.basename(log_path))[0]
+        self.segment_pattern = re.compile(rf"^{re.escape(self.segment_prefix)}\.(\d{{6}})\.jsonl(\.gz)?$")
+        self.lock = threading.RLock()
+        self.compaction_lock = threading.Lock()
+        self.conn = None
+        self.fts_available = False
+        self.active_first_ts = None
+        self.deleted = self._load_tombstones()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY, first_text TEXT, timestamp TEXT, message_count INTEGER);
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT, segment INTEGER, offset INTEGER, length INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_records_conv ON records(conversation_id, segment, offset);
+            CREATE INDEX IF NOT EXISTS idx_records_segment ON records(segment);
+            CREATE INDEX IF NOT EXISTS idx_conversations_ts ON conversations(timestamp, conversation_id);
+        """)
+        # --- OPTIMISASI: Indeks teks penuh (FTS5) atas semua bagian teks setiap pesan ---
+        try:
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    text, conversation_id UNINDEXED, role UNINDEXED, timestamp UNINDEXED, segment UNINDEXED, record_offset UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2')
+            """)
+            self.fts_available = True
+        except sqlite3.OperationalError:
+            self.fts_available = False # SQLite tanpa FTS5: pencarian jatuh ke pemindaian log
+        return conn
+
+    def _open(self):
+        if self.conn is not None: return self.conn
+        try:
+            self.conn = self._connect()
+            self.conn.execute("SELECT COUNT(*) FROM meta").fetchone()
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(records)")]
+            if "segment" not in columns or "id" not in columns: raise sqlite3.DatabaseError("skema indeks lama")
+        except sqlite3.DatabaseError:
+            self._discard()
+            self.conn = self._connect()
+        return self.conn
+
+    def _discard(self):
+        if self.conn is not None:
+            try: self.conn.close()
+            except sqlite3.Error: pass
+        self.conn = None
+        if os.path.exists(self.index_path): os.remove(self.index_path)
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _head_hash(self, length):
+        if not os.path.exists(self.log_path): return hashlib.sha1(b"").hexdigest()
+        with open(self.log_path, 'rb') as f: head = f.read(min(length, self.HEAD_BYTES))
+        return hashlib.sha1(head).hexdigest()
+
+    # --- Segmen ---
+    def archived_segments(self):
+        try: names = os.listdir(self.segment_dir)
+        except OSError: return []
+        return sorted({int(m.group(1)) for m in map(self.segment_pattern.match, names) if m})
+
+    def segment_path(self, number):
+        if number == self.ACTIVE_SEGMENT: return self.log_path
+        plain = os.path.join(self.segment_dir, f"{self.segment_prefix}.{number:06d}.jsonl")
+        return plain + ".gz" if os.path.exists(plain + ".gz") else plain
+
+    @staticmethod
+    def _open_segment(path):
+        return gzip.open(path, 'rb') if path.endswith(".gz") else open(path, 'rb')
+
+    # Menghasilkan (offset, baris) untuk setiap baris lengkap; offset gzip dihitung pada data yang sudah didekompresi
+    def _iter_lines(self, number, start_offset=0):
+        path = self.segment_path(number)
+        if not os.path.exists(path): return
+        with self._open_segment(path) as f:
+            if start_offset: f.seek(start_offset)
+            offset = start_offset
+            for line in f:
+                if not line.endswith(b'\n'): break # Baris terakhir belum selesai ditulis
+                yield offset, line
+                offset += len(line)
+
+    @staticmethod
+    def _parse_record(line):
+        try: entry = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError): return None
+        return entry if isinstance(entry, dict) and entry.get("conversation_id") and entry.get("role") else None
+
+    # Semua catatan valid di seluruh segmen, dari yang tertua: (segmen, offset, entri)
+    def iter_records(self):
+        for number in self.archived_segments() + [self.ACTIVE_SEGMENT]:
+            for offset, line in self._iter_lines(number):
+                entry = self._parse_record(line)
+                if entry is not None and entry["conversation_id"] not in self.deleted: yield number, offset, entry
+
+    def _segments_signature(self):
+        return json.dumps(self.archived_segments())
+
+    def ensure_fresh(self):
+        with self.lock:
+            try:
+                self._ensure_fresh()
+            except sqlite3.DatabaseError:
+                # File indeks rusak: buang dan bangun ulang dari log
+                self._discard(); self._open(); self._rebuild()
+
+    def _ensure_fresh(self):
+        self._open()
+        log_size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        indexed_size = int(self._get_meta("log_size", -1))
+        if self._get_meta("version") != self.SCHEMA_VERSION or self._get_meta("segments") != self._segments_signature() \
+                or indexed_size < 0 or indexed_size > log_size or self._get_meta("head_hash") != self._head_hash(indexed_size):
+            self._rebuild()
+        elif indexed_size < log_size:
+            self._index_from(indexed_size)
+
+    def _rebuild(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM records"); self.conn.execute("DELETE FROM conversations")
+            if self.fts_available: self.conn.execute("DELETE FROM messages_fts")
+            self._set_meta("version", self.SCHEMA_VERSION); self._set_meta("generation", os.urandom(8).hex())
+            self._set_meta("log_size", 0); self._set_meta("head_hash", self._head_hash(0))
+            for number in self.archived_segments(): self._index_segment(number)
+            self._set_meta("segments", self._segments_signature())
+        self._index_from(0)
+
+    def _index_segment(self, number, start_offset=0, update_conversations=True):
+        records = []
+        end_offset = start_offset
+        for offset, line in self._iter_lines(number, start_offset):
+            entry = self._parse_record(line)
+            if entry is not None and entry["conversation_id"] not in self.deleted: records.append((entry, offset, len(line)))
+            end_offset = offset + len(line)
+        self._insert_records(records, number, update_conversations)
+        return end_offset
+
+    def _index_from(self, start_offset):
+        with self.conn:
+            offset = self._index_segment(self.ACTIVE_SEGMENT, start_offset)
+            self._set_meta("log_size", offset); self._set_meta("head_hash", self._head_hash(offset))
+
+    def _insert_records(self, records, segment, update_conversations=True):
+        self.conn.executemany("INSERT INTO records (conversation_id, segment, offset, length) VALUES (?, ?, ?, ?)",
+                              [(entry["conversation_id"], segment, offset, length) for entry, offset, length in records])
+        self._insert_fts(records, segment)
+        if not update_conversations: return
+        for entry, _, _ in records:
+            self.conn.execute("""
+                INSERT INTO conversations (conversation_id, first_text, timestamp, message_count) VALUES (?, ?, ?, 1)
+                ON CONFLICT(conversation_id) DO UPDATE SET message_count = message_count + 1
+            """, (entry["conversation_id"], get_display_text(entry.get("content"))[:self.SUMMARY_CHARS], entry.get("timestamp", "1970-01-01 00:00:00")))
+
+    def _insert_fts(self, records, segment):
+        if self.fts_available:
+            self.conn.executemany(
+                "INSERT INTO messages_fts (text, conversation_id, role, timestamp, segment, record_offset) VALUES (?, ?, ?, ?, ?, ?)",
+                [(get_all_text(entry.get("content")), entry["conversation_id"], entry.get("role", ""), entry.get("timestamp", ""), segment, offset)
+                 for entry, offset, _ in records])
+
+    def append(self, entry, offset, length):
+        self.append_batch([(entry, offset, length)])
+
+    # records: [(entri, offset, panjang)] yang baru saja ditulis berurutan di akhir segmen aktif
+    def append_batch(self, records):
+        if not records: return
+        with self.lock:
+            try:
+                self._open()
+                start = records[0][1]; end = records[-1][1] + records[-1][2]
+                if int(self._get_meta("log_size", -1)) != start:
+                    self._ensure_fresh(); return # Indeks tertinggal, ekor log (termasuk baris ini) diindeks ulang
+                with self.conn:
+                    self._insert_records([r for r in records if r[0].get("conversation_id") not in self.deleted], self.ACTIVE_SEGMENT)
+                    self._set_meta("log_size", end)
+                    if start < self.HEAD_BYTES: self._set_meta("head_hash", self._head_hash(end))
+            except sqlite3.DatabaseError:
+                self._discard(); self._open(); self._rebuild()
+
+    # --- Rotasi, kompresi dan kompaksi ---
+    def _active_first_timestamp(self):
+        if self.active_first_ts is None:
+            for _, line in self._iter_lines(self.ACTIVE_SEGMENT):
+                entry = self._parse_record(line)
+                if entry is None: continue
+                try: self.active_first_ts = datetime.strptime(entry.get("timestamp", ""), '%Y-%m-%d %H:%M:%S')
+                except ValueError: pass
+                break
+        return self.active_first_ts
+
+    def should_rotate(self):
+        if self.compaction_lock.locked(): return False # Segmen baru di tengah kompaksi bisa lolos dari pembersihan
+        size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        if size == 0: return False
+        if size >= float(self.settings["segment_max_mb"]) * 1024 * 1024: return True
+        max_days = float(self.settings["segment_max_days"] or 0)
+        first_ts = self._active_first_timestamp() if max_days else None
+        return bool(first_ts and (datetime.now() - first_ts).total_seconds() > max_days * 86400)
+
+    # Segmen aktif dipindah menjadi segmen arsip baru (belum dikompres); mengembalikan nomornya atau None
+    def rotate(self):
+        with self.lock:
+            if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0: return None
+            self._ensure_fresh() # Pastikan seluruh segmen aktif sudah terindeks sebelum dipindah
+            number = max(self.archived_segments(), default=0) + 1
+            os.makedirs(self.segment_dir, exist_ok=True)
+            os.replace(self.log_path, self.segment_path(number))
+            open(self.log_path, 'w').close()
+            with self.conn:
+                self.conn.execute("UPDATE records SET segment = ? WHERE segment = ?", (number, self.ACTIVE_SEGMENT))
+                if self.fts_available:
+                    self.conn.execute("UPDATE messages_fts SET segment = ? WHERE segment = ?", (number, self.ACTIVE_SEGMENT))
+                self._set_meta("segments", self._segments_signature())
+                self._set_meta("log_size", 0); self._set_meta("head_hash", self._head_hash(0))
+            self.active_first_ts = None
+            return number
+
+    def pending_compression(self):
+        return [n for n in self.archived_segments() if not self.segment_path(n).endswith(".gz")]
+
+    # Aman dijalankan di thread latar belakang: offset tidak berubah karena dihitung pada data yang didekompresi
+    # compaction_lock: compact() menulis ulang segmen yang sama lewat file sementara yang sama
+    def compress_segment(self, number):
+        with self.compaction_lock:
+            plain = self.segment_path(number)
+            if plain.endswith(".gz") or not os.path.exists(plain): return
+            tmp_path = plain + ".gz.tmp"
+            with open(plain, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst: shutil.copyfileobj(src, dst, 1 << 20)
+            with self.lock:
+                os.replace(tmp_path, plain + ".gz"); os.remove(plain)
+
+    # Menulis ulang semua segmen arsip tanpa percakapan yang dihapus dan catatan yatim (JSON rusak,
+    # tanpa conversation_id/role). Mengembalikan jumlah baris yang dibuang.
+    # rotate: fungsi rotasi pengganti, mis. ChatLogWriter.rotate agar file log tidak dipindah selagi handle penulis terbuka
+    def compact(self, rotate=None):
+        with self.compaction_lock:
+            (rotate or self.rotate)() # Segmen aktif ikut dipadatkan; setelah rotasi semua segmen tidak berubah lagi
+            deleted = set(self.deleted)
+            removed = 0
+            for number in self.archived_segments():
+                path = self.segment_path(number)
+                kept = 0; dropped = 0
+                tmp_path = os.path.join(self.segment_dir, f"{self.segment_prefix}.{number:06d}.jsonl.gz.tmp")
+                with self._open_segment(path) as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+                    for line in src:
+                        entry = self._parse_record(line) if line.endswith(b'\n') else None
+                        if entry is None or entry["conversation_id"] in deleted: dropped += 1; continue
+                        dst.write(line); kept += 1
+                if dropped == 0 and path.endswith(".gz"):
+                    os.remove(tmp_path); continue
+                with self.lock:
+                    for leftover in (path, path[:-3] if path.endswith(".gz") else path + ".gz"):
+                        if os.path.exists(leftover): os.remove(leftover)
+                    if kept: os.replace(tmp_path, os.path.join(self.segment_dir, f"{self.segment_prefix}.{number:06d}.jsonl.gz"))
+                    else: os.remove(tmp_path)
+                    self._reindex_segment(number)
+                removed += dropped
+            with self.lock:
+                self.deleted -= deleted; self._save_tombstones()
+            return removed
+
+    # Catatan yang tersisa setelah kompaksi sama dan berurutan sama dengan baris indeks segmen ini (yang dibuang hanya
+    # percakapan terhapus dan baris yatim, keduanya sudah tidak ada di records), jadi cukup offsetnya yang diperbarui:
+    # rowid tetap sehingga indeks semantik tidak perlu diisi ulang. Generasi hanya berganti jika ternyata tidak cocok.
+    def _reindex_segment(self, number):
+        self._open()
+        old_rows = self.conn.execute("SELECT rowid, conversation_id FROM records WHERE segment = ? ORDER BY offset", (number,)).fetchall()
+        records = []
+        for offset, line in self._iter_lines(number):
+            entry = self._parse_record(line)
+            if entry is not None and entry["conversation_id"] not in self.deleted: records.append((entry, offset, len(line)))
+        with self.conn:
+            if self.fts_available: self.conn.execute("DELETE FROM messages_fts WHERE segment = ?", (number,))
+            if len(old_rows) == len(records) and all(row[1] == entry["conversation_id"] for row, (entry, _, _) in zip(old_rows, records)):
+                self.conn.executemany("UPDATE records SET offset = ?, length = ? WHERE rowid = ?",
+                                      [(offset, length, row[0]) for row, (_, offset, length) in zip(old_rows, records)])
+                self._insert_fts(records, number)
+            else:
+                self.conn.execute("DELETE FROM records WHERE segment = ?", (number,))
+                self._insert_records(records, number, update_conversations=False) # Ringkasan percakapan tidak berubah
+                self._set_meta("generation", os.urandom(8).hex()) # Rowid catatan segmen ini berubah
+            self._set_meta("segments", self._segments_signature())
+
+    # --- Tombstone ---
+    def _load_tombstones(self):
+        try:
+            with open(self.tombstone_path, 'r', encoding='utf-8') as f: return set(json.load(f))
+        except (OSError, ValueError, TypeError): return set()
+
+    def _save_tombstones(self):
+        if not self.deleted:
+            if os.path.exists(self.tombstone_path): os.remove(self.tombstone_path)
+            return
+        tmp_path = self.tombstone_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(sorted(self.deleted), f)
+        os.replace(tmp_path, self.tombstone_path)
+
+    def delete_conversation(self, conversation_id):
+        with self.lock:
+            self.deleted.add(conversation_id); self._save_tombstones()
+            self._open()
+            with self.conn:
+                self.conn.execute("DELETE FROM records WHERE conversation_id = ?", (conversation_id,))
+                self.conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+                if self.fts_available: self.conn.execute("DELETE FROM messages_fts WHERE conversation_id = ?", (conversation_id,))
+
+    def reset(self):
+        with self.compaction_lock, self.lock:
+            for number in self.archived_segments():
+                os.remove(self.segment_path(number))
+            open(self.log_path, 'w').close()
+            self.deleted.clear(); self._save_tombstones()
+            self.active_first_ts = None
+            self._discard(); self._open(); self._rebuild()
+
+    def summaries(self):
+        self.ensure_fresh()
+        with self.lock:
+            return self.conn.execute(
+                "SELECT conversation_id, first_text, timestamp FROM conversations ORDER BY timestamp DESC").fetchall()
+
+    # Satu halaman ringkasan untuk sidebar; ensure_fresh() sudah dipanggil saat startup dan penulis log menjaga indeks tetap baru
+    def summaries_page(self, limit, offset=0):
+        with self.lock:
+            self._open()
+            return self.conn.execute("""
+                SELECT conversation_id, first_text, timestamp FROM conversations
+                ORDER BY timestamp DESC, conversation_id DESC LIMIT ? OFFSET ?
+            """, (limit, offset)).fetchall()
+
+    # Hasil: (conversation_id, role, timestamp, (segmen, offset), teks HTML dengan kata yang cocok ditebalkan)
+    # snippet_tokens: jika diisi, hanya potongan teks di sekitar kata yang cocok yang dikembalikan
+    def search(self, query, limit=500, offset=0, snippet_tokens=None):
+        self.ensure_fresh()
+        if not self.fts_available: return list(itertools.islice(self._scan_iter(query, snippet_tokens), offset, offset + limit))
+        fts_query = build_fts_query(query)
+        if not fts_query: return []
+        text_sql = self._text_sql(snippet_tokens)
+        with self.lock:
+            rows = self.conn.execute(f"""
+                SELECT conversation_id, role, timestamp, segment, record_offset, {text_sql}
+                FROM messages_fts WHERE messages_fts MATCH ? ORDER BY bm25(messages_fts) LIMIT ? OFFSET ?
+            """, (fts_query, limit, offset)).fetchall()
+        return [(row[0], row[1], row[2], (row[3], row[4]), self._highlight_to_html(row[5])) for row in rows]
+
+    # Jumlah total hasil; None jika tanpa FTS (pemindaian baru tahu jumlahnya setelah selesai)
+    def search_count(self, query):
+        if not self.fts_available: return None
+        fts_query = build_fts_query(query)
+        if not fts_query: return 0
+        self.ensure_fresh()
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM messages_fts WHERE messages_fts MATCH ?", (fts_query,)).fetchone()[0]
+
+    # Hasil pencarian per halaman (generator); halaman berikutnya baru dibaca saat diminta.
+    # Peringkat FTS dihitung sekali per pencarian (hanya rowid); tiap halaman cukup mengambil cuplikan untuk rowid-nya,
+    # jadi menggulir tidak mengulang pengurutan dan catatan yang ditulis di antara halaman tidak menggeser hasil.
+    def search_pages(self, query, page_size, snippet_tokens=SEARCH_SNIPPET_TOKENS, cancel_event=None):
+        self.ensure_fresh() # Juga menentukan fts_available
+        if not self.fts_available:
+            hits = self._scan_iter(query, snippet_tokens, cancel_event)
+            for page in iter(lambda: list(itertools.islice(hits, page_size)), []): yield page
+            return
+        fts_query = build_fts_query(query)
+        if not fts_query: return
+        with self.lock:
+            ranked = array.array('q', (row[0] for row in self.conn.execute(
+                "SELECT rowid FROM messages_fts WHERE messages_fts MATCH ? ORDER BY bm25(messages_fts)", (fts_query,))))
+        text_sql = self._text_sql(snippet_tokens)
+        for start in range(0, len(ranked), page_size):
+            if cancel_event is not None and cancel_event.is_set(): return
+            rowids = ranked[start:start + page_size]
+            with self.lock:
+                rows = {row[0]: row[1:] for row in self.conn.execute(f"""
+                    SELECT rowid, conversation_id, role, timestamp, segment, record_offset, {text_sql}
+                    FROM messages_fts WHERE messages_fts MATCH ? AND rowid IN ({",".join("?" * len(rowids))})
+                """, (fts_query, *rowids))}
+            # Baris yang hilang sejak peringkat dihitung (percakapan dihapus) dilewati
+            page = [(row[0], row[1], row[2], (row[3], row[4]), self._highlight_to_html(row[5])) for row in map(rows.get, rowids) if row]
+            if page: yield page
+
+    @staticmethod
+    def _text_sql(snippet_tokens):
+        return (f"snippet(messages_fts, 0, char(2), char(3), '…', {min(64, int(snippet_tokens))})" if snippet_tokens
+                else "highlight(messages_fts, 0, char(2), char(3))")
+
+    @staticmethod
+    def _highlight_to_html(text):
+        return html.escape(text).replace("\x02", "<b>").replace("\x03", "</b>").replace("\n", "<br>")
+
+    def _scan_iter(self, query, snippet_tokens=None, cancel_event=None):
+        terms = [t.lower().rstrip('*') for pair in re.findall(r'"([^"]*)"|(\S+)', query) for t in pair if t and t != "OR"]
+        if not terms: return
+        for segment, record_offset, entry in self.iter_records():
+            if cancel_event is not None and cancel_event.is_set(): return # Kata langka: batal tanpa menunggu seluruh log terpindai
+            text = get_all_text(entry.get("content")); lowered = text.lower()
+            if not all(t in lowered for t in terms): continue
+            if snippet_tokens: # Perkiraan snippet FTS: ~8 karakter per token di sekitar kata pertama yang cocok
+                span = snippet_tokens * 8; start = max(0, lowered.find(terms[0]) - span // 2)
+                text = ("…" if start else "") + text[start:start + span] + ("…" if start + span < len(text) else "")
+            yield (entry["conversation_id"], entry.get("role", ""), entry.get("timestamp", "N/A"),
+                   (segment, record_offset), html.escape(text).replace("\n", "<br>"))
+
+    def read_conversation(self, conversation_id):
+        self.ensure_fresh()
+        with self.lock: # Menahan kompresi/kompaksi agar file segmen tidak berganti saat dibaca
+            locations = self.conn.execute("""
+                SELECT segment, offset, length FROM records WHERE conversation_id = ?
+                ORDER BY segment = 0, segment, offset
+            """, (conversation_id,)).fetchall()
+            return [entry for _, entry in self._read_locations(locations)]
+
+    # Urutan pesan di lokasi tertentu dalam percakapannya (sama dengan urutan read_conversation); None jika sudah tidak ada
+    def message_position(self, conversation_id, location):
+        with self.lock:
+            self._open()
+            rows = self.conn.execute("""
+                SELECT segment, offset FROM records WHERE conversation_id = ? ORDER BY segment = 0, segment, offset
+            """, (conversation_id,)).fetchall()
+        try: return rows.index(tuple(location))
+        except ValueError: return None
+
+    # Catatan berikutnya setelah rowid tertentu, urut rowid: (generasi indeks, [(rowid, entri)]).
+    # Rowid hanya bermakna dalam satu generasi; generasi berganti setiap indeks dibangun ulang (kompaksi biasa mempertahankannya).
+    # AUTOINCREMENT: rowid catatan yang dihapus tidak dipakai ulang, jadi kursor sinkronisasi tidak melewatkan catatan baru.
+    def records_after(self, after_rowid, limit):
+        with self.lock:
+            self._open()
+            locations = self.conn.execute("""
+                SELECT segment, offset, length, rowid FROM records WHERE rowid > ? ORDER BY rowid LIMIT ?
+            """, (after_rowid, limit)).fetchall()
+            return self._get_meta("generation"), [(location[3], entry) for location, entry in self._read_locations(locations)]
+
+    # Menghasilkan (lokasi, entri) untuk setiap (segmen, offset, panjang, ...); handle segmen dipakai ulang selama segmennya sama
+    def _read_locations(self, locations):
+        current_segment = None; f = None
+        try:
+            for location in locations:
+                segment, offset, length = location[:3]
+                if segment != current_segment:
+                    if f is not None: f.close()
+                    f = self._open_segment(self.segment_path(segment)); current_segment = segment
+                f.seek(offset) # Untuk gzip, offset yang terurut berarti hanya maju
+                try: yield location, json.loads(f.read(length))
+                except json.JSONDecodeError: continue
+        finally:
+            if f is not None: f.close()
+
+# === Penulis Log Asinkron ===
+# --- OPTIMISASI: Penulisan log (dan pembaruan indeks) dipindah ke satu thread dengan antrean ---
+# Catatan yang masuk berdekatan digabung menjadi satu penulisan (group commit) lewat satu file handle yang tetap terbuka.
+# fsync: "batch" = setiap kelompok, "interval" = paling sering tiap fsync_interval_s, "never" = serahkan ke OS.
+DEFAULT_LOG_WRITER_SETTINGS = {
+    "batch_window_ms": 50, # Waktu tunggu untuk mengumpulkan catatan berikutnya sebelum menulis
+    "max_batch": 256,
+    "fsync": "batch",
+    "fsync_interval_s": 1.0,
+    "retry_delay_s": 1.0
+}
+
+class ChatLogWriter(QObject):
+    failed = Signal(str)
+    rotated = Signal(int)
+    batch_written = Signal(int, float) # (jumlah catatan, detik menulis + mengindeks)
+
+    def __init__(self, log_index, settings=None):
+        super().__init__()
+        self.log_index = log_index
+        self.settings = dict(DEFAULT_LOG_WRITER_SETTINGS, **(settings or {}))
+        self.queue = queue.Queue()
+        self.file = None
+        self.last_fsync = 0.0
+        self.thread = threading.Thread(target=self._run, name="ChatLogWriter", daemon=True)
+        self.thread.start()
+
+    # Dipanggil dari thread GUI; serialisasi di sini agar perubahan objek setelahnya tidak ikut tertulis
+    def write(self, entry):
+        self.queue.put((dict(entry), (json.dumps(entry) + '\n').encode('utf-8')))
+
+    # Menunggu sampai semua catatan yang sudah diantrekan tertulis (atau gagal)
+    def flush(self, timeout=None):
+        if not self.thread.is_alive(): return True
+        marker = threading.Event()
+        self.queue.put(marker)
+        return marker.wait(timeout)
+
+    def close(self, timeout=5.0):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    # Merotasi segmen aktif di thread penulis (handle log ditutup dulu); dipakai kompaksi. Mengembalikan nomor segmen atau None
+    def rotate(self, timeout=None):
+        if not self.thread.is_alive(): return self.log_index.rotate()
+        request = concurrent.futures.Future()
+        self.queue.put(request)
+        return request.result(timeout)
+
+    def _run(self):
+        pending = []; markers = []; rotations = []
+        window = self.settings["batch_window_ms"] / 1000.0; max_batch = int(self.settings["max_batch"])
+        running = True
+        while running:
+            item = self.queue.get() if not pending else self._get(self.settings["retry_delay_s"])
+            deadline = time.monotonic() + window
+            while True:
+                if item is None: running = False
+                elif isinstance(item, threading.Event): markers.append(item)
+                elif isinstance(item, concurrent.futures.Future): rotations.append(item)
+                elif item is not self: pending.append(item)
+                if not running or markers or len(pending) >= max_batch: break # flush() tidak menunggu jendela habis
+                item = self._get(deadline - time.monotonic())
+                if item is self: break # Jendela pengumpulan habis
+            if pending:
+                try:
+                    self._write_batch(pending); pending = []
+                except OSError as e:
+                    self._close_file()
+                    self.failed.emit(f"{e} ({len(pending)} catatan tertunda)")
+                    if not running: pending = [] # Percobaan terakhir saat aplikasi ditutup sudah gagal
+            for request in rotations:
+                try: request.set_result(self._rotate())
+                except OSError as e: request.set_exception(e)
+            if not rotations and running and self.log_index.should_rotate():
+                try: self._rotate()
+                except OSError as e: self.failed.emit(f"Rotasi log gagal: {e}")
+            for marker in markers: marker.set()
+            markers = []; rotations = []
+        self._close_file()
+
+    # Mengembalikan self sebagai penanda "tidak ada item" setelah batas waktu
+    def _get(self, timeout):
+        try: return self.queue.get(timeout=max(0.0, timeout))
+        except queue.Empty: return self
+
+    def _write_batch(self, batch):
+        index = self.log_index
+        start = time.perf_counter()
+        with index.lock: # Rotasi/reset indeks juga memegang kunci ini, jadi file tidak berganti di tengah penulisan
+            self._ensure_file()
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+            records = []
+            for entry, line in batch:
+                records.append((entry, offset, len(line))); offset += len(line)
+            self.file.write(b"".join(line for _, line in batch))
+            self.file.flush()
+            # Batch sudah ada di file: kesalahan setelah ini hanya dilaporkan, batch tidak ditulis ulang
+            try:
+                self._maybe_fsync()
+                index.append_batch(records)
+            except OSError as e:
+                self.failed.emit(f"{e} (catatan sudah tertulis)")
+        self.batch_written.emit(len(batch), time.perf_counter() - start)
+
+    # Handle ditutup sebelum file dipindah (Windows menolak os.replace pada file yang masih terbuka)
+    def _rotate(self):
+        self._close_file()
+        rotated = self.log_index.rotate()
+        if rotated is not None: self.rotated.emit(rotated)
+        return rotated
+
+    # Membuka ulang jika LOG_PATH sudah diganti (rotasi, reset, atau dihapus dari luar)
+    def _ensure_file(self):
+        if self.file is not None:
+            try:
+                if os.fstat(self.file.fileno()).st_ino == os.stat(self.log_index.log_path).st_ino: return
+            except OSError: pass
+            self._close_file()
+        self.file = open(self.log_index.log_path, 'ab')
+
+    def _maybe_fsync(self):
+        policy = self.settings["fsync"]
+        now = time.monotonic()
+        if policy == "batch" or (policy == "interval" and now - self.last_fsync >= self.settings["fsync_interval_s"]):
+            os.fsync(self.file.fileno()); self.last_fsync = now
+
+    def _close_file(self):
+        if self.file is None: return
+        try: self.file.close()
+        except OSError: pass
+        self.file = None
+
+# === Indeks Semantik ===
+# --- OPTIMISASI: Pencarian makna (bukan kata persis) sepenuhnya offline ---
+# Setiap pesan diubah menjadi vektor n-gram ter-hash (kata, pasangan kata, trigram huruf) yang dinormalisasi,
+# disimpan sebagai matriks float32 ter-memory-map. Vektor ditambahkan bertahap mengikuti rowid indeks log;
+# jika indeks log dibangun ulang (generasi berubah) matriks diisi ulang dari awal.
+# Query top-k = perkalian matriks-vektor per blok + argpartition, tanpa memuat seluruh matriks ke RAM.
+DEFAULT_SEMANTIC_SETTINGS = {
+    "dim": 256, # Dimensi vektor; mengubahnya memicu pembangunan ulang
+    "block_rows": 65536, # Baris matriks per blok perkalian
+    "sync_batch": 4096, # Catatan per batch saat mengejar log
+    "min_score": 0.2, # Kemiripan kosinus minimum yang ditampilkan
+    "max_chars": 2000 # Hanya awal pesan yang di-embed
+}
+
+class SemanticIndex:
+    VERSION = "1"
+    SNIPPET_CHARS = 200
+    TOKEN_PATTERN = re.compile(r"\w+")
+    COMBINING_PATTERN = re.compile(r"[\u0300-\u036f]") # Tanda diakritik setelah normalisasi NFKD
+
+    def __init__(self, vectors_path, index_path, settings=None):
+        self.vectors_path = vectors_path
+        self.index_path = index_path
+        self.settings = dict(DEFAULT_SEMANTIC_SETTINGS, **(settings or {}))
+        self.dim = int(self.settings["dim"])
+        self.lock = threading.RLock()
+        self.sync_lock = threading.Lock() # Hanya satu proses pengejaran log pada satu waktu
+        self.conn = None
+        self.vectors = None # np.memmap (kapasitas, dim); baris >= count tidak dipakai
+        self.count = 0
+
+    def _open(self):
+        if self.conn is not None: return
+        self.conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY, record_rowid INTEGER, conversation_id TEXT, role TEXT, timestamp TEXT, snippet TEXT);
+            CREATE INDEX IF NOT EXISTS idx_rows_conv ON rows(conversation_id);
+        """)
+        self.count = int(self._get_meta("count", 0))
+        if self._get_meta("version") != self.VERSION or self._get_meta("dim") != str(self.dim): self._clear(None)
+        self._map(self.count)
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    # File vektor hanya pernah diperbesar: memmap lama yang masih dipakai query di thread lain tetap valid
+    def _map(self, rows_needed):
+        row_bytes = self.dim * 4
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        capacity = size // row_bytes
+        if self.vectors is not None and capacity >= rows_needed and len(self.vectors) == capacity: return
+        if capacity < rows_needed:
+            capacity = max(rows_needed, capacity * 2, 4096)
+            with open(self.vectors_path, 'ab') as f: f.truncate(capacity * row_bytes)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim)) if capacity else None
+
+    def _clear(self, generation):
+        with self.conn:
+            self.conn.execute("DELETE FROM rows")
+            self._set_meta("version", self.VERSION); self._set_meta("dim", self.dim)
+            self._set_meta("count", 0); self._set_meta("last_rowid", 0); self._set_meta("generation", generation or "")
+        self.count = 0
+
+    def reset(self):
+        with self.lock:
+            self._open(); self._clear(None)
+
+    # --- Embedding ---
+    def _features(self, text):
+        text = self.COMBINING_PATTERN.sub("", unicodedata.normalize("NFKD", text[:int(self.settings["max_chars"])].lower()))
+        words = self.TOKEN_PATTERN.findall(text)
+        features = {}
+        for word in words:
+            features[word] = features.get(word, 0.0) + 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                gram = "#" + padded[i:i + 3]
+                features[gram] = features.get(gram, 0.0) + 0.5
+        for first, second in zip(words, words[1:]):
+            pair = f"{first} {second}"
+            features[pair] = features.get(pair, 0.0) + 0.5
+        return features
+
+    # Matriks (n, dim) float32 yang sudah dinormalisasi L2; hash tanda (signed hashing) meredam tabrakan
+    def embed(self, texts):
+        dim = self.dim
+        cells = []; weights = []
+        for i, text in enumerate(texts):
+            for feature, weight in self._features(text or "").items():
+                h = zlib.crc32(feature.encode('utf-8'))
+                cells.append(i * dim + h % dim); weights.append(weight if h & 0x80000000 else -weight)
+        matrix = np.bincount(np.asarray(cells, dtype=np.int64), weights=np.asarray(weights, dtype=np.float64),
+                             minlength=len(texts) * dim).reshape(len(texts), dim)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix)) # TF sublinear: kata yang diulang tidak mendominasi
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return (matrix / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+
+    # --- Pembaruan ---
+    # Mengejar indeks log: catatan dengan rowid di atas penanda di-embed per batch. Mengembalikan jumlah vektor baru.
+    def sync(self, log_index):
+        added = 0
+        with self.sync_lock:
+            while True:
+                with self.lock: self._open(); last_rowid = int(self._get_meta("last_rowid", 0)); generation = self._get_meta("generation")
+                batch_generation, batch = log_index.records_after(last_rowid, int(self.settings["sync_batch"]))
+                with self.lock:
+                    if (batch_generation or "") != (generation or ""):
+                        self._clear(batch_generation); added = 0; continue # Rowid indeks log berubah: isi ulang
+                    if not batch: return added
+                    self._append(batch); added += len(batch)
+
+    def _append(self, batch):
+        matrix = self.embed([get_all_text(entry.get("content")) for _, entry in batch])
+        start = self.count
+        self._map(start + len(batch))
+        self.vectors[start:start + len(batch)] = matrix
+        self.vectors.flush() # Vektor tersimpan sebelum penanda maju, jadi crash tidak meninggalkan baris kosong
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO rows (row, record_rowid, conversation_id, role, timestamp, snippet) VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(start + i, rowid, entry["conversation_id"], entry.get("role", ""), entry.get("timestamp", ""),
+                                    get_all_text(entry.get("content"))[:self.SNIPPET_CHARS]) for i, (rowid, entry) in enumerate(batch)])
+            self._set_meta("count", start + len(batch)); self._set_meta("last_rowid", batch[-1][0])
+        self.count = start + len(batch)
+
+    def delete_conversation(self, conversation_id):
+        with self.lock:
+            self._open()
+            rows = [row for (row,) in self.conn.execute("SELECT row FROM rows WHERE conversation_id = ?", (conversation_id,))]
+            if not rows: return
+            self.vectors[np.asarray(rows)] = 0.0; self.vectors.flush() # Vektor nol tidak pernah lolos min_score
+            with self.conn: self.conn.execute("DELETE FROM rows WHERE conversation_id = ?", (conversation_id,))
+
+    # --- Query ---
+    # Hasil: [(conversation_id, role, timestamp, skor, cuplikan)] urut dari yang paling mirip
+    def search(self, query, limit=20):
+        query_vector = self.embed([query])[0]
+        if not query_vector.any(): return []
+        with self.lock:
+            self._open(); vectors = self.vectors; count = self.count
+        if not count: return []
+        candidates = min(count, limit * 2) # Cadangan untuk baris milik percakapan yang sudah dihapus
+        block = int(self.settings["block_rows"])
+        best_rows = []; best_scores = []
+        for start in range(0, count, block):
+            scores = vectors[start:min(count, start + block)] @ query_vector
+            k = min(candidates, len(scores))
+            top = np.argpartition(scores, -k)[-k:]
+            best_rows.append(top + start); best_scores.append(scores[top])
+        rows = np.concatenate(best_rows); scores = np.concatenate(best_scores)
+        order = np.argsort(-scores)[:candidates]
+        picked = [(int(rows[i]), float(scores[i])) for i in order if scores[i] >= float(self.settings["min_score"])]
+        if not picked: return []
+        with self.lock:
+            placeholders = ",".join("?" * len(picked))
+            meta = {row[0]: row[1:] for row in self.conn.execute(
+                f"SELECT row, conversation_id, role, timestamp, snippet FROM rows WHERE row IN ({placeholders})", [row for row, _ in picked])}
+        return [(meta[row][0], meta[row][1], meta[row][2], score, meta[row][3]) for row, score in picked if row in meta][:limit]
+
+# === Manajer Klien API ===
+# --- OPTIMISASI: Klien tiap provider dibuat sekali per API key/model dan dipakai ulang antar permintaan ---
+# Koneksi HTTP (keep-alive) tetap hidup di dalam klien; klien hanya dibangun ulang saat konfigurasi berubah.
+class ApiClientManager:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.gemini_key = None
+        self.gemini_models = {} # model_name -> genai.GenerativeModel
+        self.openai_clients = {} # api_key -> openai.OpenAI
+        self.stats = {"gemini_created": 0, "gemini_reused": 0, "openai_created": 0, "openai_reused": 0, "rebuilds": 0}
+
+    def gemini_model(self, api_key, model_name):
+        with self.lock:
+            if self.gemini_key != api_key:
+                genai.configure(api_key=api_key) # Konfigurasi global SDK, hanya diulang jika key berganti
+                self.gemini_key = api_key; self.gemini_models.clear()
+            model = self.gemini_models.get(model_name)
+            if model is None:
+                model = self.gemini_models[model_name] = genai.GenerativeModel(model_name)
+                self.stats["gemini_created"] += 1
+            else:
+                self.stats["gemini_reused"] += 1
+            return model
+
+    def openai_client(self, api_key):
+        with self.lock:
+            client = self.openai_clients.get(api_key)
+            if client is None:
+                client = self.openai_clients[api_key] = openai.OpenAI(api_key=api_key)
+                self.stats["openai_created"] += 1
+            else:
+                self.stats["openai_reused"] += 1
+            return client
+
+    # Buang klien yang tidak lagi cocok dengan konfigurasi (dipanggil dari set_api_key/switch_api)
+    def sync_config(self, config):
+        with self.lock:
+            gemini_key = config.get("gemini", {}).get("api_key", "")
+            if self.gemini_key is not None and self.gemini_key != gemini_key:
+                self.gemini_key = None; self.gemini_models.clear(); self.stats["rebuilds"] += 1
+            openai_key = config.get("openai", {}).get("api_key", "")
+            for key in [k for k in self.openai_clients if k != openai_key]:
+                client = self.openai_clients.pop(key); self.stats["rebuilds"] += 1
+                try: client.close()
+                except Exception: pass
+
+    def connection_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+# === Manajemen Jendela Konteks ===
+# --- OPTIMISASI: Histori yang dikirim ke API dibatasi anggaran token, bukan seluruh self.messages ---
+# Strategi: "drop_oldest" membuang pesan terlama; "rolling_summary" menggantinya dengan ringkasan ekstraktif lokal.
+DEFAULT_CONTEXT_SETTINGS = {
+    "max_tokens": 8000, # Anggaran total (histori + prompt)
+    "reserve_tokens": 1024, # Disisakan untuk jawaban model
+    "strategy": "rolling_summary", # atau "drop_oldest"
+    "summary_tokens": 400,
+    "image_tokens": 800 # Perkiraan biaya satu gambar di prompt
+}
+
+class ContextWindowManager:
+    MESSAGE_OVERHEAD_TOKENS = 4
+    TOKEN_CACHE_LIMIT = 20000
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_CONTEXT_SETTINGS, **(settings or {}))
+        self.token_cache = {} # isi pesan -> jumlah token (hash str di-cache Python, jadi lookup murah)
+        self.summary_cache = {}
+        self.encoder = None
+        try:
+            import tiktoken # Opsional: hitungan token yang lebih akurat
+            self.encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            pass
+
+    def count_tokens(self, text):
+        tokens = self.token_cache.get(text)
+        if tokens is None:
+            tokens = len(self.encoder.encode(text)) if self.encoder else max(1, len(text) // 4)
+            if len(self.token_cache) >= self.TOKEN_CACHE_LIMIT: self.token_cache.clear()
+            self.token_cache[text] = tokens
+        return tokens + self.MESSAGE_OVERHEAD_TOKENS
+
+    def _summarize(self, dropped):
+        key = (len(dropped), dropped[-1]["content"])
+        summary = self.summary_cache.get(key)
+        if summary is None:
+            budget_chars = int(self.settings["summary_tokens"]) * 4
+            lines = []
+            for msg in reversed(dropped): # Pesan yang lebih baru diprioritaskan
+                text = " ".join(str(msg.get("content", "")).split())
+                sentence = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0][:200]
+                line = f"- {'Pengguna' if msg['role'] == 'user' else 'Asisten'}: {sentence}"
+                if sum(len(l) for l in lines) + len(line) > budget_chars: break
+                lines.append(line)
+            summary = "[Ringkasan percakapan sebelumnya]\n" + "\n".join(reversed(lines))
+            if len(self.summary_cache) > 64: self.summary_cache.clear()
+            self.summary_cache[key] = summary
+        return summary
+
+    # Hasil: {"messages": histori untuk API, "strategy": full|drop_oldest|rolling_summary|prompt_only, "dropped", "tokens", "budget"}
+    # prompt_only: prompt sendiri sudah menghabiskan anggaran, jadi seluruh histori (dan ringkasannya) tidak dikirim
+    def plan(self, history, prompt_text, image_count=0):
+        history = [{"role": m["role"], "content": m.get("content", "")} for m in history]
+        budget = int(self.settings["max_tokens"]) - int(self.settings["reserve_tokens"])
+        prompt_tokens = self.count_tokens(prompt_text) + image_count * int(self.settings["image_tokens"])
+        strategy = self.settings["strategy"]
+        history_budget = budget - prompt_tokens
+        total = sum(self.count_tokens(m["content"]) for m in history)
+        if total <= history_budget:
+            return {"messages": history, "strategy": "full", "dropped": 0, "tokens": total + prompt_tokens, "budget": budget}
+        if history_budget <= 0:
+            return {"messages": [], "strategy": "prompt_only", "dropped": len(history), "tokens": prompt_tokens, "budget": budget}
+
+        if strategy == "rolling_summary" and history_budget > int(self.settings["summary_tokens"]):
+            history_budget -= int(self.settings["summary_tokens"])
+        else:
+            strategy = "drop_oldest" # Ringkasan tidak muat di samping prompt
+        kept_tokens = 0; start = len(history)
+        while start > 0 and kept_tokens + self.count_tokens(history[start - 1]["content"]) <= history_budget:
+            start -= 1; kept_tokens += self.count_tokens(history[start]["content"])
+        while start < len(history) and history[start]["role"] != "user": # Histori harus diawali pesan pengguna
+            kept_tokens -= self.count_tokens(history[start]["content"]); start += 1
+        kept, dropped = history[start:], history[:start]
+
+        if strategy == "rolling_summary" and dropped:
+            summary = self._summarize(dropped)
+            kept = [{"role": "user", "content": summary}, {"role": "assistant", "content": "Baik, saya ingat konteks tersebut."}] + kept
+            kept_tokens += self.count_tokens(summary) + self.count_tokens(kept[1]["content"])
+        else:
+            strategy = "drop_oldest"
+        return {"messages": kept, "strategy": strategy, "dropped": len(dropped), "tokens": kept_tokens + prompt_tokens, "budget": budget}
+
+# === Eksekutor Permintaan ===
+# Menjalankan fungsi biasa di thread pool dan mengirim hasilnya ke thread GUI lewat sinyal
+class BackgroundCall(QObject):
+    done = Signal(object)
+    failed = Signal(str)
+
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn; self.args = args
+
+    def run(self):
+        try: self.done.emit(self.fn(*self.args))
+        except Exception as e: self.failed.emit(str(e))
+
+class _WorkerRunnable(QRunnable):
+    def __init__(self, worker, slots):
+        super().__init__()
+        self.worker = worker
+        self.slots = slots
+
+    def run(self):
+        # Worker dengan request_slots (balapan, map-reduce) mengambil slot sendiri untuk setiap permintaan yang dikirimnya
+        own_slots = getattr(self.worker, "request_slots", None) is not None
+        if not own_slots: self.slots.acquire()
+        try:
+            metrics = getattr(self.worker, "metrics", None)
+            if metrics: metrics.mark("run_start") # Akhir waktu antre di pool
+            self.worker.run()
+        finally:
+            if not own_slots: self.slots.release()
+
+# --- OPTIMISASI: Satu pool thread berumur panjang untuk semua permintaan AI, bukan QThread baru per prompt ---
+# Executor menyimpan referensi worker sampai selesai, jadi worker tidak bisa terhapus GC di tengah jalan.
+class RequestExecutor(QObject):
+    def __init__(self, max_workers=4, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.pool.setExpiryTimeout(-1) # Thread tetap hidup di antara permintaan
+        # Batas permintaan ke provider yang berjalan bersamaan, termasuk peserta balapan dan tahap map di luar thread pool
+        self.slots = threading.Semaphore(max_workers)
+        self.active = {} # job_id -> worker
+        self.next_job_id = 0
+
+    def submit(self, worker):
+        self.next_job_id += 1
+        job_id = self.next_job_id
+        self.active[job_id] = worker
+        for signal in (worker.finished, worker.error, worker.cancelled):
+            signal.connect(lambda *_, job_id=job_id: self.active.pop(job_id, None))
+        self.pool.start(_WorkerRunnable(worker, self.slots))
+        return job_id
+
+    def cancel(self, job_id):
+        worker = self.active.get(job_id)
+        if worker is not None: worker.cancel()
+
+    # Semua thread sedang dipakai: permintaan baru menunggu di antrean pool
+    def saturated(self):
+        return len(self.active) >= self.pool.maxThreadCount()
+
+    def shutdown(self, timeout_ms=3000):
+        for worker in list(self.active.values()): worker.cancel()
+        self.pool.waitForDone(timeout_ms)
+
+# Menunggu slot RequestExecutor.slots; False jika dibatalkan lebih dulu
+def acquire_slot(slots, cancel_event, poll_s=0.1):
+    while not cancel_event.is_set():
+        if slots.acquire(timeout=poll_s): return True
+    return False
+
+# === Praproses Gambar ===
+# --- OPTIMISASI: Gambar diperkecil ke resolusi maksimum yang berguna bagi provider lalu di-encode ulang (JPEG/WebP) ---
+# Hasil disimpan di IMAGE_CACHE_DIR dengan kunci hash konten + pengaturan, jadi gambar yang sama tidak di-encode dua kali.
+DEFAULT_IMAGE_SETTINGS = {
+    "format": "JPEG", # JPEG atau WEBP
+    "quality": 85,
+    "max_side": {"gemini": 3072, "openai": 2048},
+    "max_short_side": {"openai": 768}, # OpenAI (detail tinggi) menskalakan sisi pendek ke 768px
+    "max_cache_mb": 200
+}
+
+class ImagePreprocessor:
+    def __init__(self, cache_dir, settings=None):
+        self.cache_dir = cache_dir
+        self.settings = dict(DEFAULT_IMAGE_SETTINGS, **(settings or {}))
+        self.lock = threading.Lock()
+        self.hash_memo = {} # (path, mtime, size) -> sha256 isi file
+        self.stats = {"hits": 0, "misses": 0}
+
+    def content_hash(self, path):
+        st = os.stat(path)
+        memo_key = (path, st.st_mtime_ns, st.st_size)
+        with self.lock: digest = self.hash_memo.get(memo_key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''): h.update(block)
+            digest = h.hexdigest()
+            with self.lock: self.hash_memo[memo_key] = digest
+        return digest
+
+    def _limits(self, provider):
+        return self.settings["max_side"].get(provider, 2048), self.settings["max_short_side"].get(provider)
+
+    # Hasil: {"mime_type": ..., "data": bytes, "sha256": hash isi file asli}
+    def prepare(self, path, provider):
+        fmt = self.settings["format"].upper(); quality = int(self.settings["quality"])
+        max_side, max_short_side = self._limits(provider)
+        content_hash = self.content_hash(path)
+        cache_key = hashlib.sha256(f"{content_hash}:{fmt}:{quality}:{max_side}:{max_short_side}".encode()).hexdigest()
+        mime_type = "image/webp" if fmt == "WEBP" else "image/jpeg"
+        cache_path = os.path.join(self.cache_dir, f"{cache_key}.{fmt.lower()}")
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f: data = f.read()
+            os.utime(cache_path) # Tandai baru dipakai (pemangkasan cache membuang yang paling lama)
+            with self.lock: self.stats["hits"] += 1
+            return {"mime_type": mime_type, "data": data, "sha256": content_hash}
+
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)
+            scale = min(1.0, max_side / max(img.size))
+            if max_short_side: scale = min(scale, max_short_side / min(img.size))
+            if scale < 1.0:
+                img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.Resampling.LANCZOS)
+            if fmt == "JPEG" and img.mode != "RGB": img = img.convert("RGB")
+            elif fmt == "WEBP" and img.mode not in ("RGB", "RGBA"): img = img.convert("RGBA")
+            buffer = io.BytesIO()
+            img.save(buffer, fmt, quality=quality, optimize=True) if fmt == "JPEG" else img.save(buffer, fmt, quality=quality)
+            data = buffer.getvalue()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, 'wb') as f: f.write(data)
+        os.replace(tmp_path, cache_path)
+        with self.lock: self.stats["misses"] += 1
+        self._prune()
+        return {"mime_type": mime_type, "data": data, "sha256": content_hash}
+
+    def _prune(self):
+        limit = int(self.settings["max_cache_mb"]) * 1024 * 1024
+        try:
+            entries = [e for e in os.scandir(self.cache_dir) if e.is_file()]
+        except OSError: return
+        total = sum(e.stat().st_size for e in entries)
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= limit: break
+            size = entry.stat().st_size
+            try: os.remove(entry.path); total -= size
+            except OSError: pass
+
+# Bagian prompt berupa gambar; di-encode oleh worker (di thread pool) sesuai provider tujuan
+class ImagePart:
+    def __init__(self, path, preprocessor):
+        self.path = path
+        self.preprocessor = preprocessor
+
+    def prepare(self, provider):
+        return self.preprocessor.prepare(self.path, provider)
+
+# === Lampiran File Teks ===
+# --- OPTIMISASI: File teks dilampirkan sebagai referensi (path + ukuran), bukan disalin ke QLineEdit ---
+# Isi dibaca lewat mmap saat dikirim. File yang muat di anggaran konteks dikirim utuh; yang lebih besar dipecah
+# per bagian (di batas baris) dan diproses map-reduce oleh MapReduceWorker.
+DEFAULT_ATTACHMENT_SETTINGS = {
+    "chunk_tokens": 3000, # Ukuran satu bagian untuk tahap map
+    "map_concurrency": 3, # Permintaan paralel maksimum per lampiran
+    "max_retries": 2,
+    "preview_chars": 600
+}
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB": return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024.0
+
+class FileAttachment:
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+
+    def estimated_tokens(self):
+        return max(1, self.size // 4)
+
+    def describe(self):
+        tokens = f"{self.estimated_tokens():,}".replace(",", ".") # Pemisah ribuan gaya Indonesia
+        return f"{self.name} ({format_size(self.size)}, ±{tokens} token)"
+
+    def preview(self, max_chars=600):
+        with open(self.path, 'rb') as f: head = f.read(max_chars * 4)
+        return head.decode('utf-8', errors='ignore')[:max_chars]
+
+    def open_map(self):
+        f = open(self.path, 'rb')
+        try: return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception: f.close(); raise
+
+    def read_text(self):
+        if self.size == 0: return ""
+        f, mm = self.open_map()
+        try: return mm[:].decode('utf-8', errors='replace')
+        finally: mm.close(); f.close()
+
+    # Batas (awal, akhir) setiap bagian; dipotong di akhir baris, atau di batas karakter UTF-8 jika barisnya terlalu panjang
+    @staticmethod
+    def chunk_bounds(mm, size, chunk_bytes):
+        bounds = []; start = 0
+        while start < size:
+            end = min(size, start + chunk_bytes)
+            if end < size:
+                newline = mm.rfind(b"\n", start, end)
+                if newline > start: end = newline + 1
+                else:
+                    while end > start + 1 and (mm[end] & 0xC0) == 0x80: end -= 1
+            bounds.append((start, end)); start = end
+        return bounds
+
+# === Metrik Permintaan ===
+# --- OPTIMISASI: Setiap permintaan AI diukur per tahap agar jelas lambatnya di mana ---
+# build (thread GUI menyusun permintaan) -> antre (menunggu thread pool) -> encode (gambar/payload di worker)
+# -> TTFB provider (permintaan terkirim sampai chunk pertama) -> streaming (chunk/s, karakter/s) -> render di GUI.
+# Satu baris JSONL per permintaan di file metrik bergulir, plus ringkasan teks Prometheus (textfile collector).
+# Keduanya ditulis oleh satu thread latar belakang; file Prometheus ditulis ulang paling sering tiap prometheus_interval_s.
+DEFAULT_METRICS_SETTINGS = {
+    "enabled": True,
+    "max_file_mb": 5, # File metrik digulir (.1, .2, ...) jika melebihi ukuran ini
+    "keep_files": 3,
+    "window": 1000, # Permintaan terakhir yang dipakai untuk persentil
+    "prometheus_textfile": True, # Tulis ulang METRICS_PROM_PATH secara berkala selama ada permintaan baru
+    "prometheus_interval_s": 10.0
+}
+
+def percentile(values, q):
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+class RequestMetrics:
+    def __init__(self, conversation_id=None):
+        self.started = time.perf_counter() # Saat sendPrompt dipanggil
+        self.labels = {"provider": "", "model": "", "mode": "single"}
+        self.marks = {}
+        self.values = {"payload_bytes": 0, "encode_images_ms": 0.0, "gui_chunk_ms": 0.0, "render_ms": 0.0}
+        self.chunks = 0; self.chars = 0
+        self.conversation_id = conversation_id
+
+    def mark(self, name):
+        self.marks.setdefault(name, time.perf_counter())
+
+    def add(self, name, value):
+        self.values[name] = self.values.get(name, 0) + value
+
+    # Mode balapan: setiap peserta punya catatan sendiri; hanya milik pemenang yang dipindah ke catatan permintaan
+    def merge_contender(self, contender):
+        for name in ("payload_bytes", "encode_images_ms"): self.add(name, contender.values.get(name, 0))
+        if "request_sent" in contender.marks: self.marks["request_sent"] = contender.marks["request_sent"]
+
+    # Dipanggil dari thread worker untuk setiap potongan teks yang diterima dari provider
+    def chunk(self, text):
+        now = time.perf_counter()
+        if not self.chunks: self.marks.setdefault("first_chunk", now)
+        self.chunks += 1; self.chars += len(text); self.marks["last_chunk"] = now
+
+    def _span_ms(self, start, end):
+        if start not in self.marks and start != "started": return None
+        begin = self.started if start == "started" else self.marks[start]
+        return round((self.marks[end] - begin) * 1000, 2) if end in self.marks else None
+
+    def as_record(self, outcome):
+        self.mark("finished")
+        stream_s = (self.marks["last_chunk"] - self.marks["first_chunk"]) if self.chunks > 1 else 0.0
+        record = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **self.labels, "outcome": outcome,
+                  "build_ms": self._span_ms("started", "submitted"), "queue_ms": self._span_ms("submitted", "run_start"),
+                  "encode_ms": self._span_ms("run_start", "request_sent"), "provider_ttfb_ms": self._span_ms("request_sent", "first_chunk"),
+                  "ttft_ms": self._span_ms("started", "first_chunk"), "stream_ms": round(stream_s * 1000, 2),
+                  "total_ms": self._span_ms("started", "finished"), "chunks": self.chunks, "chars": self.chars,
+                  "chunks_per_s": round((self.chunks - 1) / stream_s, 2) if stream_s else None,
+                  "chars_per_s": round(self.chars / stream_s, 1) if stream_s else None}
+        record.update({k: round(v, 2) if isinstance(v, float) else v for k, v in self.values.items()})
+        return record
+
+class MetricsRecorder:
+    # Kolom yang diringkas (persentil) di panel statistik dan ekspor Prometheus: kolom -> (nama metrik, keterangan, skala)
+    SUMMARY_FIELDS = {
+        "build_ms": ("request_build_seconds", "Waktu menyusun permintaan di thread GUI", 0.001),
+        "queue_ms": ("request_queue_seconds", "Waktu menunggu thread pool", 0.001),
+        "encode_ms": ("request_encode_seconds", "Waktu encode gambar/payload di worker", 0.001),
+        "provider_ttfb_ms": ("provider_ttfb_seconds", "Permintaan terkirim sampai chunk pertama", 0.001),
+        "ttft_ms": ("time_to_first_token_seconds", "Kirim prompt sampai chunk pertama", 0.001),
+        "total_ms": ("request_total_seconds", "Latensi total permintaan", 0.001),
+        "chunks_per_s": ("stream_chunks_per_second", "Laju chunk saat streaming", 1),
+        "chars_per_s": ("stream_chars_per_second", "Laju karakter saat streaming", 1),
+        "render_ms": ("gui_render_seconds", "Waktu render transkrip di thread GUI", 0.001),
+        "payload_bytes": ("request_payload_bytes", "Perkiraan ukuran payload permintaan", 1),
+    }
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, path, prometheus_path, settings=None):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.settings = dict(DEFAULT_METRICS_SETTINGS, **(settings or {}))
+        self.enabled = bool(self.settings["enabled"])
+        self.lock = threading.Lock()
+        self.records = deque(maxlen=int(self.settings["window"]))
+        self.samples = {} # nama -> deque nilai (mis. log_write_ms dari thread penulis log)
+        self.outcomes = {} # (provider, model, outcome) -> jumlah sejak aplikasi dibuka
+        self.queue = queue.Queue()
+        self.thread = None
+        if self.enabled:
+            self.thread = threading.Thread(target=self._run, name="MetricsWriter", daemon=True)
+            self.thread.start()
+
+    # Dipanggil dari thread GUI; penulisan file dilakukan thread metrik
+    def record(self, record):
+        if not self.enabled: return
+        with self.lock:
+            self.records.append(record)
+            key = (record["provider"], record["model"], record["outcome"])
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+        self.queue.put(json.dumps(record))
+
+    # Menulis sisa antrean dan file Prometheus terakhir
+    def close(self, timeout=5.0):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    def _run(self):
+        interval = float(self.settings["prometheus_interval_s"])
+        export_due = None # Waktu ekspor Prometheus berikutnya; None = tidak ada perubahan yang belum diekspor
+        running = True
+        while running:
+            try: line = self.queue.get(timeout=None if export_due is None else max(0.0, export_due - time.monotonic()))
+            except queue.Empty: line = ""
+            lines = []
+            while True: # Baris yang sudah antre ditulis sekaligus
+                if line is None: running = False
+                elif line: lines.append(line)
+                try: line = self.queue.get_nowait()
+                except queue.Empty: break
+            try:
+                if lines:
+                    self._append_lines(lines)
+                    if self.settings["prometheus_textfile"] and export_due is None: export_due = time.monotonic() + interval
+                if export_due is not None and (not running or time.monotonic() >= export_due):
+                    export_due = None
+                    self.export_prometheus(self.prometheus_path)
+            except OSError as e:
+                print(f"Gagal menulis metrik: {e}", file=sys.stderr)
+
+    def observe(self, name, value):
+        if not self.enabled: return
+        with self.lock:
+            self.samples.setdefault(name, deque(maxlen=int(self.settings["window"]))).append(value)
+
+    def _append_lines(self, lines):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= float(self.settings["max_file_mb"]) * 1024 * 1024:
+            keep = int(self.settings["keep_files"])
+            for n in range(keep - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{n}"): os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+            if keep > 0: os.replace(self.path, f"{self.path}.1")
+            else: os.remove(self.path)
+        with open(self.path, 'a', encoding='utf-8') as f: f.write("".join(line + "\n" for line in lines))
+
+    # {(provider, model): {kolom: {"n", "p50", "p90", "p99"}}} dari jendela permintaan terakhir
+    def summary(self):
+        with self.lock: records = list(self.records)
+        groups = {}
+        for record in records: groups.setdefault((record["provider"], record["model"]), []).append(record)
+        result = {}
+        for key, group in groups.items():
+            result[key] = {}
+            for field in self.SUMMARY_FIELDS:
+                values = [r[field] for r in group if r.get(field) is not None]
+                if values: result[key][field] = {"n": len(values), **{f"p{int(q * 100)}": percentile(values, q) for q in self.QUANTILES}}
+        return result
+
+    def sample_summary(self):
+        with self.lock: samples = {name: list(values) for name, values in self.samples.items()}
+        return {name: {"n": len(values), **{f"p{int(q * 100)}": percentile(values, q) for q in self.QUANTILES}}
+                for name, values in samples.items() if values}
+
+    @staticmethod
+    def _labels(**labels):
+        return ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels.items())
+
+    def prometheus_text(self):
+        with self.lock: records = list(self.records); outcomes = dict(self.outcomes)
+        lines = ["# HELP macan_requests_total Jumlah permintaan AI sejak aplikasi dibuka", "# TYPE macan_requests_total counter"]
+        for (provider, model, outcome), count in sorted(outcomes.items()):
+            lines.append(f"macan_requests_total{{{self._labels(provider=provider, model=model, outcome=outcome)}}} {count}")
+        groups = {}
+        for record in records: groups.setdefault((record["provider"], record["model"]), []).append(record)
+        for field, (name, help_text, scale) in self.SUMMARY_FIELDS.items():
+            lines += [f"# HELP macan_{name} {help_text}", f"# TYPE macan_{name} summary"]
+            for (provider, model), group in sorted(groups.items()):
+                values = [r[field] * scale for r in group if r.get(field) is not None]
+                if not values: continue
+                for q in self.QUANTILES:
+                    lines.append(f"macan_{name}{{{self._labels(provider=provider, model=model, quantile=q)}}} {percentile(values, q):.6g}")
+                lines.append(f"macan_{name}_sum{{{self._labels(provider=provider, model=model)}}} {sum(values):.6g}")
+                lines.append(f"macan_{name}_count{{{self._labels(provider=provider, model=model)}}} {len(values)}")
+        for name, entry in sorted(self.sample_summary().items()):
+            metric = f"macan_{name[:-3]}_seconds" if name.endswith("_ms") else f"macan_{name}"
+            lines += [f"# TYPE {metric} summary"]
+            with self.lock: values = list(self.samples[name])
+            scale = 0.001 if name.endswith("_ms") else 1
+            for q in self.QUANTILES: lines.append(f"{metric}{{{self._labels(quantile=q)}}} {entry[f'p{int(q * 100)}'] * scale:.6g}")
+            lines.append(f"{metric}_sum {sum(values) * scale:.6g}"); lines.append(f"{metric}_count {len(values)}")
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: f.write(self.prometheus_text())
+        os.replace(tmp_path, path) # Pengumpul tidak pernah membaca file setengah jadi
+
+# === Workers ===
+# --- OPTIMISASI: Logika streaming per provider dipisah menjadi generator biasa ---
+# Dipakai bersama oleh worker GUI (QObject + sinyal) dan mode batch tanpa GUI (thread pool).
+# metrics (opsional): RequestMetrics yang menerima waktu encode gambar, ukuran payload dan saat permintaan terkirim
+# handle (opsional): StreamHandle untuk memutus koneksi dari thread lain, juga saat masih menunggu token pertama
+class StreamHandle:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.closed = False
+        self.target = None
+
+    # Dipanggil generator stream begitu objek respons ada; jika sudah ditutup, respons langsung diputus
+    def attach(self, target):
+        with self.lock:
+            self.target = target; closed = self.closed
+        if closed: self._close_target(target)
+
+    def close(self):
+        with self.lock:
+            self.closed = True; target = self.target
+        if target is not None: self._close_target(target)
+
+    @staticmethod
+    def _close_target(target):
+        for name in ("close", "cancel"):
+            method = getattr(target, name, None)
+            if callable(method):
+                try: method()
+                except Exception: pass
+                return
+
+def stream_gemini(client_manager, api_key, model_name, generation_config, history, user_prompt_parts, metrics=None, handle=None):
+    model = client_manager.gemini_model(api_key, model_name)
+
+    gemini_history = []
+    for msg in history:
+        role = "model" if msg["role"] == "assistant" else msg["role"]
+        content = msg.get("content", "")
+        gemini_history.append({'role': role, 'parts': [content]})
+
+    prompt_parts = []; payload_bytes = sum(len(m["content"].encode('utf-8')) for m in history if isinstance(m.get("content"), str))
+    for part in user_prompt_parts:
+        if isinstance(part, ImagePart):
+            start = time.perf_counter()
+            image = part.prepare("gemini") # Blob inline yang sudah diperkecil
+            if metrics: metrics.add("encode_images_ms", (time.perf_counter() - start) * 1000)
+            prompt_parts.append({"mime_type": image["mime_type"], "data": image["data"]}); payload_bytes += len(image["data"])
+        else: prompt_parts.append(part); payload_bytes += len(part.encode('utf-8'))
+    if metrics: metrics.add("payload_bytes", payload_bytes); metrics.mark("request_sent")
+    chat = model.start_chat(history=gemini_history)
+    response = chat.send_message(prompt_parts, stream=True, generation_config=generation_config)
+    if handle is not None: handle.attach(getattr(response, "_iterator", None) or response) # Stream gRPC/REST di balik respons
+    for chunk in response:
+        if handle is not None and handle.closed: return
+        if chunk.text: yield chunk.text
+
+def stream_openai(client_manager, api_key, model_name, history, user_prompt_parts, metrics=None, handle=None):
+    client = client_manager.openai_client(api_key)
+    messages = list(history)
+
+    openai_prompt_content = []
+    for part in user_prompt_parts:
+        if isinstance(part, str):
+            openai_prompt_content.append({"type": "text", "text": part})
+        elif isinstance(part, ImagePart):
+            start = time.perf_counter()
+            image = part.prepare("openai")
+            base64_image = base64.b64encode(image["data"]).decode('utf-8')
+            if metrics: metrics.add("encode_images_ms", (time.perf_counter() - start) * 1000)
+            openai_prompt_content.append({
+                "type": "image_url",
+                "image_url": {"url": f"data:{image['mime_type']};base64,{base64_image}"}
+            })
+
+    messages.append({"role": "user", "content": openai_prompt_content})
+    if metrics: metrics.add("payload_bytes", len(json.dumps(messages))); metrics.mark("request_sent")
+
+    stream = client.chat.completions.create(
+        model=model_name,
+        messages=messages,
+        stream=True
+    )
+    if handle is not None: handle.attach(stream)
+    try:
+        for chunk in stream:
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            if content: yield content
+    finally:
+        stream.close() # Juga saat konsumen berhenti lebih awal (dibatalkan)
+
+def gemini_error_message(e):
+    error_message = f"Error dari Gemini API: {str(e)}"
+    if "API key not valid" in str(e):
+        error_message = "API Key Google Gemini tidak valid. Mohon periksa kembali."
+    elif "location" in str(e) and "is not supported" in str(e):
+         error_message = "Lokasi Anda mungkin tidak didukung oleh API. Coba gunakan VPN."
+    return error_message
+
+def openai_error_message(e):
+    error_message = f"Error dari OpenAI API: {str(e)}"
+    if "Incorrect API key" in str(e):
+        error_message = "API Key OpenAI tidak valid. Mohon periksa kembali."
+    return error_message
+
+# --- OPTIMISASI: Worker sekarang mendukung streaming ---
+class GeminiWorker(QObject):
+    finished = Signal(str) # Sinyal saat seluruh respons selesai
+    chunk_received = Signal(str) # Sinyal untuk setiap potongan data
+    error = Signal(str)
+    cancelled = Signal(str) # Sinyal saat dihentikan pengguna, membawa respons parsial
+
+    def __init__(self, api_key, model_name, generation_config, history, user_prompt_parts, client_manager):
+        super().__init__()
+        self.client_manager = client_manager
+        self.api_key = api_key
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.history = history
+        self.user_prompt_parts = user_prompt_parts
+        self.full_response = ""
+        self.cache_status = None # "miss" jika cache respons aktif
+        self.metrics = None # RequestMetrics (opsional)
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        if not GEMINI_AVAILABLE:
+            self.error.emit("Pustaka Google Gemini (google-generativeai) tidak terinstal.\nSilakan jalankan: pip install google-generativeai Pillow")
+            return
+        try:
+            for text in stream_gemini(self.client_manager, self.api_key, self.model_name, self.generation_config, self.history, self.user_prompt_parts, self.metrics):
+                if self.cancel_event.is_set():
+                    self.cancelled.emit(self.full_response); return
+                if self.metrics: self.metrics.chunk(text)
+                self.full_response += text
+                self.chunk_received.emit(text)
+
+            self.finished.emit(self.full_response)
+
+        except Exception as e:
+            self.error.emit(gemini_error_message(e))
+
+class OpenAIWorker(QObject):
+    finished = Signal(str)
+    chunk_received = Signal(str)
+    error = Signal(str)
+    cancelled = Signal(str)
+
+    def __init__(self, api_key, model_name, history, user_prompt_parts, client_manager):
+        super().__init__()
+        self.client_manager = client_manager
+        self.api_key = api_key
+        self.model_name = model_name
+        self.history = history
+        self.user_prompt_parts = user_prompt_parts
+        self.full_response = ""
+        self.cache_status = None # "miss" jika cache respons aktif
+        self.metrics = None # RequestMetrics (opsional)
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        if not OPENAI_AVAILABLE:
+            self.error.emit("Pustaka OpenAI (openai) tidak terinstal.\nSilakan jalankan: pip install openai")
+            return
+        try:
+            for text in stream_openai(self.client_manager, self.api_key, self.model_name, self.history, self.user_prompt_parts, self.metrics):
+                if self.cancel_event.is_set():
+                    self.cancelled.emit(self.full_response); return # Keluar dari loop menutup stream HTTP
+                if self.metrics: self.metrics.chunk(text)
+                self.full_response += text
+                self.chunk_received.emit(text)
+
+            self.finished.emit(self.full_response)
+
+        except Exception as e:
+            self.error.emit(openai_error_message(e))
+
+
+# === Mode Balapan / Hedge Antar Provider ===
+# --- OPTIMISASI: Prompt yang sama dikirim ke Gemini dan OpenAI; stream yang lebih dulu menghasilkan token yang ditampilkan ---
+# "race" mengirim ke keduanya sekaligus; "hedge" mengirim ke provider kedua hanya jika provider utama belum
+# menghasilkan token setelah hedge_delay_ms (atau langsung jika provider utama gagal). Provider utama dipilih dari
+# statistik latensi, jadi provider/region yang lambat atau sering gagal berhenti memengaruhi latensi yang dirasakan.
+DEFAULT_RACE_SETTINGS = {
+    "mode": "off", # "off", "race" atau "hedge"
+    "hedge_delay_ms": "auto", # Angka, atau "auto" = 1.5x EWMA time-to-first-token provider utama
+    "ewma_alpha": 0.2
+}
+
+class ProviderLatencyStats:
+    DEFAULT_TTFT_S = 1.0 # Perkiraan awal sebelum ada sampel
+    ERROR_PENALTY = 4.0
+
+    def __init__(self, alpha=0.2):
+        self.alpha = float(alpha)
+        self.lock = threading.Lock()
+        self.stats = {} # provider -> {"ttft_ewma_s", "error_rate", "samples", "errors", "wins"}
+
+    def _entry(self, provider):
+        return self.stats.setdefault(provider, {"ttft_ewma_s": None, "error_rate": 0.0, "samples": 0, "errors": 0, "wins": 0})
+
+    def record_ttft(self, provider, seconds, won=False):
+        with self.lock:
+            entry = self._entry(provider)
+            entry["ttft_ewma_s"] = seconds if entry["ttft_ewma_s"] is None else (1 - self.alpha) * entry["ttft_ewma_s"] + self.alpha * seconds
+            entry["error_rate"] *= (1 - self.alpha); entry["samples"] += 1
+            if won: entry["wins"] += 1
+
+    # Provider yang kalah dibatalkan sebelum token pertamanya; waktu tunggunya hanya batas bawah TTFT
+    def record_censored(self, provider, seconds):
+        with self.lock:
+            entry = self._entry(provider)
+            if entry["ttft_ewma_s"] is None or seconds > entry["ttft_ewma_s"]:
+                entry["ttft_ewma_s"] = seconds if entry["ttft_ewma_s"] is None else (1 - self.alpha) * entry["ttft_ewma_s"] + self.alpha * seconds
+
+    def record_error(self, provider):
+        with self.lock:
+            entry = self._entry(provider)
+            entry["error_rate"] = (1 - self.alpha) * entry["error_rate"] + self.alpha; entry["errors"] += 1
+
+    def ttft(self, provider):
+        with self.lock:
+            value = self.stats.get(provider, {}).get("ttft_ewma_s")
+        return self.DEFAULT_TTFT_S if value is None else value
+
+    def score(self, provider):
+        with self.lock:
+            error_rate = self.stats.get(provider, {}).get("error_rate", 0.0)
+        return self.ttft(provider) * (1 + self.ERROR_PENALTY * error_rate)
+
+    def ranked(self, providers):
+        return sorted(providers, key=self.score)
+
+    def snapshot(self):
+        with self.lock:
+            return {p: dict(e) for p, e in self.stats.items()}
+
+class RaceWorker(QObject):
+    finished = Signal(str)
+    chunk_received = Signal(str)
+    error = Signal(str)
+    cancelled = Signal(str)
+    winner_chosen = Signal(str)
+
+    # contenders: [(provider, fungsi(metrics, handle) yang mengembalikan generator teks)], provider utama lebih dulu
+    # request_slots: RequestExecutor.slots; setiap peserta memegang satu slot selama streamnya berjalan
+    def __init__(self, contenders, mode, hedge_delay_s, latency_stats, request_slots=None):
+        super().__init__()
+        self.contenders = contenders
+        self.mode = mode
+        self.hedge_delay_s = hedge_delay_s if mode == "hedge" else 0.0
+        self.latency_stats = latency_stats
+        self.full_response = ""
+        self.cache_status = None
+        self.cancel_event = threading.Event()
+        self.cond = threading.Condition()
+        self.winner = None
+        self.started = {} # provider -> waktu mulai
+        self.handles = {} # provider -> StreamHandle
+        self.request_slots = request_slots
+        self.ended = set()
+        self.errors = {}
+        self.ttft_ms = {}
+        self.race_info = None
+        self.metrics = None
+
+    def cancel(self):
+        self.cancel_event.set()
+        with self.cond:
+            handles = list(self.handles.values()); self.cond.notify_all()
+        for handle in handles: handle.close()
+
+    # Slot (jika ada) sudah dipegang pemanggil dan dilepas saat peserta selesai
+    def _start(self, provider, factory):
+        with self.cond:
+            self.started[provider] = time.monotonic(); self.handles[provider] = StreamHandle()
+        threading.Thread(target=self._run_contender, args=(provider, factory), name=f"Race-{provider}", daemon=True).start()
+
+    # Dipanggil dengan self.cond terkunci; stream peserta lain langsung diputus, juga yang masih menunggu token pertama
+    def _declare_winner(self, provider, contender_metrics):
+        self.winner = provider; self.cond.notify_all()
+        if self.metrics: self.metrics.merge_contender(contender_metrics)
+        for other, handle in self.handles.items():
+            if other != provider: handle.close()
+
+    def _run_contender(self, provider, factory):
+        started = self.started[provider]; handle = self.handles[provider]
+        contender_metrics = RequestMetrics() # Hanya diisi thread ini; tidak ada tulis bersamaan antar-peserta
+        try:
+            for text in factory(contender_metrics, handle):
+                if self.cancel_event.is_set(): return
+                if self.winner is None:
+                    with self.cond:
+                        if self.winner is None:
+                            self._declare_winner(provider, contender_metrics)
+                            elapsed = time.monotonic() - started
+                            self.ttft_ms[provider] = round(elapsed * 1000, 1)
+                            self.latency_stats.record_ttft(provider, elapsed, won=True)
+                            self.winner_chosen.emit(provider)
+                if self.winner != provider: break
+                if self.metrics: self.metrics.chunk(text)
+                self.full_response += text
+                self.chunk_received.emit(text)
+            with self.cond:
+                if self.winner is None: self._declare_winner(provider, contender_metrics) # Jawaban kosong tetap dihitung selesai
+            if self.winner != provider: self.latency_stats.record_censored(provider, time.monotonic() - started)
+        except Exception as e:
+            if self.cancel_event.is_set(): return
+            if self.winner is not None and self.winner != provider: # Diputus karena kalah, bukan kegagalan provider
+                self.latency_stats.record_censored(provider, time.monotonic() - started); return
+            message = gemini_error_message(e) if provider == "gemini" else openai_error_message(e)
+            self.errors[provider] = message; self.latency_stats.record_error(provider)
+        finally:
+            if self.request_slots is not None: self.request_slots.release()
+            with self.cond:
+                self.ended.add(provider); self.cond.notify_all()
+
+    def run(self):
+        primary, primary_factory = self.contenders[0]
+        if self.request_slots is not None and not acquire_slot(self.request_slots, self.cancel_event):
+            self.race_info = {"mode": self.mode, "winner": None, "contenders": [], "ttft_ms": {}, "errors": {}}
+            self.cancelled.emit(""); return
+        self._start(primary, primary_factory)
+        if len(self.contenders) > 1:
+            with self.cond: # Hedge: tunggu token pertama dari provider utama, kegagalannya, atau habisnya waktu tunda
+                self.cond.wait_for(lambda: self.winner is not None or primary in self.ended or self.cancel_event.is_set(),
+                                   timeout=self.hedge_delay_s)
+            # Hedge hanya jika masih ada slot kosong; batas permintaan bersamaan tidak dilampaui demi balapan
+            if self.winner is None and not self.cancel_event.is_set() \
+                    and (self.request_slots is None or self.request_slots.acquire(blocking=False)):
+                self._start(*self.contenders[1])
+        with self.cond: # Provider yang kalah tidak ditunggu; streamnya sudah diputus saat pemenang dipilih
+            self.cond.wait_for(lambda: self.cancel_event.is_set() or (self.winner is not None and self.winner in self.ended)
+                               or self.ended >= set(self.started))
+        self.race_info = {"mode": self.mode, "winner": self.winner if self.winner not in self.errors else None,
+                          "contenders": list(self.started), "ttft_ms": dict(self.ttft_ms), "errors": dict(self.errors)}
+        if self.cancel_event.is_set():
+            self.cancelled.emit(self.full_response)
+        elif self.winner is not None and self.winner not in self.errors:
+            self.finished.emit(self.full_response)
+        else:
+            self.error.emit("\n".join(self.errors.values()) or "Tidak ada provider yang menjawab.")
+
+class MapReduceWorker(QObject):
+    finished = Signal(str)
+    chunk_received = Signal(str)
+    error = Signal(str)
+    cancelled = Signal(str)
+    progress = Signal(int, int) # (langkah selesai, total langkah)
+
+    MAP_PROMPT = ("Berikut bagian {index}/{total} dari file '{name}'.\nTugas pengguna: {task}\n\n"
+                  "Catat secara ringkas semua informasi dari bagian ini yang relevan dengan tugas tersebut. "
+                  "Jika tidak ada yang relevan, jawab persis: TIDAK ADA\n\n--- MULAI BAGIAN ---\n{text}\n--- SELESAI BAGIAN ---")
+    REDUCE_PROMPT = ("Gabungkan catatan berikut (dari beberapa bagian file '{name}') menjadi satu catatan ringkas yang "
+                     "tetap memuat semua informasi relevan untuk tugas: {task}\n\n{notes}")
+    FINAL_PROMPT = ("File '{name}' terlalu besar untuk dikirim utuh, jadi isinya sudah diproses per bagian. "
+                    "Berikut catatan dari bagian-bagian file tersebut:\n\n{notes}\n\nBerdasarkan catatan tersebut, kerjakan tugas pengguna: {task}")
+    EMPTY_NOTE = "TIDAK ADA"
+
+    # stream_factory(history, prompt_parts, metrics=None, handle=None) -> generator teks (stream_gemini/stream_openai yang sudah diikat ke provider)
+    # request_slots: RequestExecutor.slots; setiap panggilan map/reduce dan permintaan akhir memegang satu slot
+    def __init__(self, stream_factory, attachment, task, history, settings, error_formatter, reduce_budget_tokens, request_slots=None):
+        super().__init__()
+        self.stream_factory = stream_factory
+        self.attachment = attachment
+        self.task = task or "Ringkas isi file ini."
+        self.history = history
+        self.settings = dict(DEFAULT_ATTACHMENT_SETTINGS, **(settings or {}))
+        self.error_formatter = error_formatter
+        self.reduce_budget_tokens = reduce_budget_tokens
+        self.full_response = ""
+        self.cache_status = None
+        self.metrics = None
+        self.cancel_event = threading.Event()
+        self.request_slots = request_slots
+        self.lock = threading.Lock()
+        self.handles = set() # StreamHandle permintaan yang sedang berjalan; diputus saat dibatalkan
+
+    def cancel(self):
+        self.cancel_event.set()
+        with self.lock: handles = list(self.handles)
+        for handle in handles: handle.close()
+
+    # Mengambil slot batas permintaan global; None jika dibatalkan selagi menunggu
+    def _open_request(self):
+        if self.request_slots is not None and not acquire_slot(self.request_slots, self.cancel_event): return None
+        handle = StreamHandle()
+        with self.lock: self.handles.add(handle)
+        if self.cancel_event.is_set(): handle.close()
+        return handle
+
+    def _close_request(self, handle):
+        with self.lock: self.handles.discard(handle)
+        if self.request_slots is not None: self.request_slots.release()
+
+    # Satu panggilan non-stream (tahap map/reduce) dengan percobaan ulang untuk 429/5xx; slot dilepas selama jeda percobaan ulang
+    def _complete(self, prompt):
+        for attempt in range(int(self.settings["max_retries"]) + 1):
+            handle = self._open_request()
+            if handle is None: return ""
+            parts = []
+            try:
+                for text in self.stream_factory([], [prompt], None, handle):
+                    if self.cancel_event.is_set(): return ""
+                    parts.append(text)
+                return "".join(parts)
+            except Exception as e:
+                if self.cancel_event.is_set(): return ""
+                if not is_retryable_error(e) or attempt == int(self.settings["max_retries"]): raise
+            finally:
+                self._close_request(handle)
+            if self.cancel_event.wait(min(30.0, 2 ** attempt)): return ""
+
+    # Menjalankan prompt secara paralel dengan jumlah permintaan berjalan dibatasi; prompt dibuat saat akan dikirim
+    def _run_bounded(self, count, make_prompt, on_done):
+        results = [None] * count
+        limit = max(1, int(self.settings["map_concurrency"]))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=limit) as pool:
+            pending = {}; next_index = 0
+            while (next_index < count or pending):
+                while next_index < count and len(pending) < limit and not self.cancel_event.is_set():
+                    pending[pool.submit(self._complete, make_prompt(next_index))] = next_index; next_index += 1
+                if not pending: break
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future); results[index] = future.result(); on_done()
+        return results
+
+    def _group_notes(self, notes):
+        budget_chars = self.reduce_budget_tokens * 4
+        groups = [[]]; size = 0
+        for note in notes:
+            if groups[-1] and size + len(note) > budget_chars: groups.append([]); size = 0
+            groups[-1].append(note); size += len(note)
+        return groups
+
+    def run(self):
+        try:
+            chunk_bytes = int(self.settings["chunk_tokens"]) * 4
+            f, mm = self.attachment.open_map()
+            try:
+                bounds = FileAttachment.chunk_bounds(mm, self.attachment.size, chunk_bytes)
+                total_steps = len(bounds) + 1; done_steps = [0]
+                def step():
+                    done_steps[0] += 1; self.progress.emit(done_steps[0], total_steps)
+                self.progress.emit(0, total_steps)
+                # Tahap map: hanya bagian yang sedang dikirim yang didekode ke memori
+                notes = self._run_bounded(len(bounds), lambda i: self.MAP_PROMPT.format(
+                    index=i + 1, total=len(bounds), name=self.attachment.name, task=self.task,
+                    text=mm[bounds[i][0]:bounds[i][1]].decode('utf-8', errors='replace')), step)
+            finally:
+                mm.close(); f.close()
+            if self.cancel_event.is_set():
+                self.cancelled.emit(""); return
+            notes = [f"[Bagian {i + 1}] {note.strip()}" for i, note in enumerate(notes) if note and note.strip() != self.EMPTY_NOTE]
+            # Tahap reduce bertingkat sampai semua catatan muat dalam satu permintaan
+            while len(notes) > 1 and sum(len(n) for n in notes) > self.reduce_budget_tokens * 4 and not self.cancel_event.is_set():
+                groups = self._group_notes(notes)
+                if len(groups) == len(notes): notes = [n[:self.reduce_budget_tokens * 4 // len(notes)] for n in notes]; break
+                total_steps += len(groups)
+                notes = self._run_bounded(len(groups), lambda i: self.REDUCE_PROMPT.format(
+                    name=self.attachment.name, task=self.task, notes="\n\n".join(groups[i])), step)
+            if self.cancel_event.is_set():
+                self.cancelled.emit(""); return
+            final_prompt = self.FINAL_PROMPT.format(name=self.attachment.name, task=self.task,
+                                                    notes="\n\n".join(notes) or "(Tidak ada bagian yang relevan.)")
+            handle = self._open_request()
+            if handle is None:
+                self.cancelled.emit(""); return
+            try:
+                # Hanya permintaan akhir yang diukur; tahap map/reduce terhitung sebagai encode
+                for text in self.stream_factory(self.history, [final_prompt], self.metrics, handle):
+                    if self.cancel_event.is_set():
+                        self.cancelled.emit(self.full_response); return
+                    if self.metrics: self.metrics.chunk(text)
+                    self.full_response += text
+                    self.chunk_received.emit(text)
+            finally:
+                self._close_request(handle)
+            if self.cancel_event.is_set():
+                self.cancelled.emit(self.full_response); return
+            step()
+            self.finished.emit(self.full_response)
+        except Exception as e:
+            if self.cancel_event.is_set(): self.cancelled.emit(self.full_response) # Stream diputus oleh cancel()
+            else: self.error.emit(self.error_formatter(e))
+
+# === Cache Respons ===
+# --- OPTIMISASI: Cache respons opsional di disk (SQLite) di depan GeminiWorker/OpenAIWorker ---
+# Kunci = hash provider, model, generation_config, histori dan bagian prompt (gambar via hash isinya).
+# Penggusuran: TTL, lalu LRU sampai jumlah entri dan ukuran total di bawah batas.
+DEFAULT_RESPONSE_CACHE_SETTINGS = {
+    "enabled": False,
+    "ttl_seconds": 7 * 24 * 3600,
+    "max_entries": 2000,
+    "max_mb": 50
+}
+
+class ResponseCache:
+    def __init__(self, path, settings=None):
+        self.path = path
+        self.settings = dict(DEFAULT_RESPONSE_CACHE_SETTINGS, **(settings or {}))
+        self.conn = None
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _open(self):
+        if self.conn is None:
+            try:
+                self.conn = sqlite3.connect(self.path)
+                self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY, response TEXT, created REAL, last_access REAL, size INTEGER)""")
+            except sqlite3.DatabaseError:
+                if self.conn is not None: self.conn.close()
+                if os.path.exists(self.path): os.remove(self.path) # File cache rusak: mulai dari kosong
+                self.conn = None; return self._open()
+        return self.conn
+
+    @property
+    def enabled(self):
+        return bool(self.settings["enabled"])
+
+    @staticmethod
+    def make_key(provider, model, generation_config, history, user_prompt_parts):
+        # Dipanggil di thread GUI: gambar dikenali dari path, ukuran dan mtime (stat saja), bukan hash seluruh isinya
+        parts = [ResponseCache._image_identity(p.path) if isinstance(p, ImagePart) else p for p in user_prompt_parts]
+        payload = json.dumps({"provider": provider, "model": model, "generation_config": generation_config or {},
+                              "history": history, "prompt": parts}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _image_identity(path):
+        st = os.stat(path)
+        return {"image": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def get(self, key):
+        conn = self._open(); now = time.time()
+        row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row and now - row[1] > self.settings["ttl_seconds"]:
+            with conn: conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            row = None
+        if row is None:
+            self.stats["misses"] += 1; return None
+        with conn: conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        self.stats["hits"] += 1
+        return row[0]
+
+    def put(self, key, response):
+        conn = self._open(); now = time.time()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO responses (key, response, created, last_access, size) VALUES (?, ?, ?, ?, ?)",
+                         (key, response, now, now, len(response.encode('utf-8'))))
+            conn.execute("DELETE FROM responses WHERE created < ?", (now - self.settings["ttl_seconds"],))
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            max_bytes = self.settings["max_mb"] * 1024 * 1024
+            if count > self.settings["max_entries"] or total > max_bytes:
+                for old_key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+                    if count <= self.settings["max_entries"] and total <= max_bytes: break
+                    conn.execute("DELETE FROM responses WHERE key = ?", (old_key,)); count -= 1; total -= size
+
+    def clear(self):
+        conn = self._open()
+        with conn: conn.execute("DELETE FROM responses")
+
+# Memutar ulang respons dari cache lewat sinyal yang sama dengan worker API, jadi jalur UI tidak berubah
+class CachedReplayWorker(QObject):
+    finished = Signal(str)
+    chunk_received = Signal(str)
+    error = Signal(str)
+    cancelled = Signal(str)
+    REPLAY_CHUNK_CHARS = 256
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+        self.cache_status = "hit"
+        self.metrics = None
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        for start in range(0, len(self.response), self.REPLAY_CHUNK_CHARS):
+            if self.cancel_event.is_set():
+                self.cancelled.emit(self.response[:start]); return
+            if self.metrics: self.metrics.chunk(self.response[start:start + self.REPLAY_CHUNK_CHARS])
+            self.chunk_received.emit(self.response[start:start + self.REPLAY_CHUNK_CHARS])
+        self.finished.emit(self.response)
+
+# === Suara ===
+# --- OPTIMISASI: Satu thread TTS berumur panjang yang memiliki engine pyttsx3 (engine tidak thread-safe) ---
+# Thread GUI hanya mengantrekan perintah; thread layanan menjalankan loop eksternal pyttsx3 (startLoop(False) + iterate)
+# dan memberi engine satu ucapan pada satu waktu, jadi "lewati" dan "hentikan" berlaku dalam satu putaran polling.
+# Dalam mode streaming, kalimat yang sudah lengkap dibacakan selagi jawaban masih mengalir.
+DEFAULT_TTS_SETTINGS = {
+    "rate": 150,
+    "stream_sentences": False, # Bacakan kalimat selagi jawaban di-stream
+    "max_sentence_chars": 220 # Kalimat yang lebih panjang dipotong di spasi agar suara cepat mulai
+}
+
+class SentenceSplitter:
+    BOUNDARY = re.compile(r'[.!?…]+["\'”)\]]*\s+|\n+')
+    MARKUP = re.compile(r'[*_#`>|]+')
+
+    def __init__(self, max_chars=220):
+        self.max_chars = int(max_chars)
+        self.buffer = ""
+        self.in_code = False # Isi blok kode ``` tidak dibacakan
+
+    # Mengembalikan kalimat yang sudah lengkap; sisanya ditahan sampai potongan berikutnya
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        while self.buffer:
+            match = self.BOUNDARY.search(self.buffer)
+            if match is not None and match.end() <= self.max_chars: cut = match.end()
+            elif len(self.buffer) > self.max_chars:
+                cut = self.buffer.rfind(" ", 0, self.max_chars) + 1 or self.max_chars
+            elif match is not None: cut = match.end()
+            else: break
+            sentences += self._clean(self.buffer[:cut]); self.buffer = self.buffer[cut:]
+        return sentences
+
+    def flush(self):
+        piece, self.buffer = self.buffer, ""
+        return self._clean(piece)
+
+    def _clean(self, piece):
+        if piece.lstrip().startswith("```"):
+            self.in_code = not self.in_code; return []
+        if self.in_code: return []
+        text = self.MARKUP.sub("", piece).strip()
+        return [text] if any(c.isalnum() for c in text) else []
+
+class TtsService(QObject):
+    speaking_changed = Signal(bool)
+    failed = Signal(str)
+    POLL_S = 0.03 # Selang iterate() saat sedang berbicara; juga batas latensi stop/lewati
+
+    def __init__(self, settings=None):
+        super().__init__()
+        self.settings = dict(DEFAULT_TTS_SETTINGS, **(settings or {}))
+        self.commands = queue.Queue()
+        self.epoch = 0 # Naik setiap stop(); ucapan yang diantrekan sebelumnya dibuang
+        self.thread = None
+        self.speaking = False
+        self.failure = None # Pesan kegagalan engine; say() diabaikan sampai reset_failure() agar error tidak muncul per kalimat
+
+    # --- Dipanggil dari thread GUI ---
+    def say(self, text):
+        if not text.strip() or self.failure is not None: return
+        if self.thread is None or not self.thread.is_alive(): # Engine baru dibuat saat pertama kali dipakai
+            self.thread = threading.Thread(target=self._run, name="TtsService", daemon=True); self.thread.start()
+        self.commands.put(("say", self.epoch, text))
+
+    def skip(self):
+        if self.thread is not None: self.commands.put(("skip", self.epoch, None))
+
+    def stop(self):
+        self.epoch += 1
+        if self.thread is not None: self.commands.put(("stop", self.epoch, None))
+
+    def close(self, timeout=2.0):
+        if self.thread is not None and self.thread.is_alive():
+            self.commands.put(None); self.thread.join(timeout)
+
+    # Engine dicoba lagi pada say() berikutnya (pengaturan berubah atau pengguna meminta bacaan lagi)
+    def reset_failure(self):
+        self.failure = None
+
+    # --- Thread layanan ---
+    def _run(self):
+        try:
+            if sys.platform == "win32": importlib.import_module("comtypes").CoInitialize() # SAPI5 butuh COM di thread ini
+            engine = pyttsx3.init()
+            engine.setProperty('rate', int(self.settings["rate"]))
+        except Exception as e:
+            self.failure = f"Engine TTS tidak dapat dijalankan: {e}"
+            self._drain(); self.failed.emit(self.failure); return
+        current = [None] # Nama ucapan yang sedang dibacakan engine
+        engine.connect('finished-utterance', lambda name, completed: current.__setitem__(0, None) if name == current[0] else None)
+        engine.startLoop(False)
+        pending = deque(); epoch = self.epoch; counter = 0
+        try:
+            while True:
+                try: command = self.commands.get(timeout=self.POLL_S) if current[0] or pending else self.commands.get()
+                except queue.Empty: command = False
+                while command is not False:
+                    if command is None: return
+                    kind, command_epoch, text = command
+                    if kind == "stop":
+                        epoch = command_epoch; pending.clear()
+                        if current[0]: engine.stop(); current[0] = None
+                    elif command_epoch == epoch:
+                        if kind == "say": pending.append(text)
+                        elif kind == "skip" and current[0]: engine.stop(); current[0] = None
+                    try: command = self.commands.get_nowait()
+                    except queue.Empty: command = False
+                if current[0] is None and pending:
+                    counter += 1; current[0] = f"macan-{counter}"
+                    engine.say(pending.popleft(), current[0])
+                engine.iterate()
+                active = current[0] is not None or bool(pending)
+                if active != self.speaking:
+                    self.speaking = active; self.speaking_changed.emit(active)
+        except Exception as e:
+            self.failure = f"Error during text-to-speech: {e}"
+            self.failed.emit(self.failure)
+        finally:
+            if self.speaking: self.speaking = False; self.speaking_changed.emit(False)
+            try: engine.endLoop()
+            except Exception: pass
+            self._drain() # Ucapan yang masih antre tidak dibacakan oleh thread berikutnya
+
+    def _drain(self):
+        while True:
+            try: self.commands.get_nowait()
+            except queue.Empty: return
+
+# --- OPTIMISASI: Pendengar mikrofon berumur panjang ---
+# Perangkat dibuka sekali (saat mikrofon pertama kali dipakai) dan terus dibaca oleh thread penangkap, sehingga
+# ambang energi (noise floor) selalu terkalibrasi tanpa jeda adjust_for_ambient_noise setiap kali tombol ditekan.
+# Segmen ucapan ditentukan oleh VAD energi (mode berkelanjutan) atau oleh tombol (tekan-untuk-bicara), lalu dikenali
+# di thread terpisah lewat backend yang bisa diganti (Google daring, Vosk/Whisper luring).
+DEFAULT_SPEECH_SETTINGS = {
+    "mode": "push_to_talk", # "push_to_talk" atau "continuous"
+    "backend": "google", # Kunci di SPEECH_BACKENDS
+    "language": "id-ID",
+    "device_index": None,
+    "min_energy": 300, # Ambang energi terendah (RMS sampel 16-bit)
+    "energy_ratio": 1.5, # Ambang = noise floor x rasio ini
+    "calibration_s": 2.0, # Konstanta waktu pembaruan noise floor
+    "pause_s": 0.8, # Hening sepanjang ini mengakhiri ucapan (mode berkelanjutan)
+    "preroll_s": 0.3, # Audio sebelum VAD terpicu ikut dikirim agar awal kata tidak terpotong
+    "min_phrase_s": 0.3,
+    "max_phrase_s": 15,
+    "vosk_model_path": "model",
+    "whisper_model": "base",
+    "whisper_language": "indonesian"
+}
+
+def frame_rms(frame):
+    samples = array.array('h', frame) # Microphone merekam paInt16
+    if sys.byteorder == "big": samples.byteswap()
+    return math.sqrt(sum(map(operator.mul, samples, samples)) / len(samples)) if samples else 0.0
+
+class GoogleSpeechBackend:
+    def __init__(self, settings):
+        self.language = settings["language"]
+
+    def recognize(self, recognizer, audio):
+        return recognizer.recognize_google(audio, language=self.language)
+
+# Model luring dimuat sekali per backend, bukan setiap ucapan
+class VoskSpeechBackend:
+    SAMPLE_RATE = 16000
+
+    def __init__(self, settings):
+        self.vosk = importlib.import_module("vosk")
+        self.model = self.vosk.Model(settings["vosk_model_path"])
+
+    def recognize(self, recognizer, audio):
+        rec = self.vosk.KaldiRecognizer(self.model, self.SAMPLE_RATE)
+        rec.AcceptWaveform(audio.get_raw_data(convert_rate=self.SAMPLE_RATE, convert_width=2))
+        return json.loads(rec.FinalResult()).get("text", "")
+
+class WhisperSpeechBackend:
+    SAMPLE_RATE = 16000
+
+    def __init__(self, settings):
+        self.model = importlib.import_module("whisper").load_model(settings["whisper_model"])
+        self.language = settings["whisper_language"] or None
+
+    def recognize(self, recognizer, audio):
+        samples = np.frombuffer(audio.get_raw_data(convert_rate=self.SAMPLE_RATE, convert_width=2), dtype=np.int16).astype(np.float32) / 32768.0
+        return self.model.transcribe(samples, language=self.language, fp16=False).get("text", "")
+
+# Backend lain cukup didaftarkan di sini: kelas dengan __init__(settings) dan recognize(recognizer, audio) -> teks
+SPEECH_BACKENDS = {"google": GoogleSpeechBackend, "vosk": VoskSpeechBackend, "whisper": WhisperSpeechBackend}
+
+class SpeechListener(QObject):
+    recognized = Signal(str)
+    error = Signal(str)
+    status_update = Signal(str)
+
+    def __init__(self, settings=None):
+        super().__init__()
+        self.settings = dict(DEFAULT_SPEECH_SETTINGS, **(settings or {}))
+        self.jobs = queue.Queue() # (AudioData, dari tekan-untuk-bicara?) menunggu dikenali
+        self.stop_event = threading.Event()
+        self.push_to_talk = threading.Event() # Tombol sedang ditekan
+        self.continuous = threading.Event() # Dikte berkelanjutan sedang aktif
+        self.capture_thread = None; self.recognize_thread = None
+        self.noise_floor = None
+
+    # --- Dipanggil dari thread GUI ---
+    def ensure_started(self):
+        if self.capture_thread is not None and self.capture_thread.is_alive(): return
+        self.stop_event.clear()
+        self.capture_thread = threading.Thread(target=self._capture, name="SpeechCapture", daemon=True); self.capture_thread.start()
+        if self.recognize_thread is None or not self.recognize_thread.is_alive():
+            self.recognize_thread = threading.Thread(target=self._recognize_loop, name="SpeechRecognize", daemon=True); self.recognize_thread.start()
+
+    def begin_push_to_talk(self):
+        self.ensure_started(); self.push_to_talk.set()
+        self.status_update.emit("Mendengarkan...")
+
+    def end_push_to_talk(self):
+        self.push_to_talk.clear()
+
+    def set_continuous(self, enabled):
+        if enabled:
+            self.ensure_started(); self.continuous.set(); self.status_update.emit("Dikte aktif...")
+        else:
+            self.continuous.clear(); self.status_update.emit("")
+
+    def set_backend(self, name):
+        self.settings["backend"] = name
+        self.jobs.put(("backend", name)) # Diganti di thread pengenal agar tidak bentrok dengan pengenalan yang berjalan
+
+    def close(self, timeout=2.0):
+        self.stop_event.set(); self.jobs.put(None)
+        for thread in (self.capture_thread, self.recognize_thread):
+            if thread is not None: thread.join(timeout)
+
+    # --- Thread penangkap: satu perangkat terbuka, kalibrasi dan VAD per frame ---
+    def _threshold(self):
+        return max(float(self.settings["min_energy"]), (self.noise_floor or 0.0) * float(self.settings["energy_ratio"]))
+
+    def _capture(self):
+        try:
+            microphone = sr.Microphone(device_index=self.settings["device_index"])
+            source = microphone.__enter__()
+        except Exception as e:
+            self.push_to_talk.clear(); self.continuous.clear()
+            self.error.emit(f"Mikrofon tidak dapat dibuka: {e}"); self.status_update.emit(""); return
+        frame_s = source.CHUNK / float(source.SAMPLE_RATE)
+        alpha = min(1.0, frame_s / float(self.settings["calibration_s"]))
+        preroll = deque(maxlen=max(1, int(float(self.settings["preroll_s"]) / frame_s)))
+        phrase = None; voiced_frames = 0; silence_s = 0.0; from_button = False
+        try:
+            while not self.stop_event.is_set():
+                frame = source.stream.read(source.CHUNK)
+                energy = frame_rms(frame)
+                is_voiced = energy > self._threshold()
+                if phrase is None:
+                    if self.push_to_talk.is_set():
+                        phrase = list(preroll); from_button = True; voiced_frames = 0
+                    elif self.continuous.is_set() and is_voiced:
+                        phrase = list(preroll); from_button = False; voiced_frames = 0; silence_s = 0.0
+                    elif not is_voiced: # Kalibrasi berjalan terus dari frame yang bukan ucapan
+                        self.noise_floor = energy if self.noise_floor is None else (1 - alpha) * self.noise_floor + alpha * energy
+                preroll.append(frame)
+                if phrase is None: continue
+                phrase.append(frame)
+                if is_voiced: voiced_frames += 1; silence_s = 0.0
+                else: silence_s += frame_s
+                duration = len(phrase) * frame_s
+                if from_button: ended = not self.push_to_talk.is_set() or duration >= float(self.settings["max_phrase_s"])
+                else: ended = not self.continuous.is_set() or silence_s >= float(self.settings["pause_s"]) or duration >= float(self.settings["max_phrase_s"])
+                if not ended: continue
+                if from_button and self.push_to_talk.is_set(): self.push_to_talk.clear() # Batas durasi tercapai
+                if voiced_frames * frame_s >= float(self.settings["min_phrase_s"]):
+                    self.jobs.put((sr.AudioData(b"".join(phrase), source.SAMPLE_RATE, source.SAMPLE_WIDTH), from_button))
+                elif from_button:
+                    self.error.emit("Tidak ada suara terdeteksi."); self.status_update.emit("")
+                phrase = None; preroll.clear()
+        except Exception as e:
+            self.error.emit(f"Error mikrofon: {e}")
+        finally:
+            self.push_to_talk.clear(); self.continuous.clear()
+            try: microphone.__exit__(None, None, None)
+            except Exception: pass
+
+    # --- Thread pengenal: backend (dan model luringnya) dibuat sekali lalu dipakai ulang ---
+    def _recognize_loop(self):
+        recognizer = sr.Recognizer(); backend = None
+        while True:
+            job = self.jobs.get()
+            if job is None: return
+            if job[0] == "backend": backend = None; continue
+            audio, from_button = job
+            self.status_update.emit("Memproses suara...")
+            try:
+                if backend is None: backend = SPEECH_BACKENDS[self.settings["backend"]](self.settings)
+                text = (backend.recognize(recognizer, audio) or "").strip()
+                if text: self.recognized.emit(text)
+                elif from_button: self.error.emit("Tidak dapat mengenali ucapan.")
+            except sr.UnknownValueError:
+                if from_button: self.error.emit("Tidak dapat mengenali ucapan.") # Mode berkelanjutan: abaikan derau
+            except sr.RequestError as e: self.error.emit(f"Error layanan pengenalan suara: {e}")
+            except Exception as e: self.error.emit(f"Error pengenalan suara: {e}")
+            finally: self.status_update.emit("Dikte aktif..." if self.continuous.is_set() else "")
+
+# --- OPTIMISASI: Buffer streaming yang menggabungkan potongan dan menggambar ulang maksimal sekali per frame ---
+class StreamRenderBuffer(QObject):
+    FRAME_INTERVAL_MS = 16 # ~60 fps
+
+    def __init__(self, sink, parent=None):
+        super().__init__(parent)
+        self.sink = sink # Dipanggil dengan teks tambahan (hanya bagian baru) setiap flush
+        self.pending = []
+        self.timer = QTimer(self); self.timer.setInterval(self.FRAME_INTERVAL_MS)
+        self.timer.timeout.connect(self.flush)
+
+    def feed(self, chunk):
+        self.pending.append(chunk)
+        if not self.timer.isActive(): self.timer.start()
+
+    def flush(self):
+        if not self.pending:
+            self.timer.stop(); return
+        text = "".join(self.pending); self.pending.clear()
+        self.sink(text)
+
+    def finish(self):
+        self.flush(); self.timer.stop()
+
+    def discard(self):
+        self.pending.clear(); self.timer.stop()
+
+# === Cache Thumbnail ===
+class _ThumbnailJob(QRunnable):
+    def __init__(self, cache, key, source):
+        super().__init__()
+        self.cache = cache; self.key = key; self.source = source
+
+    def run(self):
+        self.cache.decoded.emit(self.key, self.cache.load_or_decode(self.key, self.source))
+
+# --- OPTIMISASI: Thumbnail gelembung chat di-cache (LRU di memori + penyimpanan PNG di disk) ---
+# Kunci: path + mtime + ukuran untuk file, hash konten untuk gambar base64. Dekode berjalan di thread pool;
+# selama belum siap, delegate menggambar placeholder. Penyimpanan disk dipangkas (yang paling lama tidak dipakai) di atas max_store_mb.
+class ThumbnailCache(QObject):
+    thumbnail_ready = Signal(str)
+    decoded = Signal(str, QImage) # Internal: dari thread pool ke thread GUI
+
+    def __init__(self, store_dir, size=200, max_items=256, max_store_mb=100, parent=None):
+        super().__init__(parent)
+        self.store_dir = store_dir
+        self.size = size
+        self.max_items = max_items
+        self.max_store_mb = max_store_mb
+        self.memory = OrderedDict() # key -> QPixmap (QPixmap kosong = gagal didekode)
+        self.pending = set()
+        self.pool = QThreadPool(self); self.pool.setMaxThreadCount(2)
+        self.decoded.connect(self._on_decoded)
+
+    @staticmethod
+    def key_for(source):
+        kind, value = source
+        if kind == "path":
+            try:
+                st = os.stat(value); raw = f"{os.path.abspath(value)}:{st.st_mtime_ns}:{st.st_size}"
+            except OSError: raw = f"{value}:missing"
+        else:
+            raw = value
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def peek(self, key):
+        return self.memory.get(key)
+
+    def get(self, key, source):
+        pixmap = self.memory.get(key)
+        if pixmap is not None:
+            self.memory.move_to_end(key); return pixmap
+        if key not in self.pending:
+            self.pending.add(key)
+            self.pool.start(_ThumbnailJob(self, key, source))
+        return None
+
+    # Dipanggil di thread pool: hanya memakai QImage (QPixmap tidak aman di luar thread GUI)
+    def load_or_decode(self, key, source):
+        store_path = os.path.join(self.store_dir, f"{key}.png")
+        if os.path.exists(store_path):
+            image = QImage(store_path)
+            if not image.isNull():
+                try: os.utime(store_path) # Tandai baru dipakai (pemangkasan membuang yang paling lama)
+                except OSError: pass
+                return image
+        kind, value = source
+        if kind == "base64":
+            buffer = QBuffer(); buffer.setData(QByteArray(base64.b64decode(value))); buffer.open(QBuffer.OpenModeFlag.ReadOnly)
+            reader = QImageReader(buffer)
+        else:
+            reader = QImageReader(value)
+        reader.setAutoTransform(True)
+        full_size = reader.size()
+        if full_size.isValid() and (full_size.width() > self.size or full_size.height() > self.size):
+            # Dekoder (mis. JPEG) bisa langsung mendekode ke ukuran kecil, jauh lebih murah dari dekode penuh
+            reader.setScaledSize(full_size.scaled(self.size, self.size, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull(): return image
+        if image.width() > self.size or image.height() > self.size:
+            image = image.scaled(self.size, self.size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            image.save(store_path, "PNG")
+        except OSError: pass
+        self._prune_store()
+        return image
+
+    def _prune_store(self):
+        limit = int(self.max_store_mb) * 1024 * 1024
+        try:
+            entries = [e for e in os.scandir(self.store_dir) if e.is_file()]
+        except OSError: return
+        total = sum(e.stat().st_size for e in entries)
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= limit: break
+            size = entry.stat().st_size
+            try: os.remove(entry.path); total -= size
+            except OSError: pass
+
+    def _on_decoded(self, key, image):
+        self.pending.discard(key)
+        self.memory[key] = QPixmap.fromImage(image) if not image.isNull() else QPixmap()
+        while len(self.memory) > self.max_items: self.memory.popitem(last=False)
+        self.thumbnail_ready.emit(key)
+
+# === Transkrip Chat (Model/View) ===
+# --- OPTIMISASI: Transkrip berbasis QListView + model + delegate, menggantikan satu QWidget per pesan ---
+# Hanya baris yang terlihat yang digambar; ukuran tiap baris di-cache per lebar viewport.
+class TranscriptModel(QAbstractListModel):
+    RoleRole = Qt.ItemDataRole.UserRole + 1
+    ErrorRole = Qt.ItemDataRole.UserRole + 2
+
+    def __init__(self, thumbnail_cache, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.thumbnail_cache = thumbnail_cache
+        self.rows_by_thumb = {} # thumb_key -> [posisi baris]
+        self.thumbnail_cache.thumbnail_ready.connect(self._on_thumbnail_ready)
+
+    @staticmethod
+    def _row_from_message(message_obj):
+        content = message_obj.get("content")
+        text_content = ""; image_source = None
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text": text_content += part.get("text", "")
+                elif part.get("type") == "image_url":
+                    url_data = part.get("image_url", {}).get("url", "")
+                    if "base64," in url_data: image_source = ("base64", url_data.split("base64,")[1])
+                elif part.get("type") == "image_path": image_source = ("path", part.get("image_path"))
+                elif part.get("type") == "file_ref": # Lampiran file disimpan sebagai referensi
+                    text_content += f"\n📎 {part.get('name', '')} ({format_size(part.get('size', 0))})"
+        else:
+            text_content = content or ""
+        return {"role": message_obj.get("role"), "text": text_content, "image_source": image_source,
+                "thumb_key": None, "error": False, "layout": None} # layout: (lebar, ukuran) terakhir
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid(): return None
+        row = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole: return row["text"]
+        if role == self.RoleRole: return row["role"]
+        if role == self.ErrorRole: return row["error"]
+        return None
+
+    def append_message(self, message_obj):
+        position = len(self.rows)
+        self.beginInsertRows(QModelIndex(), position, position)
+        self.rows.append(self._row_from_message(message_obj))
+        self.endInsertRows()
+        return position
+
+    def set_messages(self, message_objs):
+        self.beginResetModel()
+        self.rows = [self._row_from_message(m) for m in message_objs]
+        self.rows_by_thumb = {}
+        self.endResetModel()
+
+    def clear(self):
+        self.set_messages([])
+
+    def append_text(self, position, text):
+        row = self.rows[position]; row["text"] += text; row["layout"] = None
+        index = self.index(position); self.dataChanged.emit(index, index)
+
+    def set_error(self, position, text):
+        row = self.rows[position]; row["text"] = text; row["error"] = True; row["layout"] = None
+        index = self.index(position); self.dataChanged.emit(index, index)
+
+    def _thumb_key(self, position):
+        row = self.rows[position]
+        if row["thumb_key"] is None:
+            row["thumb_key"] = ThumbnailCache.key_for(row["image_source"])
+            self.rows_by_thumb.setdefault(row["thumb_key"], []).append(position)
+        return row["thumb_key"]
+
+    # Tanpa memicu dekode (dipakai saat menghitung ukuran semua baris); None = belum siap
+    def cached_thumbnail(self, position):
+        if not self.rows[position]["image_source"]: return None
+        return self.thumbnail_cache.peek(self._thumb_key(position))
+
+    # Meminta dekode di latar belakang jika belum ada (dipakai saat baris digambar)
+    def thumbnail(self, position):
+        if not self.rows[position]["image_source"]: return None
+        return self.thumbnail_cache.get(self._thumb_key(position), self.rows[position]["image_source"])
+
+    def _on_thumbnail_ready(self, key):
+        for position in self.rows_by_thumb.get(key, []):
+            self.rows[position]["layout"] = None
+            index = self.index(position); self.dataChanged.emit(index, index)
+
+class BubbleDelegate(QStyledItemDelegate):
+    MARGIN = 5; PADDING = 10; SPACING = 10; ICON_SIZE = 24; THUMB_SIZE = 200
+    COLORS = {"user": QColor("#E0E0E0"), "assistant": QColor("#A0D4E4")}
+
+    # Hitung posisi gelembung, ikon, thumbnail dan teks untuk lebar baris tertentu
+    def _layout(self, option, index):
+        model = index.model(); row = model.rows[index.row()]
+        width = option.rect.width()
+        # Hanya ukuran untuk lebar terakhir yang disimpan; mengubah ukuran jendela tidak menumpuk entri cache
+        cached = row["layout"][1] if row["layout"] is not None and row["layout"][0] == width else None
+        if cached is None:
+            content_max = max(int(width * 0.80) - 2 * self.PADDING - self.ICON_SIZE - self.SPACING, 50)
+            thumb = model.cached_thumbnail(index.row())
+            if thumb is not None: thumb_size = thumb.size()
+            elif row["image_source"]: thumb_size = QSize(self.THUMB_SIZE, self.THUMB_SIZE) # Belum didekode: pakai ukuran maksimum
+            else: thumb_size = QSize(0, 0)
+            text_size = QSize(0, 0)
+            if row["text"]:
+                text_size = option.fontMetrics.boundingRect(QRect(0, 0, content_max, 1 << 24),
+                                                            Qt.TextFlag.TextWordWrap | Qt.TextFlag.TextWrapAnywhere, row["text"]).size()
+            content_w = max(text_size.width(), thumb_size.width())
+            content_h = thumb_size.height() + text_size.height() + (self.SPACING if thumb_size.height() and text_size.height() else 0)
+            bubble = QSize(content_w + 2 * self.PADDING + self.ICON_SIZE + self.SPACING, max(content_h, self.ICON_SIZE) + 2 * self.PADDING)
+            cached = (bubble, thumb_size, text_size); row["layout"] = (width, cached)
+        bubble, thumb_size, text_size = cached
+        rect = option.rect
+        if row["role"] == "user":
+            bubble_rect = QRect(rect.right() - self.MARGIN - bubble.width(), rect.top() + self.MARGIN, bubble.width(), bubble.height())
+            icon_rect = QRect(bubble_rect.right() - self.PADDING - self.ICON_SIZE, bubble_rect.top() + self.PADDING, self.ICON_SIZE, self.ICON_SIZE)
+            content_left = bubble_rect.left() + self.PADDING
+        else:
+            bubble_rect = QRect(rect.left() + self.MARGIN, rect.top() + self.MARGIN, bubble.width(), bubble.height())
+            icon_rect = QRect(bubble_rect.left() + self.PADDING, bubble_rect.top() + self.PADDING, self.ICON_SIZE, self.ICON_SIZE)
+            content_left = icon_rect.right() + 1 + self.SPACING
+        thumb_rect = QRect(content_left, bubble_rect.top() + self.PADDING, thumb_size.width(), thumb_size.height())
+        text_top = thumb_rect.bottom() + 1 + (self.SPACING if thumb_size.height() else 0) if thumb_size.height() else thumb_rect.top()
+        text_rect = QRect(content_left, text_top, text_size.width(), text_size.height())
+        return bubble_rect, icon_rect, thumb_rect, text_rect
+
+    def sizeHint(self, option, index):
+        bubble_rect, _, _, _ = self._layout(option, index)
+        return QSize(option.rect.width(), bubble_rect.height() + 2 * self.MARGIN)
+
+    def paint(self, painter, option, index):
+        model = index.model(); row = model.rows[index.row()]
+        thumb = model.thumbnail(index.row()) # Dekode diminta hanya untuk baris yang terlihat
+        bubble_rect, icon_rect, thumb_rect, text_rect = self._layout(option, index)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen); painter.setBrush(self.COLORS.get(row["role"], self.COLORS["assistant"]))
+        painter.drawRoundedRect(bubble_rect, 15, 15)
+        icon_svg = SVG_USER_ICON if row["role"] == "user" else SVG_BOT_ICON
+        painter.drawPixmap(icon_rect, get_svg_pixmap(icon_svg, self.ICON_SIZE, painter.device().devicePixelRatioF()))
+        if thumb is not None and not thumb.isNull():
+            painter.drawPixmap(thumb_rect, thumb)
+        elif thumb is None and row["image_source"]:
+            painter.setBrush(QColor(0, 0, 0, 30)); painter.drawRoundedRect(thumb_rect, 8, 8) # Placeholder selama dekode
+            painter.setPen(QColor("#555555")); painter.drawText(thumb_rect, int(Qt.AlignmentFlag.AlignCenter), "Memuat gambar...")
+        if row["text"]:
+            painter.setPen(QColor("red") if row["error"] else option.palette.color(option.palette.ColorRole.Text))
+            painter.drawText(text_rect, int(Qt.TextFlag.TextWordWrap | Qt.TextFlag.TextWrapAnywhere), row["text"])
+        painter.restore()
+
+# === Sidebar Riwayat (Model Bertahap) ===
+# --- OPTIMISASI: Daftar percakapan diambil per halaman dari tabel ringkasan di indeks saat pengguna menggulir ---
+# Hanya (id, teks pertama, waktu) yang dimuat; ikon dibagi lewat cache ikon SVG.
+class ConversationListModel(QAbstractListModel):
+    PAGE_SIZE = 200
+
+    def __init__(self, log_index, parent=None):
+        super().__init__(parent)
+        self.log_index = log_index
+        self.rows = [] # [conversation_id, teks tampilan]
+        self.known_ids = set()
+        self.index_offset = 0 # Jumlah baris indeks yang sudah diambil
+        self.exhausted = True # Belum ada yang dimuat sampai reload() dipanggil
+
+    @staticmethod
+    def _display_text(first_text, ts_str):
+        try: ts = datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S').strftime('%d/%m %H:%M')
+        except (TypeError, ValueError): ts = "N/A"
+        return f"{ts} - {(first_text or '')[:30]}..."
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid(): return None
+        conv_id, text = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole: return text
+        if role == Qt.ItemDataRole.DecorationRole: return get_svg_icon(SVG_USER_ICON)
+        if role == Qt.ItemDataRole.UserRole: return conv_id
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted: return
+        try: page = self.log_index.summaries_page(self.PAGE_SIZE, self.index_offset)
+        except sqlite3.Error: page = []
+        self.index_offset += len(page)
+        if len(page) < self.PAGE_SIZE: self.exhausted = True
+        # Percakapan baru di puncak indeks menggeser offset; baris yang terambil dua kali dilewati
+        new_rows = [[conv_id, self._display_text(text, ts)] for conv_id, text, ts in page if conv_id not in self.known_ids]
+        if not new_rows: return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(new_rows) - 1)
+        self.rows.extend(new_rows); self.known_ids.update(row[0] for row in new_rows)
+        self.endInsertRows()
+
+    # Memuat ulang dari indeks; baris "Chat Baru" yang belum tercatat di log tetap di atas
+    def reload(self, keep_ids=()):
+        self.beginResetModel()
+        self.rows = [row for row in self.rows if row[0] in keep_ids]
+        self.known_ids = {row[0] for row in self.rows}
+        self.index_offset = 0; self.exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def prepend(self, conversation_id, text):
+        self.beginInsertRows(QModelIndex(), 0, 0)
+        self.rows.insert(0, [conversation_id, text]); self.known_ids.add(conversation_id)
+        self.endInsertRows()
+
+    def remove(self, conversation_id, from_index=True):
+        for row, (conv_id, _) in enumerate(self.rows):
+            if conv_id != conversation_id: continue
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.rows[row]; self.known_ids.discard(conv_id)
+            self.endRemoveRows()
+            if from_index: self.index_offset = max(0, self.index_offset - 1) # Baris indeks setelahnya bergeser naik
+            return
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []; self.known_ids = set(); self.index_offset = 0; self.exhausted = True
+        self.endResetModel()
+
+class SemanticResultsDialog(QDialog):
+    def __init__(self, query, hits, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Percakapan Serupa")
+        self.setGeometry(100, 100, 600, 400)
+        self.selected_conversation_id = None
+
+        layout = QVBoxLayout(self)
+        self.text_area = QTextBrowser()
+        self.text_area.setOpenLinks(False) # Klik hasil membuka percakapannya, bukan URL
+        self.text_area.anchorClicked.connect(self.open_hit)
+        results = [f"<p><a href=\"conv:{html.escape(conv_id)}\"><b>[{html.escape(timestamp)}] {html.escape((role or 'N/A').capitalize())}</b></a>"
+                   f" <i>({score:.0%})</i><br>{html.escape(snippet)}</p>" for conv_id, role, timestamp, score, snippet in hits]
+        if results: self.text_area.setHtml(f"<h3>Mirip dengan: {html.escape(query)}</h3>" + "".join(results))
+        else: self.text_area.setHtml(f"<p>Tidak ada pesan yang mirip dengan '<b>{html.escape(query)}</b>'.</p>")
+        layout.addWidget(self.text_area)
 
-try:
-    import speech_recognition as sr
-    SPEECH_RECOGNITION_AVAILABLE = True
-except ImportError:
-    SPEECH_RECOGNITION_AVAILABLE = False
+        close_button = QPushButton("Tutup")
+        close_button.clicked.connect(self.reject)
+        layout.addWidget(close_button)
 
-# Shortcut enum
-Expanding = QSizePolicy.Policy.Expanding
+    def open_hit(self, url):
+        self.selected_conversation_id = url.toString()[len("conv:"):]
+        self.accept()
 
-# === Path Konfigurasi ===
-BASE_PATH = os.path.dirname(os.path.abspath(__file__))
-CONFIG_PATH = os.path.join(BASE_PATH, "macan_ai_config.json")
-LOG_PATH = os.path.join(BASE_PATH, "macan_ai_chatlog.jsonl")
+class RequestStatsDialog(QDialog):
+    FIELD_LABELS = {"build_ms": "Susun permintaan", "queue_ms": "Antre", "encode_ms": "Encode payload", "provider_ttfb_ms": "TTFB provider",
+                    "ttft_ms": "Token pertama", "total_ms": "Total", "chunks_per_s": "Chunk/detik", "chars_per_s": "Karakter/detik",
+                    "render_ms": "Render GUI", "payload_bytes": "Ukuran payload",
+                    "log_enqueue_ms": "log_chat (antre)", "log_write_ms": "Tulis log (per batch)"}
 
-if not os.path.exists(LOG_PATH):
-    open(LOG_PATH, 'w').close()
+    def __init__(self, recorder, parent=None):
+        super().__init__(parent)
+        self.recorder = recorder
+        self.setWindowTitle("Statistik Permintaan")
+        self.setGeometry(100, 100, 640, 480)
 
-def load_config(path):
-    if not os.path.exists(path):
-        # --- OPTIMISASI: Mengganti model default OpenAI ke gpt-4o-mini ---
-        default_config = {
-            "active_api": "gemini",
-            "gemini": {
-                "api_key": "",
-                "model": "gemini-1.5-flash-latest",
-                "generation_config": {
-                    "temperature": 0.9,
-                    "top_p": 1,
-                    "top_k": 1,
-                    "max_output_tokens": 2048
-                }
-            },
-            "openai": {
-                "api_key": "",
-                "model": "gpt-4o-mini"
-                }
-            }
-        
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(default_config, f, indent=4)
-        return default_config
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        layout = QVBoxLayout(self)
+        self.text_area = QTextBrowser()
+        layout.addWidget(self.text_area)
+        button_row = QHBoxLayout()
+        refresh_button = QPushButton("Segarkan"); refresh_button.clicked.connect(self.refresh)
+        export_button = QPushButton("Ekspor Prometheus..."); export_button.clicked.connect(self.export)
+        close_button = QPushButton("Tutup"); close_button.clicked.connect(self.accept)
+        button_row.addWidget(refresh_button); button_row.addWidget(export_button); button_row.addStretch(1); button_row.addWidget(close_button)
+        layout.addLayout(button_row)
+        self.refresh()
 
-def save_config(path, config_data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(config_data, f, indent=4)
+    @staticmethod
+    def _format(field, value):
+        if value is None: return "-"
+        if field == "payload_bytes": return format_size(value)
+        if field.endswith("_ms"): return f"{value:.0f} ms" if value >= 10 else f"{value:.2f} ms"
+        return f"{value:.1f}"
 
-# === SVG Icons (Tidak Berubah) ===
-SVG_USER_ICON = """
-<svg width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="#60d060" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M20 21v-2a4 4 0 0 0-4-4H8a4 4 0 0 0-4 4v2"></path>
-  <circle cx="12" cy="7" r="4"></circle>
-</svg>
-"""
-SVG_BOT_ICON = """
-<svg width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="#60d060" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-  <path d="M12 12V3"></path>
-  <path d="M18 10h-2"></path>
-  <path d="M8 10H6"></path>
-  <path d="M2 16c0 1.1.9 2 2 2h16a2 2 0 0 0 2-2V8a2 2 0 0 0-2-2H4a2 2 0 0 0-2 2v8z"></path>
-  <path d="M7 21h10"></path>
-</svg>
-"""
+    def _table(self, title, entries):
+        rows = "".join(f"<tr><td>{self.FIELD_LABELS.get(field, field)}</td><td align='right'>{entry['n']}</td>"
+                       + "".join(f"<td align='right'>{self._format(field, entry[p])}</td>" for p in ("p50", "p90", "p99")) + "</tr>"
+                       for field, entry in entries.items())
+        return (f"<h4>{html.escape(title)}</h4><table cellspacing='0' cellpadding='3' border='1'>"
+                f"<tr><th>Metrik</th><th>n</th><th>p50</th><th>p90</th><th>p99</th></tr>{rows}</table>")
 
-def get_svg_icon(svg_string, size=18):
-    renderer = QSvgRenderer(QByteArray(svg_string.encode('utf-8')))
-    pixmap = QPixmap(size, size)
-    pixmap.fill(Qt.GlobalColor.transparent)
-    painter = QPainter(pixmap)
-    renderer.render(painter)
-    painter.end()
-    return QIcon(pixmap)
+    def refresh(self):
+        parts = [self._table(f"{provider.capitalize() or '-'} · {model or '-'}", entries) for (provider, model), entries in sorted(self.recorder.summary().items())]
+        samples = self.recorder.sample_summary()
+        if samples: parts.append(self._table("Log chat", samples))
+        self.text_area.setHtml("".join(parts) or "<p>Belum ada permintaan yang tercatat.</p>")
 
-# === Workers ===
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Ekspor Metrik", "macan_ai_metrics.prom", "Prometheus Text (*.prom *.txt)")
+        if not path: return
+        try: self.recorder.export_prometheus(path)
+        except OSError as e: QMessageBox.critical(self, "Ekspor Metrik", f"Gagal menulis file: {e}")
 
-# --- OPTIMISASI: Worker sekarang mendukung streaming ---
-class GeminiWorker(QObject):
-    finished = Signal(str) # Sinyal saat seluruh respons selesai
-    chunk_received = Signal(str) # Sinyal untuk setiap potongan data
+# === Hasil Pencarian Log (Model Bertahap) ===
+# --- OPTIMISASI: Pencarian berjalan di thread sendiri dan mengirim hasil per halaman ke model ---
+# Halaman berikutnya baru diambil saat daftar digulir (canFetchMore/fetchMore), jadi kata kunci yang sangat umum
+# tidak membekukan GUI ataupun membangun satu dokumen HTML raksasa. Jumlah total hasil dihitung terpisah.
+class LogSearchWorker(QObject):
+    page_ready = Signal(list)
+    count_ready = Signal(int) # Jumlah total hasil (hanya jika indeks FTS tersedia)
+    finished = Signal(bool) # True jika semua hasil sudah dikirim
     error = Signal(str)
+    PREFETCH_PAGES = 2 # Halaman yang diambil sebelum diminta model
 
-    def __init__(self, api_key, model_name, generation_config, history, user_prompt_parts):
+    def __init__(self, log_index, query, page_size):
         super().__init__()
-        self.api_key = api_key
-        self.model_name = model_name
-        self.generation_config = generation_config
-        self.history = history
-        self.user_prompt_parts = user_prompt_parts
-        self.full_response = ""
+        self.log_index = log_index
+        self.query = query
+        self.page_size = page_size
+        self.cancel_event = threading.Event()
+        self.cond = threading.Condition()
+        self.requested = self.PREFETCH_PAGES
+        self.thread = None
 
-    def run(self):
-        if not GEMINI_AVAILABLE:
-            self.error.emit("Pustaka Google Gemini (google-generativeai) tidak terinstal.\nSilakan jalankan: pip install google-generativeai Pillow")
-            return
-        try:
-            genai.configure(api_key=self.api_key)
-            model = genai.GenerativeModel(self.model_name)
-            
-            gemini_history = []
-            for msg in self.history:
-                role = "model" if msg["role"] == "assistant" else msg["role"]
-                content = msg.get("content", "")
-                gemini_history.append({'role': role, 'parts': [content]})
-
-            chat = model.start_chat(history=gemini_history)
-            response = chat.send_message(self.user_prompt_parts, stream=True, generation_config=self.generation_config)
-            
-            for chunk in response:
-                if chunk.text:
-                    self.full_response += chunk.text
-                    self.chunk_received.emit(chunk.text)
-            
-            self.finished.emit(self.full_response)
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="LogSearch", daemon=True); self.thread.start()
 
-        except Exception as e:
-            error_message = f"Error dari Gemini API: {str(e)}"
-            if "API key not valid" in str(e):
-                error_message = "API Key Google Gemini tidak valid. Mohon periksa kembali."
-            elif "location" in str(e) and "is not supported" in str(e):
-                 error_message = "Lokasi Anda mungkin tidak didukung oleh API. Coba gunakan VPN."
-            self.error.emit(error_message)
+    def request_page(self):
+        with self.cond: self.requested += 1; self.cond.notify_all()
 
-class OpenAIWorker(QObject):
-    finished = Signal(str)
-    chunk_received = Signal(str)
-    error = Signal(str)
+    def cancel(self):
+        self.cancel_event.set()
+        with self.cond: self.cond.notify_all()
 
-    def __init__(self, api_key, model_name, history, user_prompt_parts):
-        super().__init__()
-        self.api_key = api_key
-        self.model_name = model_name
-        self.history = history
-        self.user_prompt_parts = user_prompt_parts
-        self.full_response = ""
+    def emit_count(self):
+        total = self.log_index.search_count(self.query)
+        if total is not None: self.count_ready.emit(total)
 
     def run(self):
-        if not OPENAI_AVAILABLE:
-            self.error.emit("Pustaka OpenAI (openai) tidak terinstal.\nSilakan jalankan: pip install openai")
-            return
         try:
-            client = openai.OpenAI(api_key=self.api_key)
-            messages = list(self.history)
-            
-            openai_prompt_content = []
-            for part in self.user_prompt_parts:
-                if isinstance(part, str):
-                    openai_prompt_content.append({"type": "text", "text": part})
-                elif isinstance(part, Image.Image):
-                    buffered = QByteArray()
-                    buffer = QBuffer(buffered)
-                    buffer.open(QBuffer.OpenModeFlag.WriteOnly)
-                    part.save(buffer, "PNG")
-                    base64_image = buffered.toBase64().data().decode('utf-8')
-                    openai_prompt_content.append({
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/png;base64,{base64_image}"}
-                    })
-
-            messages.append({"role": "user", "content": openai_prompt_content})
-
-            stream = client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                stream=True
-            )
-            for chunk in stream:
-                content = chunk.choices[0].delta.content
-                if content:
-                    self.full_response += content
-                    self.chunk_received.emit(content)
+            delivered = 0
+            for page in self.log_index.search_pages(self.query, self.page_size, cancel_event=self.cancel_event):
+                with self.cond: # Menunggu model meminta halaman berikutnya
+                    self.cond.wait_for(lambda: self.cancel_event.is_set() or self.requested > delivered)
+                if self.cancel_event.is_set(): return self.finished.emit(False)
+                self.page_ready.emit(page); delivered += 1
+                if delivered == 1: self.emit_count() # Dihitung setelah halaman pertama agar hasil tampil lebih dulu
+            if delivered == 0: self.emit_count()
+            self.finished.emit(True)
+        except Exception as e:
+            self.error.emit(str(e))
 
-            self.finished.emit(self.full_response)
+class SearchResultsModel(QAbstractListModel):
+    LocationRole = Qt.ItemDataRole.UserRole + 1
 
-        except Exception as e:
-            error_message = f"Error dari OpenAI API: {str(e)}"
-            if "Incorrect API key" in str(e):
-                error_message = "API Key OpenAI tidak valid. Mohon periksa kembali."
-            self.error.emit(error_message)
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = [] # (conversation_id, (segmen, offset), html)
+        self.worker = None
+        self.exhausted = False
+        self.waiting = False # Halaman sudah diminta tapi belum tiba
 
+    def attach(self, worker):
+        self.worker = worker
+        worker.page_ready.connect(self.add_page)
+        worker.finished.connect(self.on_worker_done); worker.error.connect(self.on_worker_done)
 
-class SpeechRecognitionWorker(QObject):
-    finished = Signal(str)
-    error = Signal(str)
-    status_update = Signal(str)
-    def run(self):
-        if not SPEECH_RECOGNITION_AVAILABLE:
-            self.error.emit("Library 'speech_recognition' tidak terinstal."); return
-        r = sr.Recognizer()
-        self.status_update.emit("Mendengarkan...")
-        try:
-            with sr.Microphone() as source:
-                r.adjust_for_ambient_noise(source)
-                audio = r.listen(source, timeout=5, phrase_time_limit=10)
-            self.status_update.emit("Memproses suara...")
-            text = r.recognize_google(audio, language="id-ID")
-            self.finished.emit(text)
-        except sr.UnknownValueError: self.error.emit("Tidak dapat mengenali ucapan.")
-        except sr.RequestError as e: self.error.emit(f"Error layanan Google Speech: {e}")
-        except sr.WaitTimeoutError: self.error.emit("Tidak ada suara terdeteksi.")
-        except Exception as e: self.error.emit(f"Error pengenalan suara: {e}")
-        finally: self.status_update.emit("")
+    def on_worker_done(self, _):
+        self.exhausted = True
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid(): return None
+        conv_id, location, text_html = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole: return text_html
+        if role == Qt.ItemDataRole.UserRole: return conv_id
+        if role == self.LocationRole: return location
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.waiting and self.worker is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent): return
+        self.waiting = True; self.worker.request_page()
+
+    def add_page(self, hits):
+        self.waiting = False
+        if not hits: return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(hits) - 1)
+        for conv_id_full, role, timestamp, location, text_html in hits:
+            sender = html.escape((role or "N/A").capitalize())
+            conv_id = conv_id_full[-6:] if len(conv_id_full) > 6 else conv_id_full
+            self.rows.append((conv_id_full, location, f"<b>[{html.escape(timestamp or 'N/A')}] ({html.escape(conv_id)}) {sender}:</b> {text_html}"))
+        self.endInsertRows()
+
+class HtmlItemDelegate(QStyledItemDelegate):
+    MARGIN = 6
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.document = QTextDocument(self)
+
+    def _layout(self, option, index, width):
+        self.document.setDefaultFont(option.font)
+        self.document.setHtml(index.data() or "")
+        self.document.setTextWidth(max(50, width - 2 * self.MARGIN))
+
+    def paint(self, painter, option, index):
+        self._layout(option, index, option.rect.width())
+        painter.save()
+        if option.state & QStyle.StateFlag.State_Selected: painter.fillRect(option.rect, option.palette.highlight())
+        elif option.state & QStyle.StateFlag.State_MouseOver: painter.fillRect(option.rect, QColor("#eef4ff"))
+        painter.translate(option.rect.left() + self.MARGIN, option.rect.top() + self.MARGIN)
+        self.document.drawContents(painter)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        view = self.parent()
+        self._layout(option, index, view.viewport().width() if view is not None else 400)
+        return QSize(int(self.document.idealWidth()) + 2 * self.MARGIN, int(self.document.size().height()) + 2 * self.MARGIN)
 
 class SearchResultsDialog(QDialog):
-    def __init__(self, results_text, parent=None):
+    hit_activated = Signal(str, object) # (conversation_id, (segmen, offset))
+
+    def __init__(self, log_index, keyword, parent=None):
         super().__init__(parent)
-        self.setWindowTitle("Hasil Pencarian Log")
+        self.setWindowTitle(f"Hasil Pencarian Log: {keyword}")
         self.setGeometry(100, 100, 600, 400)
-        
+        self.keyword = keyword
+        self.total = None; self.complete = False
+
         layout = QVBoxLayout(self)
-        self.text_area = QTextEdit()
-        self.text_area.setReadOnly(True)
-        self.text_area.setHtml(results_text)
-        layout.addWidget(self.text_area)
-        
-        close_button = QPushButton("Tutup")
-        close_button.clicked.connect(self.accept)
-        layout.addWidget(close_button)
+        self.count_label = QLabel("Mencari...")
+        layout.addWidget(self.count_label)
+        self.model = SearchResultsModel(self)
+        self.results_view = QListView(); self.results_view.setModel(self.model)
+        self.results_view.setItemDelegate(HtmlItemDelegate(self.results_view))
+        self.results_view.setWordWrap(True); self.results_view.setMouseTracking(True)
+        self.results_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.results_view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.results_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.results_view.setToolTip("Klik hasil untuk membuka percakapan pada pesan tersebut")
+        self.results_view.clicked.connect(lambda index: self.hit_activated.emit(index.data(Qt.ItemDataRole.UserRole), index.data(SearchResultsModel.LocationRole)))
+        layout.addWidget(self.results_view)
+
+        button_row = QHBoxLayout()
+        self.cancel_button = QPushButton("Batalkan"); self.cancel_button.clicked.connect(self.cancel_search)
+        close_button = QPushButton("Tutup"); close_button.clicked.connect(self.accept)
+        button_row.addWidget(self.cancel_button); button_row.addStretch(1); button_row.addWidget(close_button)
+        layout.addLayout(button_row)
 
+        self.worker = LogSearchWorker(log_index, keyword, SEARCH_PAGE_SIZE)
+        self.model.attach(self.worker)
+        self.worker.count_ready.connect(self.on_count)
+        self.worker.page_ready.connect(self.on_page)
+        self.worker.finished.connect(self.on_finished)
+        self.worker.error.connect(self.on_error)
+        self.worker.start()
+
+    def on_page(self, _):
+        self.update_count()
+
+    def on_count(self, total):
+        self.total = total; self.update_count()
+
+    def update_count(self):
+        shown = self.model.rowCount()
+        if self.total is not None:
+            if self.total == 0: text = f"Tidak ditemukan hasil untuk kata kunci '{self.keyword}'."
+            else: text = f"{self.total} hasil ditemukan" + (f" (ditampilkan {shown}, gulir untuk memuat lagi)" if shown < self.total else "")
+        elif self.complete: text = f"{shown} hasil ditemukan" if shown else f"Tidak ditemukan hasil untuk kata kunci '{self.keyword}'."
+        else: text = f"{shown} hasil ditemukan sejauh ini..."
+        self.count_label.setText(text)
+
+    def on_finished(self, complete):
+        self.cancel_button.setEnabled(False)
+        if complete: self.complete = True; self.update_count()
+        else: self.count_label.setText(f"Pencarian dibatalkan ({self.model.rowCount()} hasil dimuat).")
+
+    def on_error(self, message):
+        self.cancel_button.setEnabled(False)
+        self.count_label.setText(f"Gagal membaca log: {message}")
+
+    def cancel_search(self):
+        self.worker.cancel()
+
+    def done(self, result): # Menutup dialog juga menghentikan thread pencarian
+        self.worker.cancel()
+        super().done(result)
+
+# === Sesi Percakapan ===
+# --- OPTIMISASI: Setiap percakapan punya transkrip, histori API dan permintaan berjalan sendiri ---
+# Stream tetap masuk ke model transkrip sesinya walau pengguna sedang membuka percakapan lain. Sinyal worker
+# diterima sesi (QObject di thread GUI), jadi jawaban selalu sampai ke percakapan yang mengirim prompt.
+class ConversationSession(QObject):
+    def __init__(self, conversation_id, owner):
+        super().__init__(owner)
+        self.conversation_id = conversation_id
+        self.owner = owner
+        self.model = TranscriptModel(owner.thumbnail_cache, self)
+        self.messages = [] # Histori untuk API (teks sederhana)
+        self.last_reply = ""
+        self.bot_row = None # Baris transkrip yang sedang diisi streaming
+        self.job_id = None
+        self.context_plan = None
+        self.cache_status = None
+        self.status_text = ""
+        self.worker = None
+        self.provider = None # Provider tunggal permintaan ini (None untuk cache/mode balapan)
+        self.request_started = None; self.first_token_at = None
+        self.metrics = None # RequestMetrics permintaan yang sedang berjalan
+        self.speech_splitter = None # SentenceSplitter jika jawaban ini dibacakan selagi di-stream
+        self.stream_buffer = StreamRenderBuffer(self.append_to_bot_row, self)
+
+    def is_busy(self):
+        return self.job_id is not None
+
+    def append_to_bot_row(self, text):
+        if self.bot_row is None: return
+        start = time.perf_counter()
+        self.model.append_text(self.bot_row, text)
+        if self.owner.session is self: self.owner.scroll_to_bottom()
+        if self.metrics: self.metrics.add("render_ms", (time.perf_counter() - start) * 1000)
+
+    # Potongan hanya ditampung; model diperbarui oleh stream_buffer pada laju frame tetap
+    def on_chunk(self, chunk):
+        start = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+            if self.provider: self.owner.latency_stats.record_ttft(self.provider, self.first_token_at - self.request_started)
+        if self.bot_row is not None: self.stream_buffer.feed(chunk)
+        if self.speech_splitter is not None:
+            for sentence in self.speech_splitter.feed(chunk): self.owner.tts.say(sentence)
+        if self.metrics: self.metrics.add("gui_chunk_ms", (time.perf_counter() - start) * 1000)
+
+    def on_progress(self, done, total):
+        if done < total: self.owner.set_session_status(self, f"Memproses bagian file {done}/{total}...")
+        else: self.owner.set_session_status(self, "")
+
+    def on_race_winner(self, provider):
+        self.owner.set_session_status(self, f"{provider.capitalize()} menjawab lebih dulu...")
+
+    def on_finished(self, reply): self.owner.handle_ai_reply(self, reply)
+    def on_error(self, error_msg): self.owner.handle_ai_error(self, error_msg)
+    def on_cancelled(self, partial_reply): self.owner.handle_ai_cancelled(self, partial_reply)
 
 # === Main AI Chat Application ===
 class MacanAIChat(QMainWindow):
@@ -264,18 +3136,45 @@ class MacanAIChat(QMainWindow):
         self.setGeometry(100, 100, 800, 600)
 
         self.config = load_config(CONFIG_PATH)
-        self.messages = []
-        self.last_reply = ""
-        self.engine = pyttsx3.init()
-        self.engine.setProperty('rate', 150)
-        self.current_conversation_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        self.log_index = ChatLogIndex(LOG_PATH, LOG_INDEX_PATH, LOG_SEGMENT_DIR, LOG_TOMBSTONE_PATH, self.config.get("log_storage"))
+        self.log_writer = ChatLogWriter(self.log_index, self.config.get("log_writer"))
+        self.log_writer.failed.connect(self.on_log_write_failed); self.log_writer.rotated.connect(self.on_log_rotated)
+        self.api_clients = ApiClientManager()
+        self.image_preprocessor = ImagePreprocessor(IMAGE_CACHE_DIR, self.config.get("image"))
+        self.context_manager = ContextWindowManager(self.config.get("context"))
+        self.response_cache = ResponseCache(RESPONSE_CACHE_PATH, self.config.get("response_cache"))
+        self.semantic_index = SemanticIndex(SEMANTIC_VECTORS_PATH, SEMANTIC_INDEX_PATH, self.config.get("semantic")) if NUMPY_AVAILABLE else None
+        self.semantic_sync_running = False
+        self.race_settings = dict(DEFAULT_RACE_SETTINGS, **self.config.get("race", {}))
+        self.latency_stats = ProviderLatencyStats(self.race_settings["ewma_alpha"])
+        self.metrics = MetricsRecorder(METRICS_PATH, METRICS_PROM_PATH, self.config.get("metrics"))
+        self.log_writer.batch_written.connect(lambda count, seconds: self.metrics.observe("log_write_ms", seconds * 1000))
+        # Batas global permintaan yang berjalan bersamaan (semua percakapan); sisanya menunggu di antrean pool
+        self.request_executor = RequestExecutor(self.config.get("max_concurrent_requests", 4), self)
+        self.tts_settings = dict(DEFAULT_TTS_SETTINGS, **self.config.get("tts", {}))
+        self.tts = TtsService(self.tts_settings) # --- OPTIMISASI: Engine TTS dibuat di thread layanan saat pertama kali dipakai
+        self.tts.speaking_changed.connect(self.on_tts_state); self.tts.failed.connect(lambda e: QMessageBox.warning(self, "Text-to-Speech", e))
+        self.speech_settings = dict(DEFAULT_SPEECH_SETTINGS, **self.config.get("speech", {}))
+        self.speech_listener = SpeechListener(self.speech_settings) # Perangkat baru dibuka saat mikrofon pertama kali dipakai
+        self.speech_listener.recognized.connect(self.handle_speech_result); self.speech_listener.error.connect(self.handle_speech_error)
+        self.speech_listener.status_update.connect(self.update_speech_status)
         self.pending_media_path = None
         self.pending_media_type = None
-        self.current_bot_bubble_label = None # --- OPTIMISASI: Untuk streaming
+        self.pending_attachment = None # FileAttachment yang akan dikirim bersama prompt berikutnya
+        self.attachment_settings = dict(DEFAULT_ATTACHMENT_SETTINGS, **self.config.get("attachments", {}))
+        self.sessions = {} # conversation_id -> ConversationSession (sesi aktif + sesi yang masih menunggu jawaban)
+        self.session = None
+
+        STARTUP_TIMER.mark("init_services")
 
         self.setup_ui()
         self.update_ui_for_active_api()
-        self.load_initial_chat_history()
+        STARTUP_TIMER.mark("setup_ui")
+        # --- OPTIMISASI: Jendela tampil dulu, riwayat dimuat di latar belakang ---
+        self.background_calls = set()
+        self.semantic_sync_timer = QTimer(self); self.semantic_sync_timer.setSingleShot(True); self.semantic_sync_timer.setInterval(3000)
+        self.semantic_sync_timer.timeout.connect(self.sync_semantic_index)
+        QTimer.singleShot(0, self.load_initial_chat_history_async)
 
     def setup_ui(self):
         menu_bar = self.menuBar()
@@ -291,33 +3190,103 @@ class MacanAIChat(QMainWindow):
         api_menu.addAction(set_gemini_key_action)
         set_openai_key_action = QAction("Set Kunci API OpenAI", self); set_openai_key_action.triggered.connect(lambda: self.set_api_key("openai"))
         api_menu.addAction(set_openai_key_action)
+        api_menu.addSeparator()
+        self.response_cache_action = QAction("Gunakan Cache Respons", self); self.response_cache_action.setCheckable(True)
+        self.response_cache_action.setChecked(self.response_cache.enabled)
+        self.response_cache_action.toggled.connect(self.toggle_response_cache)
+        api_menu.addAction(self.response_cache_action)
+        clear_cache_action = QAction("Kosongkan Cache Respons", self); clear_cache_action.triggered.connect(self.clear_response_cache)
+        api_menu.addAction(clear_cache_action)
+        connection_stats_action = QAction("Statistik Koneksi API", self); connection_stats_action.triggered.connect(self.show_connection_stats)
+        api_menu.addAction(connection_stats_action)
+        api_menu.addSeparator()
+        race_menu = api_menu.addMenu("Mode Provider")
+        race_group = QActionGroup(self); race_group.setExclusive(True)
+        for mode, label in (("off", "Satu Provider (API aktif)"), ("race", "Balapan: Kirim ke Keduanya"), ("hedge", "Hedge: Provider Kedua Jika Lambat")):
+            action = QAction(label, self); action.setCheckable(True); action.setChecked(self.race_settings["mode"] == mode)
+            action.triggered.connect(lambda _=False, mode=mode: self.set_race_mode(mode))
+            race_group.addAction(action); race_menu.addAction(action)
+        latency_stats_action = QAction("Statistik Latensi Provider", self); latency_stats_action.triggered.connect(self.show_latency_stats)
+        api_menu.addAction(latency_stats_action)
+        request_stats_action = QAction("Statistik Permintaan", self); request_stats_action.triggered.connect(self.show_request_stats)
+        api_menu.addAction(request_stats_action)
+        voice_menu = menu_bar.addMenu("Suara")
+        self.stream_speech_action = QAction("Bacakan Jawaban Saat Streaming", self); self.stream_speech_action.setCheckable(True)
+        self.stream_speech_action.setChecked(bool(self.tts_settings["stream_sentences"]))
+        self.stream_speech_action.toggled.connect(self.toggle_stream_speech)
+        voice_menu.addAction(self.stream_speech_action)
+        skip_speech_action = QAction("Lewati Kalimat", self); skip_speech_action.triggered.connect(self.tts.skip)
+        voice_menu.addAction(skip_speech_action)
+        stop_speech_action = QAction("Hentikan Suara", self); stop_speech_action.triggered.connect(self.tts.stop)
+        voice_menu.addAction(stop_speech_action)
+        voice_menu.addSeparator()
+        mic_mode_menu = voice_menu.addMenu("Mode Mikrofon")
+        mic_mode_group = QActionGroup(self); mic_mode_group.setExclusive(True)
+        for mode, label in (("push_to_talk", "Tahan untuk Bicara"), ("continuous", "Dikte Berkelanjutan")):
+            action = QAction(label, self); action.setCheckable(True); action.setChecked(self.speech_settings["mode"] == mode)
+            action.triggered.connect(lambda _=False, mode=mode: self.set_speech_mode(mode))
+            mic_mode_group.addAction(action); mic_mode_menu.addAction(action)
+        backend_menu = voice_menu.addMenu("Mesin Pengenal Suara")
+        backend_group = QActionGroup(self); backend_group.setExclusive(True)
+        for backend, label in (("google", "Google (daring)"), ("vosk", "Vosk (luring)"), ("whisper", "Whisper (luring)")):
+            action = QAction(label, self); action.setCheckable(True); action.setChecked(self.speech_settings["backend"] == backend)
+            action.triggered.connect(lambda _=False, backend=backend: self.set_speech_backend(backend))
+            backend_group.addAction(action); backend_menu.addAction(action)
+        history_menu = menu_bar.addMenu("Riwayat")
+        compact_log_action = QAction("Padatkan Log", self); compact_log_action.triggered.connect(lambda: self.compact_log(notify=True))
+        history_menu.addAction(compact_log_action)
 
         central_widget = QWidget(); self.setCentralWidget(central_widget)
         top_h_layout = QHBoxLayout(central_widget); top_h_layout.setContentsMargins(0, 0, 0, 0); top_h_layout.setSpacing(0)
 
-        self.history_list_widget = QListWidget(); self.history_list_widget.setFixedWidth(200)
+        self.history_model = ConversationListModel(self.log_index, self)
+        self.history_list_widget = QListView(); self.history_list_widget.setFixedWidth(200)
+        self.history_list_widget.setModel(self.history_model); self.history_list_widget.setUniformItemSizes(True)
+        self.history_list_widget.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.history_list_widget.setStyleSheet("""
-            QListWidget { background-color: #2e2e2e; color: #e0e0e0; border-right: 1px solid #444444; font-size: 10pt; }
-            QListWidget::item { padding: 8px; border-bottom: 1px solid #3a3a3a; }
-            QListWidget::item:selected { background-color: #007bff; color: white; }
-            QListWidget::item:hover { background-color: #3a3a3a; }
+            QListView { background-color: #2e2e2e; color: #e0e0e0; border-right: 1px solid #444444; font-size: 10pt; }
+            QListView::item { padding: 8px; border-bottom: 1px solid #3a3a3a; }
+            QListView::item:selected { background-color: #007bff; color: white; }
+            QListView::item:hover { background-color: #3a3a3a; }
         """)
-        self.history_list_widget.itemClicked.connect(self.load_conversation_from_history)
+        self.history_list_widget.clicked.connect(self.load_conversation_from_history)
+        self.history_list_widget.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.history_list_widget.customContextMenuRequested.connect(self.show_history_menu)
         top_h_layout.addWidget(self.history_list_widget)
 
         chat_area_widget = QWidget(); chat_area_layout = QVBoxLayout(chat_area_widget)
         chat_area_layout.setContentsMargins(10, 10, 10, 10); chat_area_layout.setSpacing(10)        
 
-        self.scrollArea = QScrollArea(); self.scrollArea.setWidgetResizable(True)
-        self.chatContent = QWidget(); self.chatLayout = QVBoxLayout(self.chatContent)
-        self.chatLayout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.scrollArea.setWidget(self.chatContent)
-        chat_area_layout.addWidget(self.scrollArea, stretch=1)
+        self.thumbnail_cache = ThumbnailCache(THUMBNAIL_DIR, BubbleDelegate.THUMB_SIZE,
+                                              max_store_mb=self.config.get("thumbnail_cache_mb", 100), parent=self)
+        self.transcript_delegate = BubbleDelegate(self)
+        self.session = self.create_session(datetime.now().strftime("%Y%m%d%H%M%S%f"))
+        self.transcript_view = QListView(); self.transcript_view.setModel(self.session.model)
+        self.transcript_view.setItemDelegate(self.transcript_delegate)
+        self.transcript_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.transcript_view.setResizeMode(QListView.ResizeMode.Adjust)
+        # Tata letak bertahap: membuka percakapan panjang tidak mengukur semua baris sekaligus
+        self.transcript_view.setLayoutMode(QListView.LayoutMode.Batched); self.transcript_view.setBatchSize(TRANSCRIPT_BATCH_SIZE)
+        self.transcript_view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.transcript_view.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.transcript_view.customContextMenuRequested.connect(self.show_transcript_menu)
+        # --- OPTIMISASI: Satu timer untuk semua permintaan scroll, permintaan beruntun digabung ---
+        self.scroll_timer = QTimer(self); self.scroll_timer.setSingleShot(True); self.scroll_timer.setInterval(50)
+        self.scroll_timer.timeout.connect(self.transcript_view.scrollToBottom)
+        chat_area_layout.addWidget(self.transcript_view, stretch=1)
 
         self.loader = QLabel(""); self.loader.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.loader.setStyleSheet("color: #00FF00; font-style: italic;")
         chat_area_layout.addWidget(self.loader)
 
+        attachment_row = QHBoxLayout()
+        self.attachmentLabel = QLabel(""); self.attachmentLabel.setStyleSheet("color: #60d060; font-style: italic;")
+        self.removeAttachmentButton = QPushButton("✖"); self.removeAttachmentButton.setFixedSize(24, 24)
+        self.removeAttachmentButton.setToolTip("Batalkan lampiran file"); self.removeAttachmentButton.clicked.connect(lambda: self.set_pending_attachment(None))
+        attachment_row.addWidget(self.attachmentLabel, stretch=1); attachment_row.addWidget(self.removeAttachmentButton)
+        self.attachmentLabel.setVisible(False); self.removeAttachmentButton.setVisible(False)
+        chat_area_layout.addLayout(attachment_row)
+
         input_row_layout = QHBoxLayout()
         self.inputPrompt = QLineEdit(); self.inputPrompt.returnPressed.connect(self.sendPrompt)
         self.inputPrompt.setStyleSheet("padding: 8px; border-radius: 5px; border: 1px solid #cccccc;")
@@ -334,9 +3303,20 @@ class MacanAIChat(QMainWindow):
         self.sendButton.setStyleSheet("background-color: #28a745; color: white; border-radius: 5px; padding: 8px 15px;")
         input_row_layout.addWidget(self.sendButton)
 
+        self.stopButton = QPushButton("⏹"); self.stopButton.setFixedSize(36, 36); self.stopButton.clicked.connect(self.stop_generation)
+        self.stopButton.setToolTip("Hentikan jawaban")
+        self.stopButton.setStyleSheet("background-color: #ffc107; color: black; border-radius: 5px;")
+        self.stopButton.setVisible(False)
+        input_row_layout.addWidget(self.stopButton)
+
         self.readButton = QPushButton("Baca"); self.readButton.clicked.connect(self.readReply)
         self.readButton.setStyleSheet("background-color: #007bff; color: white; border-radius: 5px; padding: 8px 15px;")
         input_row_layout.addWidget(self.readButton)
+        self.skipSpeechButton = QPushButton("⏭"); self.skipSpeechButton.setFixedSize(36, 36); self.skipSpeechButton.clicked.connect(self.tts.skip)
+        self.skipSpeechButton.setToolTip("Lewati kalimat yang sedang dibacakan")
+        self.skipSpeechButton.setStyleSheet("background-color: #007bff; color: white; border-radius: 5px;")
+        self.skipSpeechButton.setVisible(False)
+        input_row_layout.addWidget(self.skipSpeechButton)
         
         # --- OPTIMISASI: Tombol baru dan reset dengan ikon ---
         button_font = QFont(); button_font.setPointSize(12)
@@ -354,8 +3334,8 @@ class MacanAIChat(QMainWindow):
         input_row_layout.addWidget(self.resetButton)
 
         self.mic_button = QPushButton("🎤"); self.mic_button.setFixedSize(36, 36)
-        self.mic_button.clicked.connect(self.start_speech_recognition)
-        self.mic_button.setToolTip("Gunakan suara untuk mengetik prompt.")
+        self.mic_button.pressed.connect(self.on_mic_pressed); self.mic_button.released.connect(self.on_mic_released)
+        self.mic_button.setToolTip(self.mic_tooltip())
         if not SPEECH_RECOGNITION_AVAILABLE:
             self.mic_button.setEnabled(False); self.mic_button.setToolTip("Fitur ini membutuhkan library 'speech_recognition' dan 'PyAudio'.")
         input_row_layout.insertWidget(0, self.mic_button)
@@ -373,12 +3353,19 @@ class MacanAIChat(QMainWindow):
        
         self.search_log_button = QPushButton("🔍 Cari Log"); self.search_log_button.clicked.connect(self.open_log_search_dialog)
         self.search_log_button.setStyleSheet("background-color: #6c757d; color: white; border-radius: 5px; padding: 5px 10px;")
-        chat_area_layout.addWidget(self.search_log_button, alignment=Qt.AlignmentFlag.AlignRight)
+        self.semantic_search_button = QPushButton("🧠 Cari Mirip"); self.semantic_search_button.clicked.connect(self.open_semantic_search_dialog)
+        self.semantic_search_button.setStyleSheet("background-color: #6c757d; color: white; border-radius: 5px; padding: 5px 10px;")
+        self.semantic_search_button.setToolTip("Cari pesan lama yang maknanya mirip (offline)" if NUMPY_AVAILABLE else "Butuh numpy: pip install numpy")
+        self.semantic_search_button.setEnabled(NUMPY_AVAILABLE)
+        search_row = QHBoxLayout(); search_row.addStretch(1)
+        search_row.addWidget(self.semantic_search_button); search_row.addWidget(self.search_log_button)
+        chat_area_layout.addLayout(search_row)
        
         top_h_layout.addWidget(chat_area_widget, stretch=1)
 
     def switch_api(self, api_name):
         self.config['active_api'] = api_name; save_config(CONFIG_PATH, self.config)
+        self.api_clients.sync_config(self.config)
         self.update_ui_for_active_api()
         QMessageBox.information(self, "Mode Diganti", f"Sekarang menggunakan API {api_name.capitalize()}.")
 
@@ -399,10 +3386,48 @@ class MacanAIChat(QMainWindow):
         text, ok = QInputDialog.getText(self, f"Input {api_name.capitalize()} API Key", prompt_text, QLineEdit.EchoMode.Password, current_key)
         if ok and text:
             self.config[api_name]['api_key'] = text.strip(); save_config(CONFIG_PATH, self.config)
+            self.api_clients.sync_config(self.config)
             QMessageBox.information(self, "Sukses", f"{api_name.capitalize()} API Key berhasil disimpan.")
         else:
             QMessageBox.warning(self, "Batal", "API Key tidak diubah.")
         
+    def toggle_response_cache(self, enabled):
+        self.config.setdefault("response_cache", {})["enabled"] = enabled; save_config(CONFIG_PATH, self.config)
+        self.response_cache.settings["enabled"] = enabled
+
+    def set_race_mode(self, mode):
+        self.race_settings["mode"] = mode
+        self.config.setdefault("race", {})["mode"] = mode; save_config(CONFIG_PATH, self.config)
+
+    def show_latency_stats(self):
+        stats = self.latency_stats.snapshot()
+        if not stats:
+            QMessageBox.information(self, "Statistik Latensi Provider", "Belum ada data latensi."); return
+        lines = []
+        for provider, entry in stats.items():
+            ttft = f"{entry['ttft_ewma_s'] * 1000:.0f} ms" if entry["ttft_ewma_s"] is not None else "-"
+            lines.append(f"{provider.capitalize()}: TTFT (EWMA) {ttft}, sampel {entry['samples']}, menang {entry['wins']}, "
+                         f"gagal {entry['errors']} (laju error {entry['error_rate']:.0%})")
+        QMessageBox.information(self, "Statistik Latensi Provider", "\n".join(lines))
+
+    def show_request_stats(self):
+        RequestStatsDialog(self.metrics, self).exec()
+
+    def clear_response_cache(self):
+        try:
+            self.response_cache.clear()
+            QMessageBox.information(self, "Cache Respons", "Cache respons telah dikosongkan.")
+        except sqlite3.Error as e:
+            QMessageBox.critical(self, "Cache Respons", f"Gagal mengosongkan cache: {e}")
+
+    def show_connection_stats(self):
+        stats = self.api_clients.connection_stats()
+        QMessageBox.information(self, "Statistik Koneksi API",
+                                f"Gemini: {stats['gemini_created']} dibuat, {stats['gemini_reused']} dipakai ulang\n"
+                                f"OpenAI: {stats['openai_created']} dibuat, {stats['openai_reused']} dipakai ulang\n"
+                                f"Dibangun ulang karena konfigurasi berubah: {stats['rebuilds']}\n"
+                                f"Cache respons: {self.response_cache.stats['hits']} hit, {self.response_cache.stats['misses']} miss")
+
     def handle_send_image(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Pilih Gambar", "", "Image Files (*.png *.jpg *.jpeg *.webp)")
         if file_path:
@@ -412,157 +3437,347 @@ class MacanAIChat(QMainWindow):
             self.inputPrompt.setStyleSheet("padding: 8px; border-radius: 5px; border: 1px solid #cccccc; color: green; font-style: italic;")
 
     def handle_send_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Pilih File Teks", "", "Text Files (*.txt *.py *.json *.md);;All Files (*)")
+        file_path, _ = QFileDialog.getOpenFileName(self, "Pilih File Teks", "", "Text Files (*.txt *.py *.json *.md *.log);;All Files (*)")
         if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f: content = f.read()
-                file_name = os.path.basename(file_path)
-                current_prompt = self.inputPrompt.text() if not self.inputPrompt.text().startswith("[Gambar") else ""
-                new_prompt = f"{current_prompt}\n\n--- MULAI KONTEN DARI FILE '{file_name}' ---\n{content}\n--- SELESAI KONTEN DARI FILE ---"
-                self.inputPrompt.setText(new_prompt)
-                self.inputPrompt.setStyleSheet("padding: 8px; border-radius: 5px; border: 1px solid #cccccc;")
-                QMessageBox.information(self, "Sukses", f"Konten dari '{file_name}' telah ditambahkan ke prompt.")
+                self.set_pending_attachment(FileAttachment(file_path))
             except Exception as e:
-                QMessageBox.critical(self, "Error Membaca File", f"Gagal membaca konten file: {e}")
+                QMessageBox.critical(self, "Error Membaca File", f"Gagal membaca file: {e}")
 
-    def addBubble(self, message_obj, is_streaming=False):
-        sender = message_obj.get("role")
-        content = message_obj.get("content")
-        
-        text_content = ""; image_pixmap = None
+    # --- OPTIMISASI: Hanya ukuran dan cuplikan awal yang dibaca saat file dipilih ---
+    def set_pending_attachment(self, attachment):
+        self.pending_attachment = attachment
+        if attachment is not None:
+            mode = "dikirim utuh" if self.attachment_fits_inline(attachment) else "diproses per bagian"
+            self.attachmentLabel.setText(f"📎 {attachment.describe()} — akan {mode}")
+            self.attachmentLabel.setToolTip(attachment.preview(int(self.attachment_settings["preview_chars"])))
+        self.attachmentLabel.setVisible(attachment is not None); self.removeAttachmentButton.setVisible(attachment is not None)
 
-        if isinstance(content, list):
-            for part in content:
-                if part.get("type") == "text": text_content += part.get("text", "")
-                elif part.get("type") == "image_url": 
-                    url_data = part.get("image_url", {}).get("url", "")
-                    if "base64," in url_data:
-                        img_data = base64.b64decode(url_data.split("base64,")[1])
-                        image_pixmap = QPixmap(); image_pixmap.loadFromData(img_data)
-                elif part.get("type") == "image_path": image_pixmap = QPixmap(part.get("image_path"))
-        else:
-            text_content = content or ""
-        
-        bubble_widget = QWidget(); bubble_layout = QHBoxLayout(bubble_widget)
-        bubble_layout.setContentsMargins(5, 5, 5, 5); bubble_layout.setSpacing(10)
-        max_bubble_width = int(self.scrollArea.viewport().width() * 0.80) if self.scrollArea.viewport().width() > 0 else 550
-        bubble_widget.setMaximumWidth(max_bubble_width)
-        
-        content_widget = QWidget(); content_layout = QVBoxLayout(content_widget)
-        content_layout.setContentsMargins(0,0,0,0)
+    def attachment_fits_inline(self, attachment):
+        settings = self.context_manager.settings
+        return attachment.estimated_tokens() <= (int(settings["max_tokens"]) - int(settings["reserve_tokens"])) // 2
 
-        if image_pixmap:
-            thumbnail_label = QLabel()
-            thumbnail_label.setPixmap(image_pixmap.scaled(200, 200, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
-            content_layout.addWidget(thumbnail_label)
+    @property
+    def current_conversation_id(self):
+        return self.session.conversation_id
 
-        message_label = QLabel(text_content); message_label.setWordWrap(True)
-        message_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
-        if text_content: content_layout.addWidget(message_label)
-        
-        if sender == "user":
-            bubble_widget.setStyleSheet("background-color: #E0E0E0; border-radius: 15px; padding: 10px; margin-bottom: 5px;")
-            user_icon_label = QLabel(); user_icon_label.setPixmap(get_svg_icon(SVG_USER_ICON, size=24).pixmap(24,24))
-            bubble_layout.addStretch(1); bubble_layout.addWidget(content_widget); bubble_layout.addWidget(user_icon_label)
-        elif sender == "assistant":
-            bubble_widget.setStyleSheet("background-color: #A0D4E4; border-radius: 15px; padding: 10px; margin-bottom: 5px;")
-            bot_icon_label = QLabel(); bot_icon_label.setPixmap(get_svg_icon(SVG_BOT_ICON, size=24).pixmap(24,24))
-            bubble_layout.addWidget(bot_icon_label); bubble_layout.addWidget(content_widget); bubble_layout.addStretch(1)
-            if is_streaming: self.current_bot_bubble_label = message_label # Simpan referensi untuk streaming
-        
-        self.chatLayout.addWidget(bubble_widget)
-        self.scroll_to_bottom()
-        return message_label
+    def create_session(self, conversation_id):
+        session = ConversationSession(conversation_id, self)
+        # Ukuran baris yang berubah (streaming/error) memicu layout ulang yang memakai cache ukuran baris lain
+        session.model.dataChanged.connect(lambda top_left, *_, s=session: self.session is s and self.transcript_delegate.sizeHintChanged.emit(top_left))
+        self.sessions[conversation_id] = session
+        return session
 
-    def log_chat(self, message_obj):
-        message_obj['conversation_id'] = self.current_conversation_id
+    def switch_to_session(self, session):
+        previous = self.session
+        if previous is session: return
+        self.session = session
+        if previous is not None and previous.speech_splitter is not None: # Percakapan di latar belakang tidak terus berbicara
+            self.stop_streamed_speech(); self.tts.stop()
+        # Sesi lama yang tidak menunggu jawaban dilepas; dimuat ulang dari log jika dibuka lagi
+        if previous is not None and (not previous.is_busy() or not self.is_live_session(previous)): self.drop_session(previous)
+        self.transcript_view.setModel(session.model)
+        self.inputPrompt.clear() # Kosongkan input saat ganti chat
+        self.update_session_controls(); self.scroll_to_bottom()
+
+    def drop_session(self, session):
+        if self.sessions.get(session.conversation_id) is session: del self.sessions[session.conversation_id]
+        if session is not self.session: session.deleteLater()
+
+    # Input hanya dikunci untuk percakapan yang sedang menunggu jawaban, bukan seluruh aplikasi
+    def update_session_controls(self):
+        busy = self.session.is_busy()
+        self.set_ui_enabled(not busy); self.stopButton.setVisible(busy)
+        self.loader.setText(self.session.status_text)
+
+    def set_session_status(self, session, text):
+        session.status_text = text
+        if session is self.session: self.loader.setText(text)
+
+    def addBubble(self, message_obj, is_streaming=False, session=None):
+        session = session or self.session
+        row = session.model.append_message(message_obj)
+        if is_streaming and message_obj.get("role") == "assistant": session.bot_row = row # Simpan referensi untuk streaming
+        if session is self.session: self.scroll_to_bottom()
+        return row
+
+    def show_transcript_menu(self, pos):
+        index = self.transcript_view.indexAt(pos)
+        if not index.isValid(): return
+        menu = QMenu(self)
+        copy_action = menu.addAction("Salin Teks")
+        if menu.exec(self.transcript_view.viewport().mapToGlobal(pos)) == copy_action:
+            QApplication.clipboard().setText(index.data())
+
+    def log_chat(self, message_obj, conversation_id=None):
+        start = time.perf_counter()
+        message_obj['conversation_id'] = conversation_id or self.current_conversation_id
         message_obj['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.log_writer.write(message_obj) # Ditulis dan diindeks oleh thread penulis log
+        self.metrics.observe("log_enqueue_ms", (time.perf_counter() - start) * 1000)
+        if self.semantic_index is not None: self.semantic_sync_timer.start() # Vektor baru di-embed setelah penulisan mereda
+
+    def on_log_write_failed(self, error):
+        self.loader.setText(f"Gagal menulis ke log: {error}")
+
+    # --- OPTIMISASI: Setelah rotasi segmen aktif, kompresi (dan kompaksi jika ada percakapan terhapus) di latar belakang ---
+    def on_log_rotated(self, segment):
+        if self.log_index.deleted: self.compact_log()
+        else: self.compress_pending_segments()
+
+    def compress_pending_segments(self):
+        pending = self.log_index.pending_compression()
+        if not pending: return
+        call = BackgroundCall(lambda: [self.log_index.compress_segment(n) for n in pending])
+        call.failed.connect(lambda e: print(f"Gagal mengompres segmen log: {e}", file=sys.stderr))
+        self.run_in_background(call)
+
+    def compact_log(self, notify=False):
+        call = BackgroundCall(lambda: self.log_index.compact(rotate=self.log_writer.rotate))
+        if notify: call.done.connect(lambda removed: QMessageBox.information(self, "Padatkan Log", f"Log dipadatkan, {removed} catatan dibuang."))
+        call.failed.connect(lambda e: QMessageBox.warning(self, "Padatkan Log", f"Gagal memadatkan log: {e}"))
+        self.run_in_background(call)
+
+    def show_history_menu(self, pos):
+        item = self.history_list_widget.indexAt(pos)
+        if not item.isValid(): return
+        menu = QMenu(self)
+        delete_action = menu.addAction("Hapus Percakapan")
+        if menu.exec(self.history_list_widget.viewport().mapToGlobal(pos)) == delete_action:
+            self.delete_conversation(item)
+
+    def delete_conversation(self, item):
+        conv_id = item.data(Qt.ItemDataRole.UserRole)
+        confirm = QMessageBox.question(self, "Konfirmasi Hapus", "Hapus percakapan ini dari riwayat?",
+                                       QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
+        if confirm != QMessageBox.StandardButton.Yes: return
         try:
-            with open(LOG_PATH, 'a', encoding='utf-8') as f:
-                json.dump(message_obj, f); f.write('\n')
-        except Exception as e:
-            QMessageBox.warning(self, "Logging Error", f"Gagal menulis ke log: {e}")
+            self.log_index.delete_conversation(conv_id) # Langsung hilang dari indeks; dibuang dari file saat kompaksi
+            if self.semantic_index is not None: self.semantic_index.delete_conversation(conv_id)
+        except (OSError, sqlite3.Error) as e:
+            QMessageBox.critical(self, "Error", f"Gagal menghapus percakapan: {e}"); return
+        self.history_model.remove(conv_id)
+        session = self.sessions.get(conv_id)
+        if session is not None:
+            if session.job_id is not None: self.request_executor.cancel(session.job_id)
+            self.drop_session(session) # Jawaban yang datang kemudian diabaikan
+            if session is self.session: self.start_new_chat()
 
     def sendPrompt(self):
         prompt = self.inputPrompt.text().strip()
-        if not prompt and not self.pending_media_path: return
+        if not prompt and not self.pending_media_path and not self.pending_attachment: return
         if not self.check_active_api_key(): return
+        metrics = RequestMetrics() # Waktu susun permintaan dihitung dari sini
 
         prompt_text_for_api = prompt if not prompt.startswith("[Gambar terlampir:") else "Jelaskan atau proses gambar yang terlampir."
+        if not prompt and self.pending_attachment is not None: prompt_text_for_api = "Ringkas isi file yang terlampir."
         user_prompt_parts = [prompt_text_for_api] 
         display_content_parts = [{"type": "text", "text": prompt_text_for_api}]
 
         if self.pending_media_type == 'image' and self.pending_media_path:
             try:
-                img = Image.open(self.pending_media_path)
-                user_prompt_parts.append(img)
+                with Image.open(self.pending_media_path): pass # Validasi header saja; encode dilakukan di worker
+                user_prompt_parts.append(ImagePart(self.pending_media_path, self.image_preprocessor))
                 display_content_parts.append({"type": "image_path", "image_path": self.pending_media_path})
             except Exception as e:
                 QMessageBox.critical(self, "Error Gambar", f"Gagal memproses gambar: {e}"); return
 
+        session = self.session
+        attachment = self.pending_attachment; inline_file = False
+        if attachment is not None:
+            display_content_parts.append({"type": "file_ref", "path": attachment.path, "name": attachment.name, "size": attachment.size})
+            if self.attachment_fits_inline(attachment):
+                try: file_text = attachment.read_text()
+                except OSError as e:
+                    QMessageBox.critical(self, "Error Membaca File", f"Gagal membaca file: {e}"); return
+                user_prompt_parts[0] = f"{prompt_text_for_api}\n\n--- MULAI KONTEN DARI FILE '{attachment.name}' ---\n{file_text}\n--- SELESAI KONTEN DARI FILE ---"
+                inline_file = True
+
         message_for_ui_and_log = {"role": "user", "content": display_content_parts}
         self.addBubble(message_for_ui_and_log)
         self.log_chat(message_for_ui_and_log)
         
         api_history_content = prompt_text_for_api
         if self.pending_media_path: api_history_content += " [user sent an image]"
-        self.messages.append({"role": "user", "content": api_history_content})
+        if attachment is not None: api_history_content += f" [user attached file {attachment.name}]"
+        session.messages.append({"role": "user", "content": api_history_content})
 
         self.inputPrompt.clear(); self.inputPrompt.setStyleSheet("padding: 8px; border-radius: 5px; border: 1px solid #cccccc;")
-        self.pending_media_path = None; self.pending_media_type = None
-        self.set_ui_enabled(False)
+        self.pending_media_path = None; self.pending_media_type = None; self.set_pending_attachment(None)
         
         # --- OPTIMISASI: Tambahkan bubble kosong untuk diisi oleh streaming ---
         self.addBubble({"role": "assistant", "content": ""}, is_streaming=True)
 
         active_api = self.config.get('active_api', 'gemini')
-        self.loader.setText(f"{active_api.capitalize()} sedang berpikir...");
+        # --- OPTIMISASI: Histori dipangkas/diringkas agar muat dalam anggaran token ---
+        session.context_plan = self.context_manager.plan(session.messages[:-1], user_prompt_parts[0] if inline_file else prompt_text_for_api,
+                                                         image_count=sum(isinstance(p, ImagePart) for p in user_prompt_parts))
+        context_note = "" if session.context_plan["strategy"] == "full" else f" ({session.context_plan['dropped']} pesan lama dipangkas)"
+        queue_note = " (menunggu giliran)" if self.request_executor.saturated() else ""
+        self.set_session_status(session, f"{active_api.capitalize()} sedang berpikir...{context_note}{queue_note}")
 
-        self.thread = QThread()
-        if active_api == 'gemini':
-            worker = GeminiWorker(self.config["gemini"]["api_key"], self.config["gemini"]["model"], self.config["gemini"].get("generation_config", {}), self.messages[:-1], user_prompt_parts)
-        else: # openai
-            worker = OpenAIWorker(self.config["openai"]["api_key"], self.config["openai"]["model"], self.messages[:-1], user_prompt_parts)
+        api_history = session.context_plan["messages"]
+        worker = None; session.provider = active_api
+        race_providers = self.race_providers() if attachment is None else []
+        if attachment is not None and not inline_file: # File besar: map-reduce di provider aktif, tanpa cache respons
+            worker = self.create_map_reduce_worker(active_api, attachment, prompt_text_for_api, api_history)
+            worker.progress.connect(session.on_progress)
+            self.set_session_status(session, f"Memproses {attachment.describe()} per bagian...")
+        elif race_providers: # Cache respons dilewati: provider yang menang belum diketahui
+            worker = self.create_race_worker(race_providers, api_history, user_prompt_parts)
+            worker.winner_chosen.connect(session.on_race_winner)
+            session.provider = None
+            self.set_session_status(session, f"Menunggu {' & '.join(p.capitalize() for p in race_providers)}...{context_note}{queue_note}")
+        elif self.response_cache.enabled:
+            provider_config = self.config[active_api]
+            cache_key = ResponseCache.make_key(active_api, provider_config["model"], provider_config.get("generation_config"), api_history, user_prompt_parts)
+            cached_response = self.response_cache.get(cache_key)
+            if cached_response is not None:
+                worker = CachedReplayWorker(cached_response); session.provider = None
+                self.set_session_status(session, f"{active_api.capitalize()}: jawaban dari cache.")
+        if worker is None:
+            worker = self.create_worker(active_api, api_history, user_prompt_parts)
+            if self.response_cache.enabled:
+                worker.cache_status = "miss"
+                worker.finished.connect(lambda reply, key=cache_key: self.response_cache.put(key, reply))
+        session.cache_status = worker.cache_status
+        session.worker = worker; session.request_started = time.monotonic(); session.first_token_at = None
+        metrics.labels = {"provider": session.provider or ("+".join(race_providers) if race_providers else active_api),
+                          "model": self.config[active_api]["model"] if session.provider or not race_providers else "",
+                          "mode": "cache" if worker.cache_status == "hit" else "map_reduce" if isinstance(worker, MapReduceWorker)
+                                  else self.race_settings["mode"] if race_providers else "single"}
+        worker.metrics = metrics; session.metrics = metrics
+        if self.tts_settings["stream_sentences"]: # Jawaban baru menggantikan bacaan yang masih berjalan
+            self.tts.stop(); self.stop_streamed_speech()
+            session.speech_splitter = SentenceSplitter(self.tts_settings["max_sentence_chars"])
         
-        self.worker = worker
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
-        self.worker.chunk_received.connect(self.handle_ai_chunk) # Terhubung ke sinyal streaming
-        self.worker.finished.connect(self.handle_ai_reply)
-        self.worker.error.connect(self.handle_ai_error)
-        self.thread.start()
+        worker.chunk_received.connect(session.on_chunk) # Terhubung ke sinyal streaming milik sesi ini
+        worker.finished.connect(session.on_finished)
+        worker.error.connect(session.on_error)
+        worker.cancelled.connect(session.on_cancelled)
+        # --- OPTIMISASI: Worker dijalankan oleh pool thread yang sudah hidup ---
+        metrics.mark("submitted")
+        session.job_id = self.request_executor.submit(worker)
+        self.update_session_controls()
 
-    # --- OPTIMISASI: Slot baru untuk menangani streaming chunk ---
-    def handle_ai_chunk(self, chunk):
-        if self.current_bot_bubble_label:
-            current_text = self.current_bot_bubble_label.text()
-            self.current_bot_bubble_label.setText(current_text + chunk)
-            self.scroll_to_bottom()
+    # Provider untuk mode balapan/hedge, provider tercepat lebih dulu; kosong jika mode mati atau hanya satu yang siap
+    def race_providers(self):
+        if self.race_settings["mode"] not in ("race", "hedge"): return []
+        ready = [p for p, available in (("gemini", GEMINI_AVAILABLE), ("openai", OPENAI_AVAILABLE))
+                 if available and self.config.get(p, {}).get("api_key")]
+        return self.latency_stats.ranked(ready) if len(ready) > 1 else []
+
+    # Mengikat generator streaming ke konfigurasi provider: factory(history, prompt_parts, metrics=None, handle=None) -> generator teks
+    def stream_factory(self, provider):
+        if provider == "gemini":
+            return lambda history, parts, metrics=None, handle=None: stream_gemini(
+                self.api_clients, self.config["gemini"]["api_key"], self.config["gemini"]["model"],
+                self.config["gemini"].get("generation_config", {}), history, parts, metrics, handle)
+        return lambda history, parts, metrics=None, handle=None: stream_openai(
+            self.api_clients, self.config["openai"]["api_key"], self.config["openai"]["model"], history, parts, metrics, handle)
+
+    def create_map_reduce_worker(self, provider, attachment, task, api_history):
+        settings = self.context_manager.settings
+        reduce_budget = (int(settings["max_tokens"]) - int(settings["reserve_tokens"])) // 2
+        return MapReduceWorker(self.stream_factory(provider), attachment, task, api_history, self.attachment_settings,
+                               gemini_error_message if provider == "gemini" else openai_error_message, reduce_budget,
+                               self.request_executor.slots)
+
+    def create_race_worker(self, providers, api_history, user_prompt_parts):
+        factories = {p: (lambda metrics, handle, factory=self.stream_factory(p): factory(api_history, user_prompt_parts, metrics, handle))
+                     for p in providers}
+        delay = self.race_settings["hedge_delay_ms"]
+        if delay == "auto": delay_s = min(5.0, max(0.3, 1.5 * self.latency_stats.ttft(providers[0])))
+        else: delay_s = float(delay) / 1000.0
+        return RaceWorker([(p, factories[p]) for p in providers], self.race_settings["mode"], delay_s, self.latency_stats,
+                          self.request_executor.slots)
+
+    def create_worker(self, provider, api_history, user_prompt_parts):
+        if provider == 'gemini':
+            return GeminiWorker(self.config["gemini"]["api_key"], self.config["gemini"]["model"], self.config["gemini"].get("generation_config", {}), api_history, user_prompt_parts, self.api_clients)
+        return OpenAIWorker(self.config["openai"]["api_key"], self.config["openai"]["model"], api_history, user_prompt_parts, self.api_clients)
 
-    def handle_ai_reply(self, full_reply):
+    # Sesi yang sudah dibuang (percakapan dihapus/reset) tidak lagi menerima jawaban
+    def is_live_session(self, session):
+        return self.sessions.get(session.conversation_id) is session
+
+    # Dipanggil saat permintaan sebuah sesi berakhir; sesi di latar belakang dilepas setelah jawabannya tercatat
+    def finish_session_request(self, session, status_text):
+        session.bot_row = None; session.job_id = None; session.worker = None # Reset referensi bubble
+        self.set_session_status(session, status_text)
+        if session is self.session: self.update_session_controls()
+        else: self.drop_session(session)
+
+    # Satu catatan metrik per permintaan; sesi melepas objeknya agar jawaban parsial tidak tercatat dua kali
+    def record_request_metrics(self, session, outcome):
+        metrics, session.metrics = session.metrics, None
+        if metrics is None: return
+        race_info = getattr(session.worker, "race_info", None)
+        if race_info and race_info.get("winner"): # Label mengikuti provider yang menang
+            metrics.labels = dict(metrics.labels, provider=race_info["winner"], model=self.config[race_info["winner"]]["model"])
+        self.metrics.record(metrics.as_record(outcome))
+
+    def handle_ai_reply(self, session, full_reply):
+        session.stream_buffer.finish()
+        self.record_request_metrics(session, "ok")
+        self.finish_streamed_speech(session, speak_rest=True)
+        if not self.is_live_session(session): return
         message_obj = {"role": "assistant", "content": full_reply}
-        self.log_chat(message_obj)
+        log_obj = dict(message_obj)
+        if session.context_plan: # Catat strategi konteks yang dipakai untuk permintaan ini
+            log_obj["context"] = {k: session.context_plan[k] for k in ("strategy", "dropped", "tokens", "budget")}
+        if session.cache_status: log_obj["cache"] = session.cache_status # "hit" atau "miss"
+        race_info = getattr(session.worker, "race_info", None)
+        if race_info: log_obj["race"] = race_info # Pemenang dan TTFT per provider
+        self.log_chat(log_obj, session.conversation_id)
         
-        self.messages.append(message_obj)
-        self.last_reply = full_reply
-        self.loader.setText(""); self.set_ui_enabled(True)
-        self.current_bot_bubble_label = None # Reset referensi bubble
-        if hasattr(self, 'thread') and self.thread.isRunning(): self.thread.quit(); self.thread.wait()
-
-    def handle_ai_error(self, error_msg):
-        if self.current_bot_bubble_label:
-            self.current_bot_bubble_label.setText(f"Error: {error_msg}")
-            self.current_bot_bubble_label.setStyleSheet("color: red;")
-        self.loader.setText("Error!"); self.set_ui_enabled(True)
-        self.current_bot_bubble_label = None
-        if hasattr(self, 'thread') and self.thread.isRunning(): self.thread.quit(); self.thread.wait()
-        QMessageBox.critical(self, "API Error", error_msg)
+        session.messages.append(message_obj)
+        session.last_reply = full_reply
+        self.finish_session_request(session, "")
+
+    def handle_ai_error(self, session, error_msg):
+        session.stream_buffer.discard()
+        self.record_request_metrics(session, "error")
+        self.finish_streamed_speech(session, speak_rest=False)
+        if session.provider: self.latency_stats.record_error(session.provider) # Mode balapan mencatat sendiri per provider
+        if not self.is_live_session(session): return
+        if session.bot_row is not None:
+            session.model.set_error(session.bot_row, f"Error: {error_msg}")
+        is_current = session is self.session
+        self.finish_session_request(session, "Error!")
+        if is_current: QMessageBox.critical(self, "API Error", error_msg)
+        else: self.loader.setText(f"Error di percakapan lain: {error_msg[:80]}")
+
+    def stop_generation(self):
+        if self.session.job_id is not None: self.request_executor.cancel(self.session.job_id)
+
+    def handle_ai_cancelled(self, session, partial_reply):
+        self.record_request_metrics(session, "cancelled")
+        self.finish_streamed_speech(session, speak_rest=False)
+        if partial_reply:
+            self.handle_ai_reply(session, partial_reply) # Simpan jawaban parsial agar histori tetap utuh
+        else:
+            session.stream_buffer.discard()
+            if not self.is_live_session(session): return
+            if session.bot_row is not None: session.model.set_error(session.bot_row, "Dihentikan.")
+            self.finish_session_request(session, "")
+        if session is not self.session: return
+        self.set_session_status(session, "Jawaban dihentikan.")
+        QTimer.singleShot(2000, lambda: self.set_session_status(session, "") if session.status_text == "Jawaban dihentikan." else None)
+
+    def closeEvent(self, event):
+        self.request_executor.shutdown()
+        self.tts.stop(); self.tts.close()
+        self.speech_listener.close()
+        self.log_writer.close() # Menulis sisa antrean sebelum keluar
+        self.metrics.close()
+        super().closeEvent(event)
 
     def set_ui_enabled(self, enabled):
         self.inputPrompt.setEnabled(enabled); self.sendButton.setEnabled(enabled)
         self.addMediaButton.setEnabled(enabled); self.resetButton.setEnabled(enabled)
         self.newChatButton.setEnabled(enabled);
-        self.mic_button.setEnabled(enabled and SPEECH_RECOGNITION_AVAILABLE)
+        self.mic_button.setEnabled(SPEECH_RECOGNITION_AVAILABLE) # Dikte tetap bisa dihentikan saat menunggu jawaban
 
     def check_active_api_key(self):
         active_api = self.config.get('active_api', 'gemini')
@@ -578,150 +3793,169 @@ class MacanAIChat(QMainWindow):
         self.set_api_key(active_api)
         return bool(self.config.get(active_api, {}).get("api_key", ""))
     
+    # Jawaban dibacakan per kalimat agar tombol lewati melompat ke kalimat berikutnya
     def readReply(self):
-        if self.engine.isBusy(): self.engine.stop()
-        elif self.last_reply and not self.last_reply.lower().startswith("error:"):
-            threading.Thread(target=self._speak_reply, args=(self.last_reply,)).start()
+        if self.tts.speaking: self.tts.stop()
+        elif self.session.last_reply and not self.session.last_reply.lower().startswith("error:"):
+            self.tts.reset_failure() # Permintaan eksplisit mencoba engine lagi
+            splitter = SentenceSplitter(self.tts_settings["max_sentence_chars"])
+            for sentence in splitter.feed(self.session.last_reply) + splitter.flush(): self.tts.say(sentence)
 
-    def _speak_reply(self, text):
-        try:
-            self.engine.say(text); self.engine.runAndWait()
-        except Exception as e: print(f"Error during text-to-speech: {e}")
+    def on_tts_state(self, speaking):
+        self.readButton.setText("Stop" if speaking else "Baca"); self.skipSpeechButton.setVisible(speaking)
+
+    def toggle_stream_speech(self, enabled):
+        self.tts_settings["stream_sentences"] = enabled; self.tts.reset_failure()
+        self.config.setdefault("tts", {})["stream_sentences"] = enabled; save_config(CONFIG_PATH, self.config)
+
+    # Satu layanan TTS dipakai bersama: hanya satu jawaban yang dibacakan selagi di-stream
+    def stop_streamed_speech(self):
+        for other in self.sessions.values(): other.speech_splitter = None
+
+    # Sisa kalimat dibacakan saat jawaban selesai; saat error/dibatalkan sisa yang belum lengkap dibuang
+    def finish_streamed_speech(self, session, speak_rest):
+        splitter, session.speech_splitter = session.speech_splitter, None
+        if splitter is not None and speak_rest:
+            for sentence in splitter.flush(): self.tts.say(sentence)
 
     # --- OPTIMISASI: Tombol chat baru ---
     def start_new_chat(self):
-        for i in reversed(range(self.chatLayout.count())):
-            widget = self.chatLayout.itemAt(i).widget()
-            if widget: widget.deleteLater()
-        
-        self.messages.clear()
-        self.last_reply = ""
-        self.current_conversation_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
-        self.inputPrompt.clear()
+        self.switch_to_session(self.create_session(datetime.now().strftime("%Y%m%d%H%M%S%f")))
         self.loader.setText("Chat baru dimulai.")
         QTimer.singleShot(2000, lambda: self.loader.setText(""))
         
         # Tambahkan item baru ke histori UI
-        list_item = QListWidgetItem(f"{datetime.now().strftime('%d/%m %H:%M')} - Chat Baru...")
-        list_item.setIcon(get_svg_icon(SVG_USER_ICON))
-        list_item.setData(Qt.ItemDataRole.UserRole, self.current_conversation_id)
-        self.history_list_widget.insertItem(0, list_item) # Tambah di paling atas
-        self.history_list_widget.setCurrentRow(0)
+        self.history_model.prepend(self.current_conversation_id, f"{datetime.now().strftime('%d/%m %H:%M')} - Chat Baru...") # Tambah di paling atas
+        self.history_list_widget.setCurrentIndex(self.history_model.index(0))
             
     def resetChat(self):
         confirm = QMessageBox.question(self, "Konfirmasi Hapus Total", "Yakin ingin menghapus SEMUA riwayat percakapan secara permanen? Tindakan ini tidak bisa dibatalkan.",
                                        QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
         if confirm == QMessageBox.StandardButton.Yes:
+            for session in list(self.sessions.values()): # Jawaban yang masih berjalan tidak ditulis ke log baru
+                if session.job_id is not None: self.request_executor.cancel(session.job_id)
+                self.drop_session(session)
             self.start_new_chat() # Memulai dengan membersihkan UI
             try:
-                if os.path.exists(LOG_PATH): os.remove(LOG_PATH)
-                open(LOG_PATH, 'w').close()
-                self.history_list_widget.clear()
+                self.log_writer.flush() # Catatan yang masih antre ikut terhapus, bukan tertulis ke log baru
+                self.log_index.reset() # Menghapus segmen aktif, arsip dan tombstone
+                if self.semantic_index is not None: self.semantic_index.reset()
+                self.history_model.clear()
                 QMessageBox.information(self, "Sukses", "Semua riwayat percakapan telah dihapus.")
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Gagal menghapus file log: {e}")
-            self.current_conversation_id = datetime.now().strftime("%Y%m%d%H%M%S%f") # Pastikan ID baru
 
-    def load_initial_chat_history(self):
-        self.history_list_widget.clear()
-        conversations = {}
-        if not os.path.exists(LOG_PATH): return
+    def load_initial_chat_history_async(self):
+        STARTUP_TIMER.mark("window_shown")
+        if not os.path.exists(LOG_PATH) and not self.log_index.archived_segments(): return self.on_history_loaded(None)
+        self.compress_pending_segments() # Lanjutkan kompresi yang terputus saat aplikasi ditutup
+        call = BackgroundCall(self.log_index.ensure_fresh) # Pembaruan/pembangunan indeks berjalan di luar thread GUI
+        call.done.connect(self.on_history_loaded)
+        call.failed.connect(lambda e: QMessageBox.warning(self, "Load History Error", f"Gagal memuat riwayat: {e}"))
+        self.run_in_background(call)
+
+    def run_in_background(self, call):
+        self.background_calls.add(call) # Simpan referensi sampai selesai
+        call.done.connect(lambda *_: self.background_calls.discard(call))
+        call.failed.connect(lambda *_: self.background_calls.discard(call))
+        QThreadPool.globalInstance().start(_WorkerRunnable(call))
+
+    def on_history_loaded(self, _=None):
+        # Halaman pertama saja; halaman berikutnya diambil model saat sidebar digulir
+        self.history_model.reload(keep_ids={self.current_conversation_id})
+        STARTUP_TIMER.mark("history_loaded")
+        if self.semantic_index is not None: self.semantic_sync_timer.start()
+        if STARTUP_TIMING_REQUESTED: print(json.dumps({"startup_timing": STARTUP_TIMER.as_dict()}), file=sys.stderr)
 
-        try:
-            with open(LOG_PATH, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        log_entry = json.loads(line)
-                        conv_id = log_entry.get("conversation_id")
-                        if conv_id not in conversations: conversations[conv_id] = []
-                        conversations[conv_id].append(log_entry)
-                    except json.JSONDecodeError: continue
-        except IOError as e:
-            QMessageBox.warning(self, "Load History Error", f"Gagal memuat riwayat: {e}"); return
-        
-        sorted_conv_ids = sorted(conversations.keys(), key=lambda k: conversations[k][0].get('timestamp', '0'), reverse=True) # Urutkan dari terbaru
-
-        for conv_id in sorted_conv_ids:
-            first_msg = conversations[conv_id][0]
-            first_content = first_msg.get("content")
-            display_text = ""
-            if isinstance(first_content, list):
-                display_text = next((p.get("text", "") for p in first_content if p.get("type") == "text"), "[Gambar]")
-            else: display_text = first_content or ""
-            
-            ts_str = first_msg.get('timestamp', '1970-01-01 00:00:00')
-            try: ts = datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S').strftime('%d/%m %H:%M')
-            except ValueError: ts = "N/A"
-
-            list_item = QListWidgetItem(f"{ts} - {display_text[:30]}...")
-            list_item.setIcon(get_svg_icon(SVG_USER_ICON))
-            list_item.setData(Qt.ItemDataRole.UserRole, conv_id)
-            self.history_list_widget.addItem(list_item)
-        
     def load_conversation_from_history(self, item):
-        conv_id_to_load = item.data(Qt.ItemDataRole.UserRole)
+        self.open_conversation(item.data(Qt.ItemDataRole.UserRole))
+
+    # location: (segmen, offset) pesan yang dituju (dari hasil pencarian), transkrip digulir ke pesan tersebut
+    def open_conversation(self, conv_id_to_load, location=None):
         # --- OPTIMISASI: Jangan load ulang jika chat yang sama sudah aktif ---
-        if conv_id_to_load == self.current_conversation_id: return
-        
-        self.inputPrompt.clear() # Kosongkan input saat ganti chat
-        for i in reversed(range(self.chatLayout.count())):
-            widget = self.chatLayout.itemAt(i).widget()
-            if widget: widget.deleteLater()
+        if conv_id_to_load == self.current_conversation_id: return self.scroll_to_message(conv_id_to_load, location)
+        # Percakapan yang masih menunggu jawaban sudah punya sesi berisi transkrip yang sedang di-stream
+        if conv_id_to_load in self.sessions:
+            self.switch_to_session(self.sessions[conv_id_to_load]); return self.scroll_to_message(conv_id_to_load, location)
         
-        self.messages.clear()
-        self.current_conversation_id = conv_id_to_load
+        session = self.create_session(conv_id_to_load)
+        self.switch_to_session(session)
         
         try:
-            with open(LOG_PATH, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        log_entry = json.loads(line)
-                        if log_entry.get("conversation_id") == conv_id_to_load:
-                            self.addBubble(log_entry)
-                            
-                            # --- OPTIMISASI: Logika direvisi agar lebih jelas ---
-                            # Siapkan histori untuk API (selalu format teks sederhana)
-                            content = log_entry.get("content", "")
-                            role = log_entry.get("role")
-                            api_history_content = ""
-                            if isinstance(content, list):
-                                text_parts = [p.get("text", "") for p in content if p.get("type") == "text"]
-                                api_history_content = " ".join(text_parts)
-                                if any(p.get("type") in ["image_path", "image_url"] for p in content):
-                                    api_history_content += f" [{role} sent an image]"
-                            else:
-                                api_history_content = content or ""
-                            
-                            self.messages.append({"role": role, "content": api_history_content.strip()})
-                    except json.JSONDecodeError: continue
+            # Sesi latar belakang dilepas begitu jawabannya selesai; catatannya mungkin masih di antrean penulis log
+            self.log_writer.flush(5)
+            # --- OPTIMISASI: Baca langsung baris-baris percakapan ini lewat offset di indeks ---
+            log_entries = self.log_index.read_conversation(conv_id_to_load)
+            session.model.set_messages(log_entries) # Satu reset model, bukan satu widget per pesan
+            self.scroll_to_bottom()
+            for log_entry in log_entries:
+                # --- OPTIMISASI: Logika direvisi agar lebih jelas ---
+                # Siapkan histori untuk API (selalu format teks sederhana)
+                content = log_entry.get("content", "")
+                role = log_entry.get("role")
+                api_history_content = ""
+                if isinstance(content, list):
+                    text_parts = [p.get("text", "") for p in content if p.get("type") == "text"]
+                    api_history_content = " ".join(text_parts)
+                    if any(p.get("type") in ["image_path", "image_url"] for p in content):
+                        api_history_content += f" [{role} sent an image]"
+                else:
+                    api_history_content = content or ""
+                
+                session.messages.append({"role": role, "content": api_history_content.strip()})
+            self.scroll_to_message(conv_id_to_load, location)
         except Exception as e:
             QMessageBox.warning(self, "Load Conversation Error", f"Gagal memuat percakapan: {e}")
             
     def scroll_to_bottom(self):
-        QTimer.singleShot(50, lambda: self.scrollArea.verticalScrollBar().setValue(self.scrollArea.verticalScrollBar().maximum()))
-
-    def start_speech_recognition(self):
-        self.set_ui_enabled(False); self.inputPrompt.setText("Mendengarkan...")
-        self.speech_thread = QThread(); self.speech_worker = SpeechRecognitionWorker()
-        self.speech_worker.moveToThread(self.speech_thread)
-        self.speech_thread.started.connect(self.speech_worker.run)
-        self.speech_worker.finished.connect(self.handle_speech_result)
-        self.speech_worker.error.connect(self.handle_speech_error)
-        self.speech_worker.status_update.connect(self.update_speech_status)
-        self.speech_thread.start()
+        if not self.scroll_timer.isActive(): self.scroll_timer.start()
+
+    def scroll_to_message(self, conversation_id, location):
+        if location is None: return
+        row = self.log_index.message_position(conversation_id, location)
+        if row is None or row >= self.session.model.rowCount(): return
+        self.scroll_timer.stop() # Gulir-ke-bawah yang tertunda tidak boleh menimpa posisi ini
+        index = self.session.model.index(row)
+        # Ditunda satu putaran event agar layout transkrip yang baru di-reset sudah selesai
+        QTimer.singleShot(0, lambda: index.model() is self.transcript_view.model() and
+                          self.transcript_view.scrollTo(index, QAbstractItemView.ScrollHint.PositionAtCenter))
+
+    def mic_tooltip(self):
+        if self.speech_settings["mode"] == "continuous": return "Klik untuk mulai/berhenti dikte (teks ditambahkan ke prompt)."
+        return "Tahan untuk bicara, lepas untuk mengenali."
+
+    # --- OPTIMISASI: Tahan-untuk-bicara memakai perangkat yang sudah terbuka dan terkalibrasi ---
+    def on_mic_pressed(self):
+        if self.speech_settings["mode"] == "push_to_talk": self.speech_listener.begin_push_to_talk()
+
+    def on_mic_released(self):
+        if self.speech_settings["mode"] == "push_to_talk": self.speech_listener.end_push_to_talk(); return
+        active = not self.speech_listener.continuous.is_set()
+        self.speech_listener.set_continuous(active); self.update_mic_button(active)
+
+    def update_mic_button(self, active):
+        self.mic_button.setStyleSheet("background-color: #dc3545; color: white; border-radius: 5px;" if active else "")
+
+    def set_speech_mode(self, mode):
+        self.speech_listener.set_continuous(False); self.update_mic_button(False)
+        self.speech_settings["mode"] = self.speech_listener.settings["mode"] = mode
+        self.config.setdefault("speech", {})["mode"] = mode; save_config(CONFIG_PATH, self.config)
+        self.mic_button.setToolTip(self.mic_tooltip())
+
+    def set_speech_backend(self, backend):
+        self.speech_settings["backend"] = backend; self.speech_listener.set_backend(backend)
+        self.config.setdefault("speech", {})["backend"] = backend; save_config(CONFIG_PATH, self.config)
 
     def handle_speech_result(self, text):
-        self.inputPrompt.setText(text); self.loader.setText(""); self.set_ui_enabled(True)
-        if hasattr(self, 'speech_thread') and self.speech_thread.isRunning():
-            self.speech_thread.quit(); self.speech_thread.wait()
+        current = self.inputPrompt.text().strip()
+        self.inputPrompt.setText(f"{current} {text}" if current and not current.startswith("[Gambar") else text)
 
     def handle_speech_error(self, error_msg):
-        self.inputPrompt.setText(""); self.loader.setText(""); self.set_ui_enabled(True)
-        if hasattr(self, 'speech_thread') and self.speech_thread.isRunning():
-            self.speech_thread.quit(); self.speech_thread.wait()
-        QMessageBox.warning(self, "Pengenalan Suara", error_msg)
+        if not self.speech_listener.continuous.is_set(): self.update_mic_button(False)
+        if self.speech_settings["mode"] == "continuous": self.loader.setText(error_msg) # Tanpa dialog di tengah dikte
+        else: QMessageBox.warning(self, "Pengenalan Suara", error_msg)
     
-    def update_speech_status(self, status_text): self.loader.setText(status_text)
+    def update_speech_status(self, status_text): self.loader.setText(status_text or self.session.status_text)
         
     def open_log_search_dialog(self):
         keyword, ok = QInputDialog.getText(self, "Cari Log Chat", "Masukkan kata kunci:")
@@ -730,34 +3964,303 @@ class MacanAIChat(QMainWindow):
     def perform_log_search(self, keyword):
         if not os.path.exists(LOG_PATH):
             QMessageBox.information(self, "Cari Log", "File log chat belum ada."); return
-        results = []
-        try:
-            with open(LOG_PATH, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        log_entry = json.loads(line); text_content = ""
-                        content = log_entry.get("content", "")
-                        if isinstance(content, list):
-                            text_content = next((p.get("text", "") for p in content if p.get("type") == "text"), "")
-                        else: text_content = content or ""
-                        
-                        if keyword.lower() in text_content.lower():
-                            timestamp = log_entry.get("timestamp", "N/A"); sender = log_entry.get("role", "N/A").capitalize()
-                            conv_id_full = log_entry.get("conversation_id", "N/A")
-                            conv_id = conv_id_full[-6:] if len(conv_id_full) > 6 else conv_id_full
-                            results.append(f"<b>[{timestamp}] ({conv_id}) {sender}:</b> {text_content}<br>")
-                    except json.JSONDecodeError: continue
-        except Exception as e:
-            QMessageBox.critical(self, "Error Membaca Log", f"Gagal membaca file log JSONL: {e}"); return
-        if results:
-            results_text = "<h3>Hasil Pencarian:</h3>" + "".join(results)
+        # --- OPTIMISASI: Cari lewat indeks teks penuh (multi-kata, "frasa", awalan*), diurutkan berdasarkan relevansi ---
+        # Pencarian berjalan di thread latar dan hasilnya dimuat per halaman; dialog tidak modal dan bisa dibatalkan
+        dialog = SearchResultsDialog(self.log_index, keyword, self)
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.hit_activated.connect(self.open_conversation)
+        dialog.show()
+        return dialog
+
+    # --- OPTIMISASI: Indeks semantik dikejar di latar belakang; hanya catatan baru yang di-embed ---
+    def sync_semantic_index(self):
+        if self.semantic_sync_running: return self.semantic_sync_timer.start()
+        self.semantic_sync_running = True
+        call = BackgroundCall(self.semantic_index.sync, self.log_index)
+        call.done.connect(lambda _: setattr(self, "semantic_sync_running", False))
+        call.failed.connect(lambda e: (setattr(self, "semantic_sync_running", False), print(f"Gagal memperbarui indeks semantik: {e}", file=sys.stderr)))
+        self.run_in_background(call)
+
+    def open_semantic_search_dialog(self):
+        query, ok = QInputDialog.getText(self, "Cari Pesan Serupa", "Tulis pertanyaan atau topik:")
+        if ok and query.strip(): self.perform_semantic_search(query.strip())
+
+    def perform_semantic_search(self, query):
+        self.semantic_search_button.setEnabled(False); self.loader.setText("Mencari pesan serupa...")
+        def search():
+            self.log_writer.flush(5) # Pesan yang baru dikirim ikut dicari
+            self.semantic_index.sync(self.log_index)
+            return [hit for hit in self.semantic_index.search(query, SEMANTIC_RESULT_LIMIT) if hit[0] not in self.log_index.deleted]
+        call = BackgroundCall(search)
+        call.done.connect(lambda hits: self.show_semantic_results(query, hits))
+        call.failed.connect(lambda e: (self.show_semantic_results(query, None), QMessageBox.critical(self, "Cari Mirip", f"Gagal mencari: {e}")))
+        self.run_in_background(call)
+
+    def show_semantic_results(self, query, hits):
+        self.semantic_search_button.setEnabled(True)
+        if self.loader.text() == "Mencari pesan serupa...": self.set_session_status(self.session, self.session.status_text)
+        if hits is None: return
+        dialog = SemanticResultsDialog(query, hits, self)
+        if dialog.exec() and dialog.selected_conversation_id: self.open_conversation(dialog.selected_conversation_id)
+
+# === Mode Batch (Tanpa GUI) ===
+# --- OPTIMISASI: Menjalankan banyak prompt dari file JSONL secara paralel dengan batas laju per provider ---
+#   python macan_chat_ai.py --batch prompts.jsonl --output hasil.jsonl [--concurrency 4] [--rpm 60] [--tpm 100000]
+# Setiap baris input: {"id": "...", "prompt": "...", "provider"?, "model"?, "history"?: [{role, content}], "image_path"?, "conversation_id"?}
+# Output memakai format record macan_ai_chatlog.jsonl (pasangan user/assistant), ditambah field "batch" berisi status dan waktu.
+# Id yang sudah berstatus "ok" di file output dilewati, jadi run yang terputus bisa dilanjutkan dengan perintah yang sama.
+DEFAULT_BATCH_SETTINGS = {
+    "concurrency": 4,
+    "rpm": {"gemini": 60, "openai": 500}, # Permintaan per menit (0 = tanpa batas)
+    "tpm": {"gemini": 1000000, "openai": 200000}, # Token per menit, perkiraan (0 = tanpa batas)
+    "max_retries": 5,
+    "backoff_base_s": 1.0,
+    "backoff_max_s": 60.0
+}
+
+# rpm/tpm digabung per provider: {"rpm": {"openai": 60}} tidak membuat Gemini tanpa batas
+def merge_batch_settings(settings=None):
+    merged = json.loads(json.dumps(DEFAULT_BATCH_SETTINGS)) # Salinan dalam
+    for key, value in (settings or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict): merged[key].update(value)
+        else: merged[key] = value
+    return merged
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate); self.updated = now
+
+    # Detik yang harus ditunggu sebelum `amount` tersedia (0 jika sudah cukup)
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity) # Permintaan lebih besar dari kapasitas tetap bisa lewat saat bucket penuh
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount # Boleh negatif: pemakaian aktual yang melebihi perkiraan menunda permintaan berikutnya
+
+class RateLimiter:
+    def __init__(self, rpm=0, tpm=0):
+        self.lock = threading.Lock()
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, tokens, cancel_event=None):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now) if self.requests else 0.0,
+                           self.tokens.wait_time(tokens, now) if self.tokens else 0.0)
+                if wait <= 0:
+                    if self.requests: self.requests.take(1)
+                    if self.tokens: self.tokens.take(tokens)
+                    return True
+            if cancel_event is not None and cancel_event.wait(min(wait, 1.0)): return False
+            elif cancel_event is None: time.sleep(min(wait, 1.0))
+
+    # Koreksi setelah jawaban diterima: token keluaran ikut dihitung
+    def consume(self, tokens):
+        if self.tokens and tokens > 0:
+            with self.lock: self.tokens.take(tokens)
+
+def batch_error_status(e):
+    status = getattr(e, "status_code", None) or getattr(e, "code", None)
+    if callable(status): status = status() # Exception gRPC memakai method code()
+    status = getattr(status, "value", status)
+    if isinstance(status, tuple): status = status[0]
+    return status if isinstance(status, int) else None
+
+# 429 dan 5xx (termasuk kuota/overload dan putus koneksi) dicoba ulang; error lain (key salah, 400) tidak
+def is_retryable_error(e):
+    status = batch_error_status(e)
+    if status is not None: return status == 429 or 500 <= status < 600
+    name = type(e).__name__; text = str(e).lower()
+    return any(k in name for k in ("Timeout", "Connection", "RateLimit", "ResourceExhausted", "ServiceUnavailable", "InternalServerError")) \
+        or any(k in text for k in ("429", "rate limit", "resource has been exhausted", "overloaded", "503", "502", "500 internal", "timed out"))
+
+def retry_after_seconds(e):
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    try: return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError): return None
+
+class BatchRunner:
+    def __init__(self, config, output_path, settings=None, client_manager=None, log=None):
+        self.config = config
+        self.output_path = output_path
+        self.settings = merge_batch_settings(settings)
+        self.client_manager = client_manager or ApiClientManager()
+        self.token_counter = ContextWindowManager(config.get("context"))
+        self.image_preprocessor = ImagePreprocessor(IMAGE_CACHE_DIR, config.get("image"))
+        self.limiters = {p: RateLimiter(self.settings["rpm"].get(p, 0), self.settings["tpm"].get(p, 0)) for p in ("gemini", "openai")}
+        self.write_lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.log = log or (lambda message: print(message, file=sys.stderr))
+        self.stats = {"ok": 0, "error": 0, "skipped": 0}
+
+    @staticmethod
+    def read_jobs(input_path):
+        jobs = []
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip(): continue
+                job = json.loads(line)
+                if isinstance(job, str): job = {"prompt": job}
+                job.setdefault("id", f"line-{line_no}")
+                job["id"] = str(job["id"])
+                jobs.append(job)
+        return jobs
+
+    # Id yang sudah selesai dengan sukses pada run sebelumnya
+    def completed_ids(self):
+        done = set()
+        if not os.path.exists(self.output_path): return done
+        with open(self.output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try: batch = json.loads(line).get("batch")
+                except (json.JSONDecodeError, AttributeError): continue # Baris terakhir bisa terpotong saat proses dihentikan
+                if batch and batch.get("status") == "ok": done.add(batch.get("id"))
+        return done
+
+    # Baris gagal dari run sebelumnya untuk id yang akan dicoba lagi dibuang (juga baris terakhir yang terpotong),
+    # jadi setelah dilanjutkan setiap id hanya punya satu hasil di file keluaran
+    def drop_retried_errors(self, retry_ids):
+        if not retry_ids or not os.path.exists(self.output_path): return
+        tmp_path = self.output_path + ".tmp"
+        with open(self.output_path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+            for line in src:
+                try: batch = json.loads(line).get("batch") or {}
+                except (json.JSONDecodeError, AttributeError): continue
+                if batch.get("status") != "ok" and batch.get("id") in retry_ids: continue
+                dst.write(line if line.endswith("\n") else line + "\n")
+        os.replace(tmp_path, self.output_path)
+
+    def run(self, jobs):
+        done = self.completed_ids()
+        pending = [job for job in jobs if job["id"] not in done]
+        self.drop_retried_errors({job["id"] for job in pending})
+        self.stats["skipped"] = len(jobs) - len(pending)
+        if self.stats["skipped"]: self.log(f"[batch] {self.stats['skipped']} prompt sudah selesai sebelumnya, dilewati.")
+        total = len(pending)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(self.settings["concurrency"]))) as pool:
+            futures = [pool.submit(self.run_job, job) for job in pending]
+            try:
+                for finished, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                    job, status, detail = future.result()
+                    self.stats[status] += 1
+                    self.log(f"[batch] {finished}/{total} {status} {job['id']} {detail}")
+            except KeyboardInterrupt:
+                self.cancel_event.set() # Permintaan yang berjalan berhenti; yang sudah tertulis tetap tersimpan
+                for future in futures: future.cancel()
+                self.log("[batch] Dihentikan. Jalankan perintah yang sama untuk melanjutkan.")
+                raise
+        return self.stats
+
+    def run_job(self, job):
+        provider = job.get("provider") or self.config.get("active_api", "gemini")
+        provider_config = self.config.get(provider, {})
+        model_name = job.get("model") or provider_config.get("model")
+        history = job.get("history", [])
+        parts = [job.get("prompt", "")]
+        if job.get("image_path"): parts.append(ImagePart(job["image_path"], self.image_preprocessor))
+        prompt_tokens = self.token_counter.count_tokens(job.get("prompt", "")) + sum(self.token_counter.count_tokens(str(m.get("content", ""))) for m in history)
+        limiter = self.limiters.setdefault(provider, RateLimiter())
+        info = {"id": job["id"], "provider": provider, "model": model_name, "attempts": 0, "prompt_tokens": prompt_tokens}
+        started = time.monotonic(); reply = ""; error = None
+        while not self.cancel_event.is_set():
+            info["attempts"] += 1
+            if not limiter.acquire(prompt_tokens, self.cancel_event): break
+            attempt_start = time.monotonic(); first_token = None; chunks = []
+            try:
+                for text in self.stream(provider, provider_config, model_name, history, parts):
+                    if first_token is None: first_token = time.monotonic()
+                    if self.cancel_event.is_set(): break
+                    chunks.append(text)
+                else:
+                    reply = "".join(chunks); error = None
+                    info["ttft_ms"] = round(((first_token or time.monotonic()) - attempt_start) * 1000, 1)
+                    break
+                error = "dibatalkan"; break
+            except Exception as e:
+                error = str(e)
+                if not is_retryable_error(e) or info["attempts"] > int(self.settings["max_retries"]): break
+                delay = retry_after_seconds(e) or min(self.settings["backoff_max_s"], self.settings["backoff_base_s"] * 2 ** (info["attempts"] - 1))
+                delay *= 1 + random.random() * 0.25 # Jitter agar permintaan paralel tidak mencoba ulang bersamaan
+                self.log(f"[batch] {job['id']}: percobaan {info['attempts']} gagal ({error[:80]}), ulang dalam {delay:.1f} dtk")
+                if self.cancel_event.wait(delay): break
         else:
-            results_text = f"<p>Tidak ditemukan hasil untuk kata kunci '<b>{keyword}</b>'.</p>"
-        dialog = SearchResultsDialog(results_text, self)
-        dialog.exec()
+            error = error or "dibatalkan"
+        info["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        if error is None:
+            info["completion_tokens"] = self.token_counter.count_tokens(reply)
+            limiter.consume(info["completion_tokens"])
+        info["status"] = "ok" if error is None else "error"
+        if error is not None: info["error"] = error
+        if error != "dibatalkan": self.write_result(job, reply, info) # Yang dibatalkan diulang saat run dilanjutkan
+        return job, info["status"], f"({info['latency_ms'] / 1000:.1f} dtk)" if error is None else error[:120]
+
+    def stream(self, provider, provider_config, model_name, history, parts):
+        api_key = provider_config.get("api_key", "")
+        if provider == "gemini":
+            if not GEMINI_AVAILABLE: raise RuntimeError("Pustaka google-generativeai tidak terinstal.")
+            return stream_gemini(self.client_manager, api_key, model_name, provider_config.get("generation_config", {}), history, parts)
+        if provider == "openai":
+            if not OPENAI_AVAILABLE: raise RuntimeError("Pustaka openai tidak terinstal.")
+            return stream_openai(self.client_manager, api_key, model_name, history, parts)
+        raise ValueError(f"Provider tidak dikenal: {provider}")
+
+    def write_result(self, job, reply, info):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conversation_id = job.get("conversation_id") or f"batch-{job['id']}"
+        user_content = [{"type": "text", "text": job.get("prompt", "")}]
+        if job.get("image_path"): user_content.append({"type": "image_path", "image_path": job["image_path"]})
+        records = [{"role": "user", "content": user_content, "conversation_id": conversation_id, "timestamp": timestamp},
+                   {"role": "assistant", "content": reply, "conversation_id": conversation_id, "timestamp": timestamp, "batch": info}]
+        data = "".join(json.dumps(record) + "\n" for record in records)
+        with self.write_lock: # Pasangan ditulis utuh dalam satu write agar output tetap valid saat dihentikan
+            with open(self.output_path, 'a', encoding='utf-8') as f: f.write(data)
+
+def run_batch(argv):
+    parser = argparse.ArgumentParser(description="Jalankan prompt dari file JSONL tanpa GUI.")
+    parser.add_argument("--batch", required=True, metavar="INPUT_JSONL")
+    parser.add_argument("--output", required=True, metavar="OUTPUT_JSONL")
+    parser.add_argument("--provider", choices=("gemini", "openai"), help="Provider default (bawaan: active_api di konfigurasi)")
+    parser.add_argument("--model", help="Model default untuk provider tersebut")
+    parser.add_argument("--concurrency", type=int)
+    parser.add_argument("--rpm", type=float, help="Batas permintaan/menit untuk provider default")
+    parser.add_argument("--tpm", type=float, help="Batas token/menit untuk provider default")
+    parser.add_argument("--max-retries", type=int)
+    args = parser.parse_args(argv)
+
+    config = load_config(CONFIG_PATH)
+    settings = merge_batch_settings(config.get("batch"))
+    if args.provider: config["active_api"] = args.provider
+    provider = config.get("active_api", "gemini")
+    if args.model: config.setdefault(provider, {})["model"] = args.model
+    if args.concurrency: settings["concurrency"] = args.concurrency
+    if args.rpm is not None: settings["rpm"][provider] = args.rpm
+    if args.tpm is not None: settings["tpm"][provider] = args.tpm
+    if args.max_retries is not None: settings["max_retries"] = args.max_retries
+
+    runner = BatchRunner(config, args.output, settings)
+    try:
+        stats = runner.run(BatchRunner.read_jobs(args.batch))
+    except KeyboardInterrupt:
+        return 130
+    print(json.dumps({"batch": stats}), file=sys.stderr)
+    return 0 if stats["error"] == 0 else 1
 
 # === Entrypoint ===
+STARTUP_TIMING_REQUESTED = "--startup-timing" in sys.argv or bool(os.environ.get("MACAN_STARTUP_TIMING"))
+
 if __name__ == '__main__':
+    if "--batch" in sys.argv: sys.exit(run_batch(sys.argv[1:]))
+    STARTUP_TIMER.mark("import_app")
     app = QApplication(sys.argv)
     chat_app = MacanAIChat()
     chat_app.show()